@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import tempfile
+
+from file_lock import file_lock
+
+# --- Configuración ---
+ANALYSIS_CACHE_DIR = '.analysis_cache'           # Carpeta del caché persistente
+ANALYSIS_CACHE_MAX_BYTES = 200 * 1024 * 1024     # Tamaño máximo total antes de expulsar (LRU)
+HASH_CHUNK_BYTES = 4 * 1024 * 1024               # Bloque de lectura para el hash del video
+STATS_FILENAME = '_stats.json'
+# --- Fin Configuración ---
+
+_hash_memo = {} # (ruta, tamaño, mtime) -> hash: evita releer el mismo video en una ejecución
+
+
+def compute_file_hash(file_path: str, chunk_size: int = HASH_CHUNK_BYTES) -> str:
+    """
+    Calcula el SHA-256 del contenido de un archivo leyéndolo por bloques.
+    El resultado se recuerda mientras el archivo no cambie (tamaño y fecha de modificación).
+
+    Args:
+        file_path: Ruta al archivo.
+        chunk_size: Tamaño de cada bloque de lectura.
+
+    Returns:
+        El hash hexadecimal del contenido.
+    """
+    st = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    _hash_memo[memo_key] = hasher.hexdigest()
+    return _hash_memo[memo_key]
+
+def build_cache_key(video_hash: str, prompt: str, model_name: str, generation_config: dict, extra: dict = None) -> str:
+    """
+    Construye la clave del caché a partir de todo lo que determina la respuesta del modelo.
+
+    Args:
+        video_hash: Hash del contenido del video original.
+        prompt: Texto completo del prompt.
+        model_name: Nombre del modelo.
+        generation_config: Configuración de generación usada en la llamada.
+        extra: Parámetros adicionales que alteran la entrada (ej: ancho de redimensionamiento).
+
+    Returns:
+        La clave hexadecimal (SHA-256).
+    """
+    key_material = {
+        "video_sha256": video_hash,
+        "prompt_sha256": hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+        "model_name": model_name,
+        "generation_config": generation_config,
+        "extra": extra or {},
+    }
+    serialized = json.dumps(key_material, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+def _entry_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"{key}.json")
+
+def _update_stats(cache_dir: str, field: str):
+    """
+    Incrementa un contador de estadísticas persistido en el directorio del caché.
+    El lock de archivo serializa la lectura-modificación-escritura entre hilos y entre procesos.
+    """
+    stats_path = os.path.join(cache_dir, STATS_FILENAME)
+    with file_lock(stats_path):
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        try:
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                stats.update(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        stats[field] = stats.get(field, 0) + 1
+        _atomic_write_json(stats_path, stats)
+
+def _atomic_write_json(path: str, data):
+    """Escribe JSON en un archivo temporal del mismo directorio y lo reemplaza atómicamente."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def cache_get(key: str, cache_dir: str = ANALYSIS_CACHE_DIR):
+    """
+    Busca un resultado de análisis en el caché.
+
+    Un acierto actualiza la fecha de modificación de la entrada (orden LRU).
+
+    Returns:
+        El diccionario de análisis cacheado, o None si no existe o es inválido.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_path = _entry_path(cache_dir, key)
+    try:
+        with open(entry_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        os.utime(entry_path, None)
+    except FileNotFoundError:
+        _update_stats(cache_dir, "misses")
+        return None
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[Cache] Advertencia: Entrada de caché inválida '{entry_path}' ({e}). Se descartará.")
+        try:
+            os.unlink(entry_path)
+        except OSError:
+            pass
+        _update_stats(cache_dir, "misses")
+        return None
+    _update_stats(cache_dir, "hits")
+    return data
+
+def cache_put(key: str, data: dict, cache_dir: str = ANALYSIS_CACHE_DIR, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES):
+    """
+    Guarda un resultado de análisis en el caché y expulsa las entradas menos usadas si se excede el tamaño.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    _atomic_write_json(_entry_path(cache_dir, key), data)
+    evict_lru(cache_dir, max_bytes, keep_key=key)
+
+def _list_entries(cache_dir: str) -> list:
+    """Devuelve [(ruta, tamaño, mtime)] de las entradas del caché."""
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.json') or filename == STATS_FILENAME:
+            continue
+        path = os.path.join(cache_dir, filename)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue # Eliminada por otro proceso
+        entries.append((path, st.st_size, st.st_mtime))
+    return entries
+
+def evict_lru(cache_dir: str = ANALYSIS_CACHE_DIR, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES, keep_key: str = None) -> int:
+    """
+    Elimina las entradas menos recientemente usadas hasta que el caché quepa en `max_bytes`.
+
+    Returns:
+        Número de entradas eliminadas.
+    """
+    entries = _list_entries(cache_dir)
+    total_bytes = sum(size for _, size, _ in entries)
+    keep_path = _entry_path(cache_dir, keep_key) if keep_key else None
+    evicted = 0
+    for path, size, _ in sorted(entries, key=lambda e: e[2]):
+        if total_bytes <= max_bytes:
+            break
+        if path == keep_path:
+            continue
+        try:
+            os.unlink(path)
+            total_bytes -= size
+            evicted += 1
+            _update_stats(cache_dir, "evictions")
+        except FileNotFoundError:
+            pass
+    if evicted:
+        print(f"[Cache] {evicted} entradas expulsadas (LRU). Tamaño actual: {total_bytes / (1024 * 1024):.1f} MiB.")
+    return evicted
+
+def get_cache_stats(cache_dir: str = ANALYSIS_CACHE_DIR) -> dict:
+    """
+    Devuelve estadísticas del caché: aciertos, fallos, expulsiones, tasa de aciertos, entradas y bytes.
+    """
+    stats = {"hits": 0, "misses": 0, "evictions": 0}
+    if not os.path.isdir(cache_dir):
+        return {**stats, "hit_rate": 0.0, "entries": 0, "bytes": 0}
+    try:
+        with open(os.path.join(cache_dir, STATS_FILENAME), 'r', encoding='utf-8') as f:
+            stats.update(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    entries = _list_entries(cache_dir)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = len(entries)
+    stats["bytes"] = sum(size for _, size, _ in entries)
+    return stats
+
+
+# --- Bloque de Ejecución Principal ---
+if __name__ == "__main__":
+    print(json.dumps(get_cache_stats(), indent=2))
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from video_analyzer import analyze_video_steps
+
+# --- Configuración del Cliente Concurrente ---
+ASYNC_MAX_CONCURRENCY = 4            # Llamadas simultáneas máximas al modelo (todas las ejecuciones)
+RATE_LIMIT_REQUESTS_PER_MIN = 60     # Ajustar a la cuota del proyecto (solicitudes por minuto)
+RATE_LIMIT_BURST = 5                 # Solicitudes que pueden salir de golpe tras un periodo inactivo
+RETRY_MAX_ATTEMPTS = 5               # Intentos totales por solicitud (1 = sin reintentos)
+RETRY_BASE_DELAY_SEC = 2.0           # Espera base del backoff exponencial
+RETRY_MAX_DELAY_SEC = 60.0           # Espera máxima entre intentos
+REQUEST_DEADLINE_SEC = 900           # Tiempo máximo por intento antes de abandonarlo
+# --- Fin Configuración ---
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                         "DeadlineExceeded", "GatewayTimeout", "Aborted")
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Indica si un error de la API es transitorio (cuota, 5xx, red) y vale la pena reintentar.
+
+    Se evalúa por código HTTP y nombre de clase para no depender de importar `google.api_core`.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+def backoff_delay(attempt: int, base_delay_sec: float = RETRY_BASE_DELAY_SEC,
+                  max_delay_sec: float = RETRY_MAX_DELAY_SEC) -> float:
+    """Espera antes del reintento `attempt` (1, 2, ...): backoff exponencial con jitter completo."""
+    return random.uniform(0, min(max_delay_sec, base_delay_sec * (2 ** (attempt - 1))))
+
+
+class TokenBucket:
+    """Limitador de tasa: cada solicitud consume un token; los tokens se reponen a `rate_per_sec`."""
+
+    def __init__(self, rate_per_sec: float, capacity: int):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Espera hasta que haya un token disponible y lo consume."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_sec)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate_per_sec)
+
+
+class AsyncModelClient:
+    """
+    Capa de solicitudes al modelo para ejecuciones concurrentes.
+
+    Toda llamada pasa por un semáforo global (concurrencia) y un token bucket (tasa),
+    se reintenta con backoff exponencial y jitter ante errores transitorios y se abandona
+    si supera el plazo por intento. Las llamadas de los backends son bloqueantes, así que
+    se ejecutan en un pool de hilos propio de `max_concurrency` hilos (no en el ejecutor por
+    defecto del bucle, que ocupan los pipelines que esperan estas llamadas). Un intento
+    abandonado por plazo sigue ejecutándose en su hilo y retiene su lugar del semáforo hasta
+    que termina, así el límite de concurrencia se cumple también con intentos abandonados.
+    """
+
+    def __init__(self, max_concurrency: int = ASYNC_MAX_CONCURRENCY,
+                 requests_per_minute: float = RATE_LIMIT_REQUESTS_PER_MIN, burst: int = RATE_LIMIT_BURST,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS, deadline_sec: float = REQUEST_DEADLINE_SEC):
+        self.max_attempts = max(1, max_attempts)
+        self.deadline_sec = deadline_sec
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="model-call")
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.stats = {"calls": 0, "retries": 0, "timeouts": 0, "failures": 0}
+
+    async def call(self, func, *args, deadline_sec: float = None):
+        """
+        Ejecuta `func(*args)` (bloqueante) respetando los límites, con reintentos y plazo.
+
+        Returns:
+            El resultado de `func`. Si se agotan los intentos, o el error no es transitorio,
+            se relanza la última excepción.
+        """
+        deadline_sec = deadline_sec or self.deadline_sec
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, self.max_attempts + 1):
+            await self._semaphore.acquire()
+            future = None
+            try:
+                await self._bucket.acquire()
+                self.stats["calls"] += 1
+                future = loop.run_in_executor(self._executor, func, *args)
+                return await asyncio.wait_for(asyncio.shield(future), timeout=deadline_sec)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                last_error = TimeoutError(f"La solicitud superó el plazo de {deadline_sec}s.")
+            except Exception as e:
+                if not is_retryable_error(e):
+                    self.stats["failures"] += 1
+                    raise
+                last_error = e
+            finally:
+                if future is None or future.done():
+                    self._semaphore.release()
+                else: # El hilo sigue ocupado: el lugar se libera cuando termine
+                    future.add_done_callback(self._release_abandoned)
+            if attempt == self.max_attempts:
+                break
+            delay = backoff_delay(attempt)
+            self.stats["retries"] += 1
+            print(f"[AsyncClient] Error transitorio ({last_error}). Reintento {attempt}/{self.max_attempts - 1} en {delay:.1f}s...")
+            await asyncio.sleep(delay)
+        self.stats["failures"] += 1
+        raise last_error
+
+    def _release_abandoned(self, future):
+        self._semaphore.release()
+        if not future.cancelled():
+            future.exception() # Marca el error del intento abandonado como recuperado (sin aviso en el log)
+
+    def threadsafe_runner(self, loop: asyncio.AbstractEventLoop):
+        """
+        Devuelve un ejecutor síncrono `runner(func)` para código que corre en hilos de trabajo
+        (ej: `analyze_video_steps(request_runner=...)`): envía la llamada al bucle `loop` y espera
+        su resultado, de modo que los límites globales se aplican también a esos hilos.
+
+        No usar desde el hilo del propio bucle (se bloquearía).
+        """
+        def runner(func, *args):
+            return asyncio.run_coroutine_threadsafe(self.call(func, *args), loop).result()
+        return runner
+
+
+_shared_clients = weakref.WeakKeyDictionary()
+
+def get_shared_client() -> AsyncModelClient:
+    """Devuelve el cliente compartido del bucle de eventos actual (límites globales por proceso)."""
+    loop = asyncio.get_running_loop()
+    client = _shared_clients.get(loop)
+    if client is None:
+        client = AsyncModelClient()
+        _shared_clients[loop] = client
+    return client
+
+async def analyze_video_steps_async(project_id: str, location: str, model_name: str, video_path: str,
+                                    client: AsyncModelClient = None, **kwargs):
+    """
+    Versión asíncrona de `analyze_video_steps` que pasa por el cliente compartido.
+
+    Returns:
+        Una tupla (datos, error), igual que `analyze_video_steps`.
+    """
+    client = client or get_shared_client()
+    runner = client.threadsafe_runner(asyncio.get_running_loop())
+    return await asyncio.to_thread(analyze_video_steps, project_id, location, model_name, video_path,
+                                   request_runner=runner, **kwargs)
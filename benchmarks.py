@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks de rendimiento del pipeline PDD.
+
+Uso:
+    python benchmarks.py payload-memory --size-gb 2
+    python benchmarks.py resize --frames 120 --width 3840 --height 2160
+    python benchmarks.py screenshots --frames 900 --steps 100 --workers 4
+    python benchmarks.py encoding --frames 60 --profiles png jpeg webp
+    python benchmarks.py steps-table --sizes 250 500 1000 2000 --legacy
+    python benchmarks.py docx-template --documents 50
+    python benchmarks.py docx-stream --steps 1000
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import tracemalloc
+
+MIB = 1024 * 1024
+
+
+# --- Utilidades Comunes ---
+def create_sparse_file(path: str, size_bytes: int):
+    """Crea un archivo disperso del tamaño indicado (no ocupa disco real en la mayoría de FS)."""
+    with open(path, "wb") as f:
+        f.truncate(size_bytes)
+
+def measure_peak_memory(func, *args, **kwargs):
+    """
+    Ejecuta `func` midiendo la memoria pico asignada por Python (tracemalloc).
+
+    Returns:
+        Una tupla (resultado, peak_bytes, segundos).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, peak, elapsed
+
+def print_row(label: str, file_size: int, peak: int, elapsed: float):
+    ratio = peak / file_size if file_size else 0.0
+    print(f"  {label:<38} archivo={file_size / MIB:>9.1f} MiB  pico={peak / MIB:>8.1f} MiB  "
+          f"pico/archivo={ratio:>6.3f}x  t={elapsed:>7.2f}s")
+
+
+# --- Benchmark: Memoria del Payload de Video ---
+def bench_payload_memory(args) -> bool:
+    """
+    Verifica que la construcción del payload de video tiene memoria pico acotada.
+
+    - Lectura en streaming (ruta usada para la subida por referencia) sobre un archivo de `--size-gb`.
+    - Decisión inline/referencia sobre el archivo grande con bucket (no debe leerlo en memoria).
+    - Sin bucket (configuración por defecto), el archivo grande se rechaza sin leerlo en memoria.
+    - Payload inline de un archivo en el límite `INLINE_VIDEO_MAX_BYTES`.
+    - (Opcional, --legacy) el método anterior read()+b64encode sobre ese mismo archivo.
+    """
+    import model_backends
+    from vertexai.preview.generative_models import Part # Precargar: no medir la importación del SDK
+
+    size_bytes = int(args.size_gb * 1024 * MIB)
+    inline_bytes = model_backends.INLINE_VIDEO_MAX_BYTES
+    chunk_bytes = model_backends.VIDEO_READ_CHUNK_BYTES
+    # Cota esperada: bytes leídos + copia interna del Part para el límite inline, más dos bloques
+    memory_cap = int(inline_bytes * 2 + 2 * chunk_bytes)
+    print(f"--- Benchmark: memoria del payload de video (cota esperada {memory_cap / MIB:.1f} MiB) ---")
+
+    all_ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        big_path = os.path.join(tmp_dir, "big_video.mp4")
+        create_sparse_file(big_path, size_bytes)
+
+        def stream_digest(path):
+            hasher = hashlib.sha256()
+            for chunk in model_backends.iter_file_chunks(path):
+                hasher.update(chunk)
+            return hasher.hexdigest()
+
+        _, peak, elapsed = measure_peak_memory(stream_digest, big_path)
+        print_row("lectura en streaming (referencia)", size_bytes, peak, elapsed)
+        all_ok &= peak <= memory_cap
+
+        # Con bucket configurado, un video mayor al límite va por referencia sin leerlo en memoria.
+        # La subida se sustituye por una lectura en streaming para no depender de la red.
+        def streaming_upload(path, bucket_name, **kwargs):
+            stream_digest(path)
+            return f"gs://{bucket_name}/{os.path.basename(path)}"
+
+        original_bucket = model_backends.VIDEO_UPLOAD_GCS_BUCKET
+        original_upload = model_backends.upload_video_to_gcs
+        model_backends.VIDEO_UPLOAD_GCS_BUCKET = "benchmark-bucket"
+        model_backends.upload_video_to_gcs = streaming_upload
+        try:
+            (_, error), peak, elapsed = measure_peak_memory(model_backends.build_video_part, big_path)
+        finally:
+            model_backends.VIDEO_UPLOAD_GCS_BUCKET = original_bucket
+            model_backends.upload_video_to_gcs = original_upload
+        print_row("build_video_part (> límite, referencia)", size_bytes, peak, elapsed)
+        all_ok &= peak <= memory_cap and error is None
+
+        # Configuración por defecto (sin bucket): el video grande se rechaza sin leerlo en memoria
+        model_backends.VIDEO_UPLOAD_GCS_BUCKET = None
+        try:
+            (part, error), peak, elapsed = measure_peak_memory(model_backends.build_video_part, big_path)
+        finally:
+            model_backends.VIDEO_UPLOAD_GCS_BUCKET = original_bucket
+        print_row("build_video_part (> límite, sin bucket)", size_bytes, peak, elapsed)
+        all_ok &= peak <= memory_cap and part is None and error is not None
+
+        inline_path = os.path.join(tmp_dir, "inline_video.mp4")
+        create_sparse_file(inline_path, inline_bytes)
+        (_, error), peak, elapsed = measure_peak_memory(model_backends.build_video_part, inline_path)
+        print_row("build_video_part (inline)", inline_bytes, peak, elapsed)
+        all_ok &= peak <= memory_cap and error is None
+
+        if args.legacy:
+            import base64
+
+            def legacy_encode(path):
+                with open(path, "rb") as f:
+                    video_bytes = f.read()
+                encoded_content = base64.b64encode(video_bytes).decode("utf-8")
+                return Part.from_data(data=encoded_content, mime_type="video/mp4")
+
+            _, peak, elapsed = measure_peak_memory(legacy_encode, inline_path)
+            print_row("método anterior read()+b64encode", inline_bytes, peak, elapsed)
+
+    print(f"Resultado: {'OK' if all_ok else 'FALLO'} (memoria pico {'dentro' if all_ok else 'fuera'} de la cota)")
+    return all_ok
+
+
+# --- Benchmark: Redimensionamiento (serial vs. por etapas) ---
+def create_synthetic_video(path: str, frames: int, width: int, height: int, fps: float = 30.0):
+    """Genera una grabación de pantalla sintética (fondo fijo con texto y un bloque en movimiento)."""
+    import cv2
+    import numpy as np
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    background = np.full((height, width, 3), 235, dtype=np.uint8)
+    for row in range(0, height, 40):
+        cv2.putText(background, f"Fila {row // 40}: dato de ejemplo", (20, row + 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (40, 40, 40), 2)
+    for i in range(frames):
+        frame = background.copy()
+        x = (i * 37) % max(1, width - 200)
+        cv2.rectangle(frame, (x, height // 3), (x + 200, height // 3 + 120), (30, 90, 200), -1)
+        writer.write(frame)
+    writer.release()
+
+def legacy_resize_loop(input_path: str, output_path: str, target_width: int) -> int:
+    """Bucle serial anterior de `resize_video` (decodificar, redimensionar y escribir cada fotograma)."""
+    import cv2
+    cap = cv2.VideoCapture(input_path)
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    new_size = (target_width, int(target_width * height / width))
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), cap.get(cv2.CAP_PROP_FPS), new_size)
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        writer.write(cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA))
+        frame_count += 1
+    cap.release()
+    writer.release()
+    return frame_count
+
+def bench_resize(args) -> bool:
+    """
+    Compara el bucle serial anterior con la transcodificación por etapas (`video_proxy.transcode_video`)
+    sobre un video sintético: fotogramas por segundo y memoria pico.
+    """
+    import video_proxy
+
+    print(f"--- Benchmark: redimensionamiento {args.width}x{args.height} -> ancho {args.target_width} "
+          f"({args.frames} fotogramas, {video_proxy.RESIZE_WORKERS} workers) ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_path = os.path.join(tmp_dir, "source.mp4")
+        create_synthetic_video(source_path, args.frames, args.width, args.height)
+
+        frames, peak, elapsed = measure_peak_memory(legacy_resize_loop, source_path,
+                                                    os.path.join(tmp_dir, "serial.mp4"), args.target_width)
+        serial_fps = frames / elapsed if elapsed else 0.0
+        print(f"  {'serial (anterior)':<20} fps={serial_fps:>8.1f}  pico={peak / MIB:>8.1f} MiB  t={elapsed:>6.2f}s")
+
+        stats, peak, elapsed = measure_peak_memory(video_proxy.transcode_video, source_path,
+                                                   os.path.join(tmp_dir, "pipelined.mp4"), args.target_width)
+        if stats is None:
+            print("Resultado: FALLO (la transcodificación por etapas no produjo salida)")
+            return False
+        print(f"  {'por etapas':<20} fps={stats['fps']:>8.1f}  pico={peak / MIB:>8.1f} MiB  t={elapsed:>6.2f}s  "
+              f"(en vuelo máx. {stats['peak_inflight_frames']} fotogramas)")
+
+    ok = stats["frames_out"] == frames
+    print(f"Resultado: {'OK' if ok else 'FALLO'} (aceleración {stats['fps'] / serial_fps if serial_fps else 0:.2f}x)")
+    return ok
+
+
+# --- Benchmark: Extracción de Screenshots (por modo) ---
+def bench_screenshots(args) -> bool:
+    """
+    Extrae los screenshots de `--steps` pasos repartidos por un video sintético con cada modo de
+    `extraer_screenshots` y verifica que todos los modos produzcan imágenes idénticas (con el mejor
+    fotograma y BEST_FRAME_SEEK_ADJACENT, 'seek' evalúa otros candidatos y solo se compara consigo mismo).
+    """
+    import json
+    import random
+    import contextlib
+    import io
+    import cv2
+    import numpy as np
+    import extraer_screenshots
+    from screenshot_store import resolve_step_screenshots
+
+    extraer_screenshots.EXTRACTION_WORKERS = args.workers
+    extraer_screenshots.BEST_FRAME_ENABLED = not args.no_best_frame
+    print(f"--- Benchmark: screenshots de {args.steps} pasos en {args.frames} fotogramas {args.width}x{args.height} "
+          f"({args.workers} procesos en modo 'parallel', mejor fotograma: {'no' if args.no_best_frame else 'sí'}) ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, "source.mp4")
+        create_synthetic_video(video_path, args.frames, args.width, args.height)
+        duration_ms = int(args.frames / 30.0 * 1000)
+        rng = random.Random(0)
+        steps = [{"step_number": i + 1, "timestamp_ms": rng.randrange(duration_ms)} for i in range(args.steps)]
+        json_path = os.path.join(tmp_dir, "steps.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"section_3_3_detailed_steps": steps}, f)
+
+        outputs = {}
+        for mode in args.modes:
+            output_dir = os.path.join(tmp_dir, mode)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # Los mensajes por paso distorsionan la medición
+                ok = extraer_screenshots.extract_screenshots(json_path, video_path, output_dir, mode=mode)
+            elapsed = time.perf_counter() - start
+            outputs[mode] = output_dir
+            print(f"  {mode:<10} t={elapsed:>6.2f}s  pasos/s={args.steps / elapsed if elapsed else 0:>8.1f}  {'OK' if ok else 'FALLO'}")
+
+        # Re-ejecución sobre la misma carpeta: todos los fotogramas figuran ya en el manifiesto
+        reference = args.modes[0]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            extraer_screenshots.extract_screenshots(json_path, video_path, outputs[reference], mode=reference)
+        print(f"  {'re-ejec.':<10} t={time.perf_counter() - start:>6.2f}s  (modo '{reference}', screenshots reutilizados)")
+
+        identical = True
+        reference_paths = resolve_step_screenshots(outputs[reference])
+        narrow_seek = extraer_screenshots.BEST_FRAME_ENABLED and extraer_screenshots.BEST_FRAME_SEEK_ADJACENT
+        for mode in args.modes[1:]:
+            if narrow_seek and (mode == "seek") != (reference == "seek"):
+                print(f"  ({mode} no se compara con {reference}: candidatos distintos)")
+                continue
+            mode_paths = resolve_step_screenshots(outputs[mode])
+            for step in steps:
+                name = str(step['step_number'])
+                a = cv2.imread(reference_paths.get(name, ""))
+                b = cv2.imread(mode_paths.get(name, ""))
+                if a is None or b is None or not np.array_equal(a, b):
+                    print(f"  Diferencia en el paso {name} ({reference} vs. {mode})")
+                    identical = False
+                    break
+    print(f"Resultado: {'OK' if identical else 'FALLO'} (imágenes idénticas entre modos: {identical})")
+    return identical
+
+
+# --- Benchmark: Perfiles de Codificación de Screenshots ---
+def bench_encoding(args) -> bool:
+    """
+    Codifica `--frames` fotogramas de un video sintético con cada perfil de `screenshot_encoding`
+    (pool de `--workers` hilos) y reporta bytes por screenshot, tiempo de codificación y tiempo total,
+    frente al `cv2.imwrite` serial anterior.
+    """
+    import io
+    import contextlib
+    import cv2
+    from screenshot_encoding import ScreenshotEncoder, SCREENSHOT_PROFILES
+
+    print(f"--- Benchmark: codificación de {args.frames} screenshots {args.width}x{args.height} "
+          f"({args.workers} hilos por perfil) ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, "source.mp4")
+        create_synthetic_video(video_path, args.frames, args.width, args.height)
+        cap = cv2.VideoCapture(video_path)
+        frames = []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+
+        legacy_dir = os.path.join(tmp_dir, "legacy")
+        os.makedirs(legacy_dir)
+        start = time.perf_counter()
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(legacy_dir, f"screenshot_paso_{i + 1}.png"), frame)
+        elapsed = time.perf_counter() - start
+        legacy_bytes = sum(os.path.getsize(os.path.join(legacy_dir, name)) for name in os.listdir(legacy_dir))
+        print(f"  {'imwrite (serial)':<18} {legacy_bytes / len(frames) / 1024:>9.1f} KiB/screenshot  "
+              f"codif.={elapsed / len(frames) * 1000:>7.1f} ms/screenshot  total={elapsed:>6.2f}s")
+
+        ok = True
+        for profile_name in args.profiles:
+            if profile_name not in SCREENSHOT_PROFILES:
+                print(f"  Perfil desconocido '{profile_name}'.")
+                ok = False
+                continue
+            profile_dir = os.path.join(tmp_dir, profile_name)
+            os.makedirs(profile_dir)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                with ScreenshotEncoder(profile_name, workers=args.workers) as encoder:
+                    for i, frame in enumerate(frames):
+                        encoder.submit(frame, os.path.join(profile_dir, f"{i:08d}{encoder.extension}"))
+                    results = encoder.drain()
+            elapsed = time.perf_counter() - start
+            stats = encoder.stats
+            ok = ok and all(result for _, result in results)
+            docx_note = "" if encoder.profile["format"] != "webp" else "  (no incrustable en DOCX)"
+            print(f"  {profile_name:<18} {stats['bytes'] / max(1, stats['count']) / 1024:>9.1f} KiB/screenshot  "
+                  f"codif.={stats['encode_sec'] / max(1, stats['count']) * 1000:>7.1f} ms/screenshot  "
+                  f"total={elapsed:>6.2f}s{docx_note}")
+    print(f"Resultado: {'OK' if ok else 'FALLO'}")
+    return ok
+
+
+# --- Benchmark: Tabla de Pasos del DOCX ---
+def bench_steps_table(args) -> bool:
+    """
+    Construye la tabla de pasos (con un screenshot distinto por paso) para cada tamaño de `--sizes`
+    con la vía en bloque de `generar_docx_pdd` (y opcionalmente la vía celda por celda) y muestra
+    el tiempo por paso: con escalado lineal se mantiene constante al crecer el número de pasos.
+    """
+    import io
+    import contextlib
+    import cv2
+    import numpy as np
+    from docx import Document
+    import generar_docx_pdd
+
+    print(f"--- Benchmark: tabla de pasos del DOCX ({', '.join(str(n) for n in args.sizes)} pasos) ---")
+    max_steps = max(args.sizes)
+    step_images = {}
+    for i in range(max_steps):
+        image = np.full((90, 160, 3), 235, dtype=np.uint8)
+        cv2.putText(image, str(i + 1), (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (40, 40, 40), 2)
+        ok, buffer = cv2.imencode(".png", image)
+        step_images[i + 1] = {"data": buffer.tobytes(), "width": 160, "height": 90, "format": "png"}
+    steps = [{"step_number": i + 1, "application_in_focus": "Aplicación", "description": f"Acción {i + 1} & detalle",
+              "action_type_inferred": "Descripción del paso"} for i in range(max_steps)]
+
+    variants = [("bloque", True)] + ([("celda a celda", False)] if args.legacy else [])
+    ok = True
+    for label, bulk in variants:
+        generar_docx_pdd.STEPS_TABLE_BULK = bulk
+        per_step = []
+        for size in args.sizes:
+            document = Document()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                inserted = generar_docx_pdd.add_detailed_steps_table(document, steps[:size], tempfile.gettempdir(), step_images)
+            elapsed = time.perf_counter() - start
+            per_step.append(elapsed / size)
+            ok = ok and inserted == size and len(document.tables[0].rows) == size + 1
+            print(f"  {label:<14} pasos={size:>5}  t={elapsed:>7.2f}s  {elapsed / size * 1000:>6.2f} ms/paso")
+        print(f"  {label:<14} ms/paso (mayor/menor tamaño): {per_step[-1] / per_step[0]:.2f}x")
+    print(f"Resultado: {'OK' if ok else 'FALLO'}")
+    return ok
+
+
+# --- Benchmark: Plantilla DOCX ---
+def bench_docx_template(args) -> bool:
+    """
+    Tiempo de CPU por documento de `build_pdd_document` reconstruyendo el esqueleto en cada
+    documento vs. partiendo de la plantilla cacheada (DOCX_TEMPLATE_MODE), con el JSON de ejemplo.
+    """
+    import io
+    import json
+    import contextlib
+    import generar_docx_pdd
+    from pdd_model import build_pdd_model
+
+    print(f"--- Benchmark: plantilla DOCX ({args.documents} documentos) ---")
+    with open(args.json, "r", encoding="utf-8") as f:
+        json_data = json.load(f)
+    model = build_pdd_model(json_data, generar_docx_pdd.DEFAULT_USER_METADATA, os.path.join(tempfile.gettempdir(), "bench.bpmn"))
+    results = {}
+    for label, template_mode in (("esqueleto", False), ("plantilla", True)):
+        generar_docx_pdd.DOCX_TEMPLATE_MODE = template_mode
+        with contextlib.redirect_stdout(io.StringIO()):
+            generar_docx_pdd.build_pdd_document(model) # Calienta la caché
+            start = time.process_time()
+            for _ in range(args.documents):
+                document, _anchor = generar_docx_pdd.build_pdd_document(model)
+        results[label] = ((time.process_time() - start) / args.documents, len(document.element.body))
+        print(f"  {label:<10} {results[label][0] * 1000:>7.1f} ms CPU/documento  ({results[label][1]} elementos)")
+    ok = results["esqueleto"][1] == results["plantilla"][1]
+    print(f"  Mejora: {results['esqueleto'][0] / max(results['plantilla'][0], 1e-9):.1f}x")
+    print(f"Resultado: {'OK' if ok else 'FALLO'}")
+    return ok
+
+
+# --- Benchmark: DOCX en Streaming ---
+def bench_docx_stream(args) -> bool:
+    """
+    Memoria pico (tracemalloc) de `render_docx` con `--steps` pasos, cada uno con su screenshot en
+    disco: guardado normal (imágenes preparadas y árbol completo en memoria) vs. DOCX_STREAMING_WRITER.
+    Verifica que ambos archivos se vuelven a abrir con python-docx con todas las filas e imágenes.
+    """
+    import io
+    import json
+    import contextlib
+    import cv2
+    import numpy as np
+    from docx import Document
+    import generar_docx_pdd
+    from pdd_model import build_pdd_model
+    from screenshot_store import LEGACY_SCREENSHOT_PATTERN
+
+    print(f"--- Benchmark: DOCX en streaming ({args.steps} pasos, {args.width}x{args.height}) ---")
+    with open(args.json, "r", encoding="utf-8") as f:
+        json_data = json.load(f)
+    json_data["section_3_3_detailed_steps"] = [
+        {"step_number": i + 1, "application_in_focus": "Aplicación", "description": f"Acción {i + 1} & detalle",
+         "action_type_inferred": "Descripción del paso"} for i in range(args.steps)]
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rng = np.random.default_rng(0)
+        for i in range(args.steps): # Ruido: no se comprime, como el peor caso de screenshots reales
+            image = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+            cv2.imwrite(os.path.join(tmp_dir, LEGACY_SCREENSHOT_PATTERN.format(step_number=i + 1)), image)
+        model = build_pdd_model(json_data, generar_docx_pdd.DEFAULT_USER_METADATA, os.path.join(tmp_dir, "bench.bpmn"))
+        for label, streaming in (("guardado normal", False), ("streaming", True)):
+            generar_docx_pdd.DOCX_STREAMING_WRITER = streaming
+            output_path = os.path.join(tmp_dir, f"bench_{streaming}.docx")
+            with contextlib.redirect_stdout(io.StringIO()):
+                saved, peak, elapsed = measure_peak_memory(generar_docx_pdd.render_docx, dict(model), output_path, tmp_dir)
+            document = Document(output_path)
+            rows, images = len(document.tables[-1].rows) - 1, len(document.inline_shapes)
+            ok = ok and saved and rows == args.steps and images == args.steps
+            print_row(label, os.path.getsize(output_path), peak, elapsed)
+            print(f"  {'':<38} filas={rows}  imágenes={images}")
+    print(f"Resultado: {'OK' if ok else 'FALLO'}")
+    return ok
+
+
+# --- Ejecución Principal ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de rendimiento del pipeline PDD.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p_payload = subparsers.add_parser("payload-memory", help="Memoria pico al construir el payload de video.")
+    p_payload.add_argument("--size-gb", type=float, default=2.0, help="Tamaño del video sintético en GiB.")
+    p_payload.add_argument("--legacy", action="store_true", help="Incluir el método anterior como referencia.")
+    p_payload.set_defaults(func=bench_payload_memory)
+
+    p_resize = subparsers.add_parser("resize", help="Redimensionamiento serial vs. por etapas.")
+    p_resize.add_argument("--frames", type=int, default=120, help="Fotogramas del video sintético.")
+    p_resize.add_argument("--width", type=int, default=3840, help="Ancho del video sintético.")
+    p_resize.add_argument("--height", type=int, default=2160, help="Alto del video sintético.")
+    p_resize.add_argument("--target-width", type=int, default=1280, help="Ancho objetivo.")
+    p_resize.set_defaults(func=bench_resize)
+
+    p_shots = subparsers.add_parser("screenshots", help="Extracción de screenshots por modo (seek, forward, parallel).")
+    p_shots.add_argument("--frames", type=int, default=900, help="Fotogramas del video sintético (30 fps).")
+    p_shots.add_argument("--steps", type=int, default=100, help="Pasos (timestamps aleatorios).")
+    p_shots.add_argument("--width", type=int, default=1920, help="Ancho del video sintético.")
+    p_shots.add_argument("--height", type=int, default=1080, help="Alto del video sintético.")
+    p_shots.add_argument("--modes", nargs="+", default=["seek", "forward", "parallel"], help="Modos a comparar (el primero es la referencia).")
+    p_shots.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos del modo 'parallel'.")
+    p_shots.add_argument("--no-best-frame", action="store_true", help="Desactivar la selección del mejor fotograma (para medir su costo).")
+    p_shots.set_defaults(func=bench_screenshots)
+
+    p_encoding = subparsers.add_parser("encoding", help="Bytes y tiempo de codificación por perfil de screenshot.")
+    p_encoding.add_argument("--frames", type=int, default=60, help="Screenshots a codificar por perfil.")
+    p_encoding.add_argument("--width", type=int, default=1920, help="Ancho del video sintético.")
+    p_encoding.add_argument("--height", type=int, default=1080, help="Alto del video sintético.")
+    p_encoding.add_argument("--profiles", nargs="+", default=["png", "png-small", "jpeg", "jpeg-1600", "webp"], help="Perfiles a comparar.")
+    p_encoding.add_argument("--workers", type=int, default=4, help="Hilos de codificación.")
+    p_encoding.set_defaults(func=bench_encoding)
+
+    p_table = subparsers.add_parser("steps-table", help="Tiempo de la tabla de pasos del DOCX según el número de pasos.")
+    p_table.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000, 2000], help="Números de pasos a medir.")
+    p_table.add_argument("--legacy", action="store_true", help="Incluir la vía celda por celda como referencia.")
+    p_table.set_defaults(func=bench_steps_table)
+
+    p_template = subparsers.add_parser("docx-template", help="CPU por documento: esqueleto reconstruido vs. plantilla cacheada.")
+    p_template.add_argument("--documents", type=int, default=50, help="Documentos a generar por modo.")
+    p_template.add_argument("--json", default="full_analysis_output.json", help="JSON de análisis de ejemplo.")
+    p_template.set_defaults(func=bench_docx_template)
+
+    p_stream = subparsers.add_parser("docx-stream", help="Memoria pico del DOCX: guardado normal vs. escritura en streaming.")
+    p_stream.add_argument("--steps", type=int, default=1000, help="Pasos (un screenshot por paso).")
+    p_stream.add_argument("--width", type=int, default=640, help="Ancho de los screenshots sintéticos.")
+    p_stream.add_argument("--height", type=int, default=360, help="Alto de los screenshots sintéticos.")
+    p_stream.add_argument("--json", default="full_analysis_output.json", help="JSON de análisis de ejemplo.")
+    p_stream.set_defaults(func=bench_docx_stream)
+
+    args = parser.parse_args()
+    ok = args.func(args)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from xml.sax.saxutils import escape
+
+
+def build_bpmn_xml_from_steps(steps_list: list) -> str:
+    """
+    Genera un BPMN 2.0 lineal (Start -> Task_n -> End) con su diagrama, igual al que pide el prompt.
+    """
+    node_ids = ["StartEvent_1"] + [f"Task_{s['step_number']}" for s in steps_list] + ["EndEvent_1"]
+    process = ['    <bpmn:startEvent id="StartEvent_1" />']
+    for step in steps_list:
+        name = escape(step.get("description") or "", {'"': "&quot;"})
+        process.append(f'    <bpmn:userTask id="Task_{step["step_number"]}" name="{name}" />')
+    process.append('    <bpmn:endEvent id="EndEvent_1" />')
+
+    shapes = []
+    edges = []
+    x = 100
+    positions = {}
+    for node_id in node_ids:
+        if node_id.startswith("Task_"):
+            shapes.append(f'      <bpmndi:BPMNShape id="{node_id}_di" bpmnElement="{node_id}"><dc:Bounds x="{x}" y="80" width="100" height="80" /></bpmndi:BPMNShape>')
+            positions[node_id] = (x, x + 100)
+            x += 150
+        else:
+            shapes.append(f'      <bpmndi:BPMNShape id="{node_id}_di" bpmnElement="{node_id}"><dc:Bounds x="{x}" y="100" width="36" height="36" /></bpmndi:BPMNShape>')
+            positions[node_id] = (x, x + 36)
+            x += 86
+    for index, (source, target) in enumerate(zip(node_ids, node_ids[1:])):
+        process.append(f'    <bpmn:sequenceFlow id="Flow_{index}" sourceRef="{source}" targetRef="{target}" />')
+        edges.append(f'      <bpmndi:BPMNEdge id="Flow_{index}_di" bpmnElement="Flow_{index}"><di:waypoint x="{positions[source][1]}" y="118" /><di:waypoint x="{positions[target][0]}" y="118" /></bpmndi:BPMNEdge>')
+
+    return "\n".join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" '
+        'xmlns:bpmndi="http://www.omg.org/spec/BPMN/20100524/DI" xmlns:dc="http://www.omg.org/spec/DD/20100524/DC" '
+        'xmlns:di="http://www.omg.org/spec/DD/20100524/DI" id="Definitions_1" targetNamespace="http://bpmn.io/schema/bpmn">',
+        '  <bpmn:process id="GeneratedProcess_1" isExecutable="false">',
+        *process,
+        '  </bpmn:process>',
+        '  <bpmndi:BPMNDiagram id="Diagram_1">',
+        '    <bpmndi:BPMNPlane id="Plane_1" bpmnElement="GeneratedProcess_1">',
+        *shapes,
+        *edges,
+        '    </bpmndi:BPMNPlane>',
+        '  </bpmndi:BPMNDiagram>',
+        '</bpmn:definitions>',
+    ])
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime
+import cv2
+
+from video_analyzer import calculate_estimated_cost
+from model_backends import get_backend_name, is_billed_backend
+from file_lock import file_lock
+
+# --- Configuración de Presupuesto ---
+MAX_COST_PER_JOB_USD = 2.00      # Costo máximo estimado por ejecución (None = sin límite)
+MAX_COST_PER_DAY_USD = 50.00     # Gasto máximo diario según el ledger (None = sin límite)
+BUDGET_ACTION = "downscale"      # "downscale": reducir los fps muestreados hasta entrar en presupuesto; "reject": rechazar
+DOWNSCALE_SAMPLING_FPS = [0.5, 1 / 3, 0.25, 0.2]  # fps del video enviado probados al reducir (de mayor a menor)
+COST_LEDGER_PATH = 'cost_ledger.jsonl'          # Registro append-only del costo real de cada ejecución
+CALIBRATION_PATH = 'cost_calibration.json'      # Factores de corrección aprendidos de usage_metadata
+# --- Fin Configuración ---
+
+# --- Modelo de Tokens (aproximación de Gemini; los factores de calibración corrigen el sesgo) ---
+# Gemini cobra una cantidad fija de tokens por fotograma muestreado, sin importar la resolución: el
+# costo del video depende de la duración y de los fps muestreados (como máximo VIDEO_SAMPLING_FPS;
+# un video enviado con menos fps aporta menos fotogramas), no del ancho.
+VIDEO_SAMPLING_FPS = 1.0         # El modelo muestrea el video a ~1 fps
+TOKENS_PER_FRAME = 258           # Tokens por fotograma muestreado
+AUDIO_TOKENS_PER_SEC = 32
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKENS_BASE = 3000        # Secciones narrativas + BPMN
+OUTPUT_TOKENS_STEPS_BASE = 300   # Metadata de la llamada de pasos (análisis por etapas)
+OUTPUT_TOKENS_PER_MIN = 900      # Pasos detallados por minuto de video
+CALIBRATION_ALPHA = 0.3          # Peso de cada nueva observación (media móvil exponencial)
+
+_ledger_lock = threading.Lock()
+
+
+def probe_video(video_path: str) -> dict:
+    """
+    Lee duración, fps y resolución del video sin decodificarlo.
+
+    Returns:
+        Diccionario con duration_sec, fps, width, height (None si no se pudo abrir).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    info = {
+        "duration_sec": total_frames / fps if fps and fps > 0 else 0.0,
+        "fps": fps or 0.0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+    cap.release()
+    return info
+
+def load_calibration(path: str = CALIBRATION_PATH) -> dict:
+    """Devuelve los factores de calibración aprendidos (1.0 si aún no hay observaciones)."""
+    calibration = {"video_factor": 1.0, "output_factor": 1.0, "samples": 0}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            calibration.update(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return calibration
+
+def estimate_tokens(duration_sec: float, fps: float, width: int, height: int, prompt_chars: int,
+                    max_output_tokens: int = None, has_audio: bool = True, calibration: dict = None,
+                    model_name: str = None, staged: dict = None) -> dict:
+    """
+    Predice tokens de entrada/salida y costo de un análisis antes de enviarlo. `fps` son los del
+    video que se envía (ej: el proxy de análisis); `width`/`height` solo se registran.
+
+    Args:
+        staged: (Opcional) Análisis por etapas: {text_model_name, calls, prompt_chars}. La llamada
+            con video solo devuelve metadata y pasos; las secciones narrativas salen de `calls`
+            llamadas de texto (con los pasos como contexto) cobradas al precio de `text_model_name`.
+
+    Returns:
+        Diccionario con los componentes crudos (sin calibrar), los totales calibrados y el costo estimado.
+        `input_tokens`/`output_tokens` son los de la llamada con video (los que se calibran); las
+        llamadas de texto van aparte en `text_input_tokens`/`text_output_tokens`.
+    """
+    calibration = calibration or load_calibration()
+    sampled_fps = min(fps, VIDEO_SAMPLING_FPS) if fps > 0 else VIDEO_SAMPLING_FPS
+    raw_video_tokens = duration_sec * sampled_fps * TOKENS_PER_FRAME
+    audio_tokens = duration_sec * AUDIO_TOKENS_PER_SEC if has_audio else 0
+    prompt_tokens = prompt_chars / CHARS_PER_TOKEN
+    output_base = OUTPUT_TOKENS_STEPS_BASE if staged else OUTPUT_TOKENS_BASE
+    raw_output_tokens = output_base + OUTPUT_TOKENS_PER_MIN * duration_sec / 60.0
+
+    input_tokens = int(prompt_tokens + audio_tokens + raw_video_tokens * calibration["video_factor"])
+    output_tokens = int(raw_output_tokens * calibration["output_factor"])
+    if max_output_tokens:
+        output_tokens = min(output_tokens, max_output_tokens)
+    estimated_cost = calculate_estimated_cost(input_tokens, output_tokens, model_name)
+    text_input_tokens = text_output_tokens = 0
+    if staged:
+        text_input_tokens = int(staged["prompt_chars"] / CHARS_PER_TOKEN + staged["calls"] * output_tokens)
+        text_output_tokens = int(OUTPUT_TOKENS_BASE * calibration["output_factor"])
+        estimated_cost += calculate_estimated_cost(text_input_tokens, text_output_tokens, staged["text_model_name"])
+    return {
+        "raw_video_tokens": raw_video_tokens,
+        "audio_tokens": audio_tokens,
+        "prompt_tokens": prompt_tokens,
+        "raw_output_tokens": raw_output_tokens,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "text_input_tokens": text_input_tokens,
+        "text_output_tokens": text_output_tokens,
+        "estimated_cost_usd": estimated_cost,
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "sampled_fps": sampled_fps,
+    }
+
+def update_calibration(estimate: dict, actual_usage: dict, path: str = CALIBRATION_PATH) -> dict:
+    """
+    Ajusta los factores de calibración con el `usage_metadata` real de una ejecución.
+
+    La lectura-modificación-escritura se hace bajo un lock de archivo (varios trabajos o procesos
+    pueden terminar a la vez) y se publica con un temporal único + os.replace.
+    """
+    if not actual_usage or not estimate:
+        return load_calibration(path)
+    with file_lock(path):
+        calibration = load_calibration(path)
+        if estimate["raw_video_tokens"] > 0:
+            observed_video = actual_usage["input_tokens"] - estimate["prompt_tokens"] - estimate["audio_tokens"]
+            video_factor = max(0.05, observed_video / estimate["raw_video_tokens"])
+            calibration["video_factor"] += CALIBRATION_ALPHA * (video_factor - calibration["video_factor"])
+        if estimate["raw_output_tokens"] > 0:
+            output_factor = max(0.05, actual_usage["output_tokens"] / estimate["raw_output_tokens"])
+            calibration["output_factor"] += CALIBRATION_ALPHA * (output_factor - calibration["output_factor"])
+        calibration["samples"] += 1
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(calibration, f, indent=2)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return calibration
+
+def append_ledger_entry(entry: dict, ledger_path: str = COST_LEDGER_PATH):
+    """Añade una línea JSON al ledger de costos (solo se agrega, nunca se reescribe)."""
+    entry = {"timestamp": datetime.now().isoformat(timespec="seconds"), **entry}
+    with _ledger_lock:
+        with open(ledger_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def get_daily_spend(day: str = None, ledger_path: str = COST_LEDGER_PATH) -> float:
+    """Suma el costo real registrado en el ledger para el día indicado (hoy por defecto, 'YYYY-MM-DD')."""
+    day = day or datetime.now().strftime('%Y-%m-%d')
+    total = 0.0
+    try:
+        with open(ledger_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("timestamp", "").startswith(day):
+                    total += entry.get("actual_cost_usd") or 0.0
+    except FileNotFoundError:
+        pass
+    return total
+
+def record_run_cost(video_path: str, model_name: str, status: str, estimate: dict = None, usage: dict = None,
+                    extra: dict = None, calibrate: bool = True, backend_name: str = None) -> float:
+    """
+    Registra en el ledger el costo real de una ejecución y recalibra el estimador con su uso de tokens.
+
+    Args:
+        status: Resultado de la ejecución ('completed', 'failed', 'rejected', 'cache_hit', ...).
+        estimate: Estimado previo (de `plan_within_budget`), si lo hubo.
+        usage: Uso real normalizado (input_tokens, output_tokens, total_tokens), si lo hubo. Con
+            "by_model" (ver `accumulate_usage`) cada modelo se cobra a su precio y solo el uso de
+            `model_name` (la llamada con video) se compara con el estimado.
+        calibrate: Si False, solo se registra (ej: análisis segmentado, cuyo uso suma varias llamadas).
+        backend_name: Backend que atendió la ejecución (None = el activo). Con 'replay' o 'stub' el uso es
+            sintético: se registra con costo 0 (no cuenta para MAX_COST_PER_DAY_USD) y no se calibra.
+
+    Returns:
+        El costo real en USD (0.0 si no hubo llamada al modelo real).
+    """
+    backend_name = get_backend_name(backend_name)
+    billed = is_billed_backend(backend_name)
+    by_model = (usage or {}).get("by_model") or ({model_name: usage} if usage else {})
+    actual_cost = sum(calculate_estimated_cost(u.get("input_tokens", 0), u.get("output_tokens", 0), name)
+                      for name, u in by_model.items()) if billed else 0.0
+    entry = {
+        "video": os.path.basename(video_path),
+        "model_name": model_name,
+        "backend": backend_name,
+        "status": status,
+        "estimated_cost_usd": estimate["estimated_cost_usd"] if estimate else None,
+        "actual_cost_usd": actual_cost,
+        "input_tokens": usage.get("input_tokens") if usage else 0,
+        "output_tokens": usage.get("output_tokens") if usage else 0,
+        **({"by_model": by_model} if len(by_model) > 1 else {}),
+        **(extra or {}),
+    }
+    try:
+        append_ledger_entry(entry)
+        if calibrate and billed and by_model.get(model_name) and estimate:
+            update_calibration(estimate, by_model[model_name])
+    except OSError as e:
+        print(f"[Presupuesto] Advertencia: No se pudo registrar el costo en el ledger: {e}")
+    return actual_cost
+
+def plan_within_budget(video_path: str, prompt_chars: int, max_output_tokens: int = None,
+                       target_width: int = None, has_audio: bool = True, duration_sec: float = None,
+                       model_name: str = None, staged: dict = None, target_fps: float = None) -> dict:
+    """
+    Estima el costo de analizar el video y aplica los límites por ejecución y por día.
+    `model_name` y `staged`: ver `estimate_tokens`.
+
+    Si el estimado excede el presupuesto y `BUDGET_ACTION` es 'downscale', prueba fps menores
+    de `DOWNSCALE_SAMPLING_FPS` para el video enviado hasta encontrar uno que entre (reducir el
+    ancho no cambia los tokens). `duration_sec` reemplaza la duración del video cuando se enviará
+    una versión condensada (detección de escenas) y `target_fps` sus fps (proxy de análisis).
+
+    Returns:
+        Diccionario con:
+            allowed (bool), target_fps (float | None: fps a usar en el video enviado),
+            estimate (dict del plan elegido), reason (str).
+    """
+    info = probe_video(video_path)
+    if info is None:
+        return {"allowed": True, "target_fps": target_fps, "estimate": None,
+                "reason": "No se pudo leer el video para estimar el costo; se omite el control de presupuesto."}
+
+    if duration_sec is not None:
+        info["duration_sec"] = duration_sec
+    if target_width and target_width < info["width"]:
+        info["width"], info["height"] = target_width, int(target_width * info["height"] / info["width"])
+    calibration = load_calibration()
+    daily_spent = get_daily_spend()
+    limits = [limit for limit in (MAX_COST_PER_JOB_USD,
+                                  MAX_COST_PER_DAY_USD - daily_spent if MAX_COST_PER_DAY_USD is not None else None)
+              if limit is not None]
+    budget = min(limits) if limits else None
+
+    def plan_for(fps):
+        fps = min(fps, info["fps"]) if fps and info["fps"] else fps or info["fps"]
+        return estimate_tokens(info["duration_sec"], fps, info["width"], info["height"], prompt_chars,
+                               max_output_tokens, has_audio, calibration, model_name, staged)
+
+    estimate = plan_for(target_fps)
+    print(f"[Presupuesto] Estimado: {estimate['input_tokens']} tokens entrada, {estimate['output_tokens']} salida, "
+          f"${estimate['estimated_cost_usd']:.4f} (gasto hoy ${daily_spent:.2f}, disponible "
+          f"{'sin límite' if budget is None else f'${budget:.2f}'}).")
+    if budget is None or estimate["estimated_cost_usd"] <= budget:
+        return {"allowed": True, "target_fps": target_fps, "estimate": estimate, "reason": "Dentro del presupuesto."}
+
+    if BUDGET_ACTION == "downscale":
+        for fps in DOWNSCALE_SAMPLING_FPS:
+            if fps >= estimate["sampled_fps"]:
+                continue
+            candidate = plan_for(fps)
+            if candidate["estimated_cost_usd"] <= budget:
+                reason = (f"Video enviado reducido a {fps:.2f} fps para entrar en el presupuesto "
+                          f"(${candidate['estimated_cost_usd']:.4f} <= ${budget:.2f}).")
+                print(f"[Presupuesto] {reason}")
+                return {"allowed": True, "target_fps": fps, "estimate": candidate, "reason": reason}
+
+    reason = (f"Costo estimado ${estimate['estimated_cost_usd']:.4f} excede el presupuesto disponible ${budget:.2f} "
+              f"(por ejecución: {MAX_COST_PER_JOB_USD}, por día: {MAX_COST_PER_DAY_USD}, gastado hoy: ${daily_spent:.2f}).")
+    print(f"[Presupuesto] Rechazado: {reason}")
+    return {"allowed": False, "target_fps": target_fps, "estimate": estimate, "reason": reason}
+
+
+# --- Bloque de Ejecución Principal ---
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Estima el costo de analizar un video antes de enviarlo.")
+    parser.add_argument("video_file", help="Ruta al video.")
+    parser.add_argument("--prompt-chars", type=int, default=15000, help="Longitud del prompt en caracteres.")
+    args = parser.parse_args()
+    print(json.dumps(plan_within_budget(args.video_file, args.prompt_chars), indent=2, ensure_ascii=False))
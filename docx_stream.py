@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import zipfile
+import tempfile
+
+from lxml import etree
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import CT_Types, serialize_part_xml
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.spec import default_content_types
+from docx.oxml.ns import nsmap
+
+# Escritura de DOCX en streaming: el contenido que crece con el número de pasos (filas de una tabla e
+# imágenes) se escribe directamente en el contenedor zip a medida que se produce, en lugar de acumularse
+# en el árbol de python-docx hasta `document.save`. El resto del documento (secciones fijas, estilos,
+# encabezados) se sigue construyendo con python-docx y se serializa una sola vez.
+
+# --- Configuración ---
+STREAM_COPY_CHUNK_BYTES = 1024 * 1024   # Bloques al copiar el cuerpo temporal al zip
+# --- Fin Configuración ---
+
+_STREAM_MARKER = 'pdd-stream'
+_IMAGE_CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg"}
+_BODY_NAMESPACES = ("r", "wp", "a", "pic") # Prefijos que usan las filas con imágenes
+
+
+class StreamingDocxWriter:
+    """
+    Escribe `document` en `output_path` con contenido adicional en streaming al final de `parent`
+    (un elemento del cuerpo, ej: el `w:tbl` de la tabla de pasos con su fila de encabezado).
+
+    Al crearse escribe en el zip todas las partes salvo el cuerpo (`word/document.xml`) y sus
+    relaciones. Después, `add_image()` escribe cada imagen en el zip al momento y `write_xml()`
+    añade XML del cuerpo a un archivo temporal, así la memoria depende del paso en curso y no del
+    documento. `close()` completa el cuerpo y las relaciones y reemplaza `output_path` de forma
+    atómica; `abort()` descarta el archivo a medio escribir.
+
+    Las imágenes no se deduplican (python-docx sí lo hace, pero requiere recordar todas).
+    """
+
+    def __init__(self, document, parent, output_path: str):
+        self.output_path = output_path
+        self.images_written = 0
+        self._image_number = 0
+        package = document.part.package
+        for part in package.parts:
+            part.before_marshal()
+        self._document_part = document.part
+        self._next_shape_id = document.part.next_id # Se calcula una vez: `next_id` recorre todo el documento
+        used_rids = [int(rId[3:]) for rId in document.part.rels if rId.startswith("rId") and rId[3:].isdigit()]
+        self._next_rid = max(used_rids, default=0) + 1
+        self._used_partnames = {str(part.partname) for part in package.parts}
+
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix='.tmp')
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self._tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        self._body = tempfile.TemporaryFile()
+        self._rels = tempfile.TemporaryFile()
+        try:
+            self._zip.writestr(CONTENT_TYPES_URI.membername, self._content_types_xml(package.parts))
+            self._zip.writestr(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+            for part in package.parts:
+                if part is self._document_part:
+                    continue
+                self._zip.writestr(part.partname.membername, part.blob)
+                if len(part.rels):
+                    self._zip.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+            marker = etree.ProcessingInstruction(_STREAM_MARKER)
+            parent.append(marker)
+            try:
+                document_xml = serialize_part_xml(document.element)
+            finally:
+                parent.remove(marker)
+            head, self._tail = document_xml.split(etree.tostring(marker), 1)
+            self._body.write(self._declare_namespaces(head, document.element.nsmap))
+        except Exception:
+            self.abort()
+            raise
+
+    @staticmethod
+    def _content_types_xml(parts) -> bytes:
+        """[Content_Types].xml de las partes existentes, con los tipos de las imágenes que se añadirán."""
+        types = CT_Types.new()
+        defaults = {"rels": "application/vnd.openxmlformats-package.relationships+xml", "xml": "application/xml",
+                    **_IMAGE_CONTENT_TYPES}
+        overrides = {}
+        for part in parts:
+            ext = part.partname.ext
+            if (ext.lower(), part.content_type) in default_content_types:
+                defaults[ext.lower()] = part.content_type
+            else:
+                overrides[part.partname] = part.content_type
+        for ext in sorted(defaults):
+            types.add_default(ext, defaults[ext])
+        for partname in sorted(overrides):
+            types.add_override(partname, overrides[partname])
+        return serialize_part_xml(types)
+
+    @staticmethod
+    def _declare_namespaces(head: bytes, declared: dict) -> bytes:
+        """Declara en el elemento raíz los prefijos que usa el XML en streaming y el documento no declara."""
+        missing = "".join(f' xmlns:{prefix}="{nsmap[prefix]}"' for prefix in _BODY_NAMESPACES if prefix not in declared)
+        if not missing:
+            return head
+        root_start = head.index(b"<w:document") + len(b"<w:document")
+        return head[:root_start] + missing.encode() + head[root_start:]
+
+    def next_shape_id(self) -> int:
+        """Id único para el `wp:docPr` de la próxima imagen."""
+        shape_id = self._next_shape_id
+        self._next_shape_id += 1
+        return shape_id
+
+    def add_image(self, data: bytes, extension: str) -> str:
+        """
+        Escribe la imagen en el zip y la relaciona con el cuerpo.
+
+        Returns:
+            El rId para el `a:blip` de la imagen.
+        """
+        extension = extension.lstrip('.').lower()
+        if extension not in _IMAGE_CONTENT_TYPES:
+            raise ValueError(f"Formato de imagen no soportado en el DOCX: '{extension}'.")
+        self._image_number += 1
+        partname = f"/word/media/stream_image{self._image_number}.{extension}"
+        while partname in self._used_partnames:
+            self._image_number += 1
+            partname = f"/word/media/stream_image{self._image_number}.{extension}"
+        self._zip.writestr(partname[1:], data)
+        self._used_partnames.add(partname)
+        self.images_written += 1
+        while f"rId{self._next_rid}" in self._document_part.rels:
+            self._next_rid += 1
+        rId = f"rId{self._next_rid}"
+        self._next_rid += 1
+        self._rels.write(f'<Relationship Id="{rId}" Type="{RT.IMAGE}" Target="{partname[len("/word/"):]}"/>'.encode())
+        return rId
+
+    def write_xml(self, fragment: str):
+        """Añade XML al cuerpo en la posición de streaming (puede usar los prefijos w, r, wp, a y pic)."""
+        self._body.write(fragment.encode('utf-8'))
+
+    def close(self):
+        """Completa el cuerpo y sus relaciones y mueve el archivo terminado a `output_path`."""
+        try:
+            self._body.write(self._tail)
+            self._body.seek(0)
+            with self._zip.open(self._document_part.partname.membername, 'w') as target:
+                shutil.copyfileobj(self._body, target, STREAM_COPY_CHUNK_BYTES)
+            rels_xml = self._document_part.rels.xml
+            if b"</Relationships>" in rels_xml:
+                rels_head = rels_xml[:rels_xml.rindex(b"</Relationships>")]
+            else: # Sin relaciones previas el elemento raíz se serializa vacío (`<Relationships .../>`)
+                rels_head = rels_xml[:rels_xml.rindex(b"/>")] + b">"
+            self._rels.seek(0)
+            with self._zip.open(self._document_part.partname.rels_uri.membername, 'w') as target:
+                target.write(rels_head)
+                shutil.copyfileobj(self._rels, target, STREAM_COPY_CHUNK_BYTES)
+                target.write(b"</Relationships>")
+            self._zip.close()
+            os.replace(self._tmp_path, self.output_path)
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._body.close()
+            self._rels.close()
+
+    def abort(self):
+        """Descarta el archivo a medio escribir."""
+        try:
+            self._zip.close()
+        except Exception:
+            pass
+        self._body.close()
+        self._rels.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
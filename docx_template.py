@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+# Plantillas DOCX con marcadores (bookmarks): un .docx ya maquetado donde cada dato a completar
+# está señalado con un marcador con nombre. Dos tipos:
+#   - Campo de texto: marcador alrededor de un texto dentro de un párrafo (ej: nombre del proceso en
+#     la portada). Se reemplaza el texto conservando el formato del primer run.
+#   - Campo de bloque: marcador dentro de un párrafo propio. El párrafo entero se reemplaza por el
+#     contenido generado (párrafos, tablas, imágenes).
+
+_TEMPLATE_CACHE = {} # {clave: bytes del .docx}; clave = (ruta absoluta, mtime) o ('builtin', nombre)
+
+
+def load_template_bytes(template_path: str = None, build_skeleton=None, name: str = 'default') -> bytes:
+    """
+    Devuelve los bytes de la plantilla, leyéndola (o construyéndola) una sola vez por proceso.
+
+    Args:
+        template_path: .docx con marcadores. Se vuelve a leer solo si cambia su fecha de modificación.
+        build_skeleton: Si no hay `template_path`, función sin argumentos que devuelve un `Document`
+            esqueleto; se guarda en memoria con la clave `name`.
+
+    Raises:
+        FileNotFoundError: Si `template_path` no existe.
+        ValueError: Si no se indicó ni ruta ni función de construcción.
+    """
+    if template_path:
+        key = (os.path.abspath(template_path), os.path.getmtime(template_path))
+        if key not in _TEMPLATE_CACHE:
+            with open(template_path, 'rb') as f:
+                _TEMPLATE_CACHE[key] = f.read()
+            print(f"[Plantilla] Plantilla DOCX cargada en memoria: '{template_path}'")
+        return _TEMPLATE_CACHE[key]
+    if build_skeleton is None:
+        raise ValueError("Se requiere una ruta de plantilla o una función que construya el esqueleto.")
+    key = ('builtin', name)
+    if key not in _TEMPLATE_CACHE:
+        buffer = io.BytesIO()
+        build_skeleton().save(buffer)
+        _TEMPLATE_CACHE[key] = buffer.getvalue()
+        print(f"[Plantilla] Esqueleto DOCX '{name}' construido y cacheado en memoria.")
+    return _TEMPLATE_CACHE[key]
+
+def open_template(template_bytes: bytes):
+    """Abre una copia independiente de la plantilla (cada trabajo modifica la suya)."""
+    return Document(io.BytesIO(template_bytes))
+
+def add_bookmark(paragraph, name: str, run=None):
+    """
+    Añade el marcador `name` al párrafo: alrededor de `run` (campo de texto) o, sin `run`,
+    al final del párrafo (campo de bloque).
+    """
+    body = paragraph._p.getroottree().getroot()
+    bookmark_id = str(1 + max([int(b.get(qn('w:id'), 0)) for b in body.iter(qn('w:bookmarkStart'))] or [0]))
+    start = OxmlElement('w:bookmarkStart')
+    start.set(qn('w:id'), bookmark_id)
+    start.set(qn('w:name'), name)
+    end = OxmlElement('w:bookmarkEnd')
+    end.set(qn('w:id'), bookmark_id)
+    if run is not None:
+        run._r.addprevious(start)
+        run._r.addnext(end)
+    else:
+        paragraph._p.append(start)
+        paragraph._p.append(end)
+
+def find_bookmarks(document) -> dict:
+    """Devuelve {nombre: elemento w:bookmarkStart} de los marcadores del cuerpo del documento."""
+    return {start.get(qn('w:name')): start for start in document.element.body.iter(qn('w:bookmarkStart'))}
+
+def _bookmark_end(start):
+    bookmark_id = start.get(qn('w:id'))
+    for end in start.getroottree().getroot().iter(qn('w:bookmarkEnd')):
+        if end.get(qn('w:id')) == bookmark_id:
+            return end
+    return None
+
+def set_bookmark_text(start, text: str):
+    """Reemplaza el texto de un campo de texto, conservando el formato del primer run del marcador."""
+    end = _bookmark_end(start)
+    runs = []
+    for sibling in start.itersiblings():
+        if sibling is end:
+            break
+        if sibling.tag == qn('w:r'):
+            runs.append(sibling)
+    if runs:
+        run = runs[0]
+        for child in list(run):
+            if child.tag != qn('w:rPr'):
+                run.remove(child)
+        for extra in runs[1:]:
+            extra.getparent().remove(extra)
+    else:
+        run = OxmlElement('w:r')
+        start.addnext(run)
+    text_element = OxmlElement('w:t')
+    text_element.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+    text_element.text = text
+    run.append(text_element)
+
+def bookmark_paragraph(start):
+    """Párrafo (w:p) que contiene un campo de bloque, o None si el marcador no está dentro de un párrafo."""
+    parent = start.getparent()
+    return parent if parent is not None and parent.tag == qn('w:p') else None
+
+def replace_paragraph(document, paragraph_element, build_func):
+    """
+    Reemplaza un párrafo del cuerpo por el contenido que `build_func(document)` añade al final del
+    documento (con las funciones habituales de python-docx), y lo mueve a la posición del párrafo.
+
+    Returns:
+        Lo que devuelva `build_func`.
+    """
+    body = document.element.body
+    tail = 1 if body.sectPr is not None else 0 # El contenido nuevo se añade antes de sectPr
+    first_new = len(body) - tail
+    result = build_func(document)
+    for element in list(body)[first_new:len(body) - tail]:
+        paragraph_element.addprevious(element)
+    for start in paragraph_element.iter(qn('w:bookmarkStart')):
+        end = _bookmark_end(start)
+        if end is not None and end.getparent() is not None and end.getparent() is not paragraph_element:
+            end.getparent().remove(end) # Marcador que terminaba fuera del párrafo
+    paragraph_element.getparent().remove(paragraph_element)
+    return result
@@ -1,62 +1,51 @@
 # -*- coding: utf-8 -*-
 import cv2
+import numpy as np
 import json
 import os
 import sys
 import shutil # Asegúrate que esta importación esté
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from analysis_cache import compute_file_hash
+from screenshot_store import (screenshot_filename, load_manifest, save_manifest, lookup_target, record_extraction,
+                              prune_screenshots)
+from screenshot_encoding import ScreenshotEncoder, print_encoding_stats
 
 # --- Configuración ---
 JSON_INPUT_PATH = 'full_analysis_output.json' # Asegúrate que este es el JSON correcto
 VIDEO_PATH = 'video_1.mkv' # Asegúrate que este es el video correcto
 OUTPUT_DIR = 'screenshots_output'
+EXTRACTION_MODE = 'parallel' # 'parallel': tramos contiguos en varios procesos; 'forward': una sola lectura hacia
+                             # adelante (grab/retrieve); 'seek': un seek por paso
+SEEK_GAP_SEC = 10.0          # En modos 'forward'/'parallel', huecos mayores entre fotogramas objetivo se saltan con un seek
+EXTRACTION_WORKERS = os.cpu_count() or 1  # Procesos del modo 'parallel' (cada uno con su propio VideoCapture)
+MIN_FRAMES_PER_WORKER = 12   # Con menos fotogramas objetivo por proceso no compensa arrancarlo ('parallel' -> 'forward')
+BEST_FRAME_ENABLED = True    # Elegir el fotograma más nítido y estable alrededor de cada timestamp
+BEST_FRAME_WINDOW_MS = 400   # Ventana de búsqueda (± ms) alrededor del timestamp del modelo
+BEST_FRAME_CANDIDATES = 3    # Fotogramas evaluados por ventana (impar: incluye el del timestamp)
+BEST_FRAME_ANALYSIS_WIDTH = 160      # Ancho al que se reducen los candidatos para puntuarlos
+BEST_FRAME_MIN_MOTION_DROP = 2.0     # Reducción mínima del movimiento (nivel de gris medio, 0-255) para dejar el fotograma del modelo
+BEST_FRAME_MIN_SHARPNESS_GAIN = 0.25 # Con movimiento similar, mejora relativa mínima de nitidez para dejar el fotograma del modelo
+BEST_FRAME_SEEK_ADJACENT = True      # En modo 'seek' (y extracción incremental) evaluar solo el objetivo y el siguiente (sin leer la ventana)
 # --- Fin de la Configuración ---
 
-def extract_screenshots(json_path: str, video_path: str, output_dir: str):
+def prepare_output_dir(output_dir: str, clean: bool = False) -> bool:
     """
-    Lee JSON complejo (v0.3), limpia directorio de salida, extrae fotogramas
-    basados en los timestamps originales del JSON. Devuelve True/False.
-    (Versión v0.3 - Usa clave 'section_3_3_detailed_steps')
+    Crea el directorio de salida. Con `clean=True` además limpia su contenido previo
+    (por defecto se conserva: los screenshots ya extraídos se reutilizan vía manifiesto, y los
+    que no figuran en él se eliminan al terminar, ver `screenshot_store.prune_screenshots`).
+    Devuelve True/False.
     """
-    print(f"--- Iniciando Fase 2.2 (Adaptada para v0.3): Extracción de Screenshots ---")
-    print(f"JSON de entrada (Complejo): {json_path}")
-    print(f"Video de entrada: {video_path}")
-    print(f"Directorio de salida: {output_dir}")
-
-    # 1. Cargar datos del JSON Complejo
-    print(f"\n[Paso 1/5] Cargando datos complejos desde '{json_path}'...")
-    steps_list = [] # Inicializar como lista vacía
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            full_data = json.load(f)
-        print(f"Datos JSON complejos cargados exitosamente.")
-
-        # --- CORRECCIÓN AQUÍ: Usar la clave correcta del JSON v0.3 ---
-        steps_key_name = "section_3_3_detailed_steps" # <--- Clave v0.3
-        steps_list = full_data.get(steps_key_name, [])
-        # --- FIN CORRECCIÓN ---
-
-        if not steps_list:
-             # Mensaje de advertencia actualizado para reflejar la clave buscada
-             print(f"Advertencia: No se encontró la lista '{steps_key_name}' o está vacía en '{json_path}'. No se extraerán screenshots.")
-        print(f"Se encontraron {len(steps_list)} pasos detallados para procesar.")
-    except FileNotFoundError:
-        print(f"Error Crítico: No se encontró el archivo JSON en '{json_path}'")
-        return False
-    except json.JSONDecodeError as e:
-        print(f"Error Crítico: El archivo '{json_path}' no contiene un JSON válido.")
-        print(f"Detalle del error: {e}")
-        return False
-    except Exception as e:
-        print(f"Error Crítico inesperado al leer el JSON: {e}")
-        return False
-
-    # 2. Asegurar y Limpiar Directorio de Salida (sin cambios)
-    print(f"\n[Paso 2/5] Asegurando y limpiando directorio de salida '{output_dir}'...")
+    print(f"\n[Paso 2/5] Asegurando directorio de salida '{output_dir}'...")
     try:
         existed_before = os.path.isdir(output_dir)
         os.makedirs(output_dir, exist_ok=True) # Crea si no existe
 
-        if existed_before:
+        if existed_before and clean:
             print(f"  - Limpiando contenido previo de '{output_dir}'...")
             cleaned_count = 0
             error_clean_count = 0
@@ -76,93 +65,533 @@ def extract_screenshots(json_path: str, video_path: str, output_dir: str):
                 print(f"  - Limpieza completada ({cleaned_count} items eliminados).")
             else:
                  print(f"  - Limpieza completada con {error_clean_count} errores.")
-        else:
+        elif not existed_before:
             print(f"Directorio '{output_dir}' creado.") # Mensaje si era nuevo
+        return True
 
     except OSError as e:
         print(f"Error Crítico: No se pudo crear/acceder al directorio de salida '{output_dir}'.")
         print(f"Detalle del error: {e}")
-        return False # Falla si no podemos asegurar el directorio
+        return False
 
-    # Si no había pasos en el JSON, terminamos aquí exitosamente
-    if not steps_list:
-        print("\nNo hay pasos detallados para procesar. Finalizando extracción.")
-        return True
+def open_video(video_path: str):
+    """
+    Abre el video y obtiene FPS y total de fotogramas.
 
-    # 3. Abrir el archivo de video (sin cambios)
+    Returns:
+        Una tupla (video_capture, fps, total_frames); video_capture es None si falla.
+    """
     print(f"\n[Paso 3/5] Abriendo archivo de video '{video_path}'...")
     video_capture = cv2.VideoCapture(video_path)
     if not video_capture.isOpened():
         print(f"Error Crítico: No se pudo abrir el archivo de video '{video_path}'.")
-        return False
+        return None, None, None
 
-    # 4. Obtener información del video (FPS y total de fotogramas) (sin cambios)
     print(f"\n[Paso 4/5] Obteniendo información del video...")
     fps = video_capture.get(cv2.CAP_PROP_FPS)
     total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
     if fps is None or fps <= 0 or total_frames is None or total_frames <= 0:
         print(f"Error Crítico: No se pudo obtener FPS ({fps}) o total de fotogramas ({total_frames}) válidos.")
         video_capture.release()
-        return False
+        return None, None, None
+    duration_sec = total_frames / fps
+    print(f"Información del video obtenida: FPS={fps:.2f}, Total Frames={total_frames}, Duración={duration_sec:.2f}s")
+    return video_capture, fps, total_frames
+
+def resolve_step_frame(step: dict, fps: float, total_frames: int):
+    """
+    Calcula el fotograma objetivo de un paso a partir de su `timestamp_ms` (acotado al video).
+
+    Returns:
+        El índice de fotograma, o None si al paso le falta 'step_number' o 'timestamp_ms'.
+    """
+    step_number = step.get("step_number")
+    timestamp_ms = step.get("timestamp_ms")
+
+    if step_number is None or timestamp_ms is None:
+        print(f"  - Paso {step_number or '?'} omitido: falta 'step_number' o 'timestamp_ms'.")
+        return None
+
+    print(f"  - Procesando Paso {step_number}: @ {timestamp_ms} ms")
+    timestamp_sec = timestamp_ms / 1000.0
+    target_frame = int(timestamp_sec * fps)
+
+    # Asegurar que el índice esté dentro de los límites
+    if target_frame >= total_frames:
+        print(f"    Advertencia: Timestamp {timestamp_ms}ms (fotograma {target_frame}) excede total ({total_frames}). Usando último.")
+        target_frame = total_frames - 1
+    elif target_frame < 0:
+         print(f"    Advertencia: Timestamp {timestamp_ms}ms resulta en fotograma negativo ({target_frame}). Usando primero (0).")
+         target_frame = 0
+    return target_frame
+
+def selection_signature(encoder: ScreenshotEncoder) -> dict:
+    """Configuración que determina qué fotograma se elige por paso y cómo se codifica (invalida el manifiesto si cambia)."""
+    return {
+        "profile": encoder.profile_name,
+        "encoding": encoder.profile,
+        "best_frame": BEST_FRAME_ENABLED,
+        "window_ms": BEST_FRAME_WINDOW_MS,
+        "candidates": BEST_FRAME_CANDIDATES,
+        "analysis_width": BEST_FRAME_ANALYSIS_WIDTH,
+        "min_motion_drop": BEST_FRAME_MIN_MOTION_DROP,
+        "min_sharpness_gain": BEST_FRAME_MIN_SHARPNESS_GAIN,
+        "seek_adjacent": BEST_FRAME_SEEK_ADJACENT,
+    }
+
+def new_counts() -> dict:
+    """Conteo de pasos por resultado: extraídos, reutilizados (ya presentes), omitidos y con error."""
+    return {"extracted": 0, "reused": 0, "skipped": 0, "error": 0}
+
+def candidate_frames(target_frame: int, fps: float, total_frames: int, adjacent: bool = False) -> list:
+    """
+    Fotogramas candidatos alrededor de `target_frame` (incluido): BEST_FRAME_CANDIDATES fotogramas
+    repartidos en ±BEST_FRAME_WINDOW_MS (con `adjacent`, el objetivo y el siguiente), acotados al
+    video. Sin selección, solo el propio objetivo.
+    """
+    half = BEST_FRAME_CANDIDATES // 2 if BEST_FRAME_ENABLED else 0
+    if half == 0:
+        return [target_frame]
+    if adjacent:
+        return sorted({target_frame, min(target_frame + 1, total_frames - 1)})
+    stride = max(1, int(round(BEST_FRAME_WINDOW_MS / 1000.0 * fps / half)))
+    frames = {min(max(0, target_frame + k * stride), total_frames - 1) for k in range(-half, half + 1)}
+    return sorted(frames)
+
+def _motion_partner(index: int, total_frames: int) -> int:
+    """Fotograma contiguo con el que se mide el movimiento de un candidato (el siguiente; el anterior al final)."""
+    return index + 1 if index + 1 < total_frames else max(0, index - 1)
+
+def frames_to_read(candidates: list, total_frames: int) -> list:
+    """Fotogramas a leer para puntuar `candidates`: cada candidato y su contiguo (ver `select_best_frame`)."""
+    if len(candidates) <= 1:
+        return list(candidates)
+    return sorted(set(candidates) | {_motion_partner(index, total_frames) for index in candidates})
+
+def select_best_frame(frames: dict, candidates: list, target_frame: int, total_frames: int):
+    """
+    Elige, entre los `candidates` de una ventana, el fotograma más nítido y estable.
+
+    Se evalúa en lote sobre versiones reducidas en gris: nitidez = varianza del Laplaciano;
+    movimiento = diferencia media con el fotograma contiguo (transiciones, animaciones). Se
+    conserva el fotograma del modelo salvo que otro candidato mejore por un margen absoluto:
+    BEST_FRAME_MIN_MOTION_DROP menos movimiento o, con movimiento similar, BEST_FRAME_MIN_SHARPNESS_GAIN
+    más nitidez. Así el ruido de compresión de una pantalla estática no cambia la elección.
+
+    Args:
+        frames: {índice: fotograma o None} con los fotogramas de `frames_to_read(candidates)`.
+
+    Returns:
+        El índice (del video) del fotograma elegido, o None si no se leyó ningún candidato.
+    """
+    available = [index for index in candidates if frames.get(index) is not None]
+    if not available:
+        return None
+    center = min(available, key=lambda index: abs(index - target_frame))
+    if len(available) == 1:
+        return center
+    scored = [index for index in available if frames.get(_motion_partner(index, total_frames)) is not None]
+    if center not in scored:
+        return center
+    height, width = frames[center].shape[:2]
+    small_size = (BEST_FRAME_ANALYSIS_WIDTH, max(3, int(BEST_FRAME_ANALYSIS_WIDTH * height / width)))
+    needed = sorted(set(scored) | {_motion_partner(index, total_frames) for index in scored})
+    stack = np.stack([cv2.cvtColor(cv2.resize(frames[index], small_size, interpolation=cv2.INTER_LINEAR), cv2.COLOR_BGR2GRAY)
+                      for index in needed]).astype(np.float32)
+    position = {index: i for i, index in enumerate(needed)}
+    candidate_stack = stack[[position[index] for index in scored]]
+    partner_stack = stack[[position[_motion_partner(index, total_frames)] for index in scored]]
+    laplacian = (candidate_stack[:, :-2, 1:-1] + candidate_stack[:, 2:, 1:-1] + candidate_stack[:, 1:-1, :-2]
+                 + candidate_stack[:, 1:-1, 2:] - 4 * candidate_stack[:, 1:-1, 1:-1])
+    sharpness = dict(zip(scored, laplacian.var(axis=(1, 2))))
+    motion = dict(zip(scored, np.abs(candidate_stack - partner_stack).mean(axis=(1, 2))))
+
+    better = [index for index in scored if index != center and (
+        motion[center] - motion[index] >= BEST_FRAME_MIN_MOTION_DROP
+        or (abs(motion[center] - motion[index]) < BEST_FRAME_MIN_MOTION_DROP
+            and sharpness[index] >= sharpness[center] * (1 + BEST_FRAME_MIN_SHARPNESS_GAIN) + 1.0))]
+    if not better:
+        return center
+    return min(better, key=lambda index: (motion[index], -sharpness[index], abs(index - target_frame)))
+
+def _save_best_frame(candidates: list, frames: dict, target_frame: int, step_numbers: list, output_dir: str,
+                     video_hash: str, encoder: ScreenshotEncoder, counts: dict, frame_records: dict, total_frames: int):
+    """
+    Elige el mejor fotograma leído entre `candidates` y lo encola en `encoder` con su nombre direccionado
+    por contenido (si ya existe en disco no se vuelve a codificar). Registra por paso {target_frame,
+    frame_index, file}; el resultado y las dimensiones se completan en `collect_encoded`.
+    """
+    chosen_frame = select_best_frame(frames, candidates, target_frame, total_frames)
+    if chosen_frame is None:
+        for step_number in step_numbers:
+            print(f"    Error: No se pudo leer el fotograma {target_frame} para el paso {step_number}.")
+            counts["error"] += 1
+        return
+    frame = frames[chosen_frame]
+    filename = screenshot_filename(video_hash, chosen_frame, encoder.profile_name, encoder.extension)
+    screenshot_path = os.path.join(output_dir, filename)
+    record = {"target_frame": target_frame, "frame_index": chosen_frame, "file": filename}
+    if encoder.write_to_disk and os.path.exists(screenshot_path):
+        counts["reused"] += len(step_numbers)
+        size = encoder.load_existing(screenshot_path) if encoder.keep_in_memory else None
+        if size:
+            record["width"], record["height"] = size
     else:
-        duration_sec = total_frames / fps
-        print(f"Información del video obtenida: FPS={fps:.2f}, Total Frames={total_frames}, Duración={duration_sec:.2f}s")
+        encoder.submit(frame, screenshot_path, key=step_numbers)
+    for step_number in step_numbers:
+        frame_records[step_number] = dict(record)
+
+def collect_encoded(encoder: ScreenshotEncoder, counts: dict, frame_records: dict):
+    """
+    Espera las escrituras pendientes de `encoder` y cuenta cada paso como extraído o con error,
+    completando las dimensiones de la imagen codificada en su registro.
+    """
+    for step_numbers, size in encoder.drain():
+        for step_number in step_numbers:
+            if size:
+                counts["extracted"] += 1
+                frame_records[step_number]["width"], frame_records[step_number]["height"] = size
+            else:
+                counts["error"] += 1
+                frame_records.pop(step_number, None)
+
+def reuse_target(record: dict, target_frame: int, step_numbers: list, output_dir: str, encoder: ScreenshotEncoder,
+                 counts: dict, frame_records: dict):
+    """Registra los pasos de un fotograma objetivo que ya figura en el manifiesto (y lo carga en memoria si se pidió)."""
+    record = {"target_frame": target_frame, **record}
+    if encoder.keep_in_memory:
+        size = encoder.load_existing(os.path.join(output_dir, record["file"]), record.get("width"), record.get("height"))
+        if size:
+            record["width"], record["height"] = size
+    for step_number in step_numbers:
+        frame_records[step_number] = dict(record)
+        counts["reused"] += 1
 
-    # 5. Procesar cada paso de la lista y extraer fotograma original (sin cambios)
-    print(f"\n[Paso 5/5] Procesando pasos y extrayendo fotogramas originales...")
-    extracted_count = 0
-    skipped_count = 0
-    error_count = 0
+def build_step_images(frame_records: dict, encoder: ScreenshotEncoder, output_dir: str) -> dict:
+    """
+    Devuelve {step_number: {data, width, height, format}} con las imágenes codificadas en memoria
+    de cada paso (ver `ScreenshotEncoder(keep_in_memory=True)`).
+    """
+    step_images = {}
+    for step_number, record in frame_records.items():
+        image = encoder.images.get(os.path.join(output_dir, record["file"]))
+        if image is not None:
+            step_images[step_number] = image
+    return step_images
 
+def _extract_group_seek(video_capture, fps: float, total_frames: int, target_frame: int, step_numbers: list,
+                        output_dir: str, video_hash: str, encoder: ScreenshotEncoder, counts: dict, frame_records: dict):
+    """
+    Modo 'seek': se posiciona al inicio de la ventana del objetivo y la lee (un seek por objetivo).
+    Con BEST_FRAME_SEEK_ADJACENT solo se evalúan el objetivo y el siguiente: leer la ventana
+    completa tras cada seek multiplicaría el costo por paso.
+    """
+    candidates = candidate_frames(target_frame, fps, total_frames, adjacent=BEST_FRAME_SEEK_ADJACENT)
+    window = frames_to_read(candidates, total_frames)
+    video_capture.set(cv2.CAP_PROP_POS_FRAMES, window[0])
+    frames = dict(read_frames_forward(video_capture, window, seek_gap_frames=total_frames, start_position=window[0]))
+    _save_best_frame(candidates, frames, target_frame, step_numbers, output_dir, video_hash, encoder, counts,
+                     frame_records, total_frames)
+
+def read_frames_forward(video_capture, target_frames, seek_gap_frames: int, start_position: int = 0):
+    """
+    Lee los fotogramas `target_frames` (ordenados, sin repetir) en una sola pasada hacia adelante:
+    los intermedios se avanzan con grab() (sin decodificar la imagen) y solo los objetivo se
+    decodifican con retrieve(). Si el hueco hasta el siguiente objetivo supera `seek_gap_frames`,
+    se hace un seek en lugar de avanzar fotograma a fotograma.
+
+    Yields:
+        Tuplas (indice_fotograma, fotograma o None si no se pudo leer).
+    """
+    position = start_position # Índice del próximo fotograma que devolverá grab()
+    for target in target_frames:
+        if target - position > seek_gap_frames:
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, target)
+            position = target
+        ok = True
+        while ok and position < target:
+            ok = video_capture.grab()
+            position += 1
+        ok = ok and video_capture.grab()
+        frame = None
+        if ok:
+            position += 1
+            ret, frame = video_capture.retrieve()
+            if not ret:
+                frame = None
+        yield target, frame
+
+def group_steps_by_frame(steps_list: list, fps: float, total_frames: int):
+    """
+    Agrupa los `step_number` por fotograma objetivo.
+
+    Returns:
+        Una tupla ({fotograma: [step_number, ...]}, pasos_omitidos).
+    """
+    steps_by_frame = {}
+    skipped = 0
     for step in steps_list:
-        step_number = step.get("step_number")
-        timestamp_ms = step.get("timestamp_ms")
+        target_frame = resolve_step_frame(step, fps, total_frames)
+        if target_frame is None:
+            skipped += 1
+            continue
+        steps_by_frame.setdefault(target_frame, []).append(step.get("step_number"))
+    return steps_by_frame, skipped
 
-        if step_number is None or timestamp_ms is None:
-            print(f"  - Paso {step_number or '?'} omitido: falta 'step_number' o 'timestamp_ms'.")
-            skipped_count += 1
+def extract_frames_forward(video_capture, fps: float, total_frames: int, frame_groups: list, output_dir: str,
+                           video_hash: str, encoder: ScreenshotEncoder, frame_records: dict,
+                           seek_gap_sec: float = SEEK_GAP_SEC, start_position: int = 0) -> dict:
+    """
+    Modo 'forward': lee el video una sola vez hacia adelante (ver `read_frames_forward`) recorriendo
+    las ventanas de candidatos de `frame_groups` [(fotograma, [step_number, ...])] ordenados, y guarda
+    el mejor fotograma de cada una. Solo se retienen en memoria los fotogramas de ventanas pendientes;
+    la codificación y escritura ocurren en los hilos de `encoder` mientras se sigue decodificando.
+
+    Returns:
+        Conteo por resultado (ver `new_counts`).
+    """
+    counts = new_counts()
+    candidates = [candidate_frames(target_frame, fps, total_frames) for target_frame, _ in frame_groups]
+    windows = [frames_to_read(group_candidates, total_frames) for group_candidates in candidates]
+    needed = sorted(set(index for window in windows for index in window))
+    seek_gap_frames = max(1, int(seek_gap_sec * fps))
+    frames = {}
+    group = 0
+    for index, frame in read_frames_forward(video_capture, needed, seek_gap_frames, start_position):
+        frames[index] = frame
+        # Las ventanas tienen el mismo ancho, así que terminan en el orden de los grupos
+        while group < len(frame_groups) and index >= windows[group][-1]:
+            target_frame, step_numbers = frame_groups[group]
+            _save_best_frame(candidates[group], frames, target_frame, step_numbers, output_dir, video_hash,
+                             encoder, counts, frame_records, total_frames)
+            group += 1
+            lowest_needed = windows[group][0] if group < len(windows) else index + 1
+            for stale in [i for i in frames if i < lowest_needed]:
+                del frames[stale]
+    collect_encoded(encoder, counts, frame_records)
+    return counts
+
+# Configuración del módulo que los procesos de trabajo deben ver igual que el proceso principal
+WORKER_CONFIG_NAMES = ("SEEK_GAP_SEC", "BEST_FRAME_ENABLED", "BEST_FRAME_WINDOW_MS", "BEST_FRAME_CANDIDATES",
+                       "BEST_FRAME_ANALYSIS_WIDTH", "BEST_FRAME_MIN_MOTION_DROP", "BEST_FRAME_MIN_SHARPNESS_GAIN",
+                       "BEST_FRAME_SEEK_ADJACENT")
+
+def _init_worker_config(config: dict):
+    """Inicializador de los procesos 'spawn': aplica la configuración vigente en el proceso principal."""
+    globals().update(config)
+
+def _extract_range_worker(video_path: str, fps: float, total_frames: int, frame_groups: list, output_dir: str,
+                          video_hash: str, profile_name: str, keep_in_memory: bool, write_to_disk: bool):
+    """
+    Proceso de trabajo del modo 'parallel': abre su propio VideoCapture, se posiciona en el primer
+    fotograma de su tramo y lo recorre hacia adelante, codificando y guardando sus imágenes.
+
+    Returns:
+        Una tupla (conteo, registros por paso, estadísticas de codificación, imágenes en memoria).
+    """
+    frame_records = {}
+    video_capture = cv2.VideoCapture(video_path)
+    if not video_capture.isOpened():
+        counts = new_counts()
+        counts["error"] = sum(len(numbers) for _, numbers in frame_groups)
+        return counts, frame_records, {}, {}
+    try:
+        with ScreenshotEncoder(profile_name, keep_in_memory=keep_in_memory, write_to_disk=write_to_disk) as encoder:
+            first_frame = frames_to_read(candidate_frames(frame_groups[0][0], fps, total_frames), total_frames)[0]
+            if first_frame > 0:
+                video_capture.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+            counts = extract_frames_forward(video_capture, fps, total_frames, frame_groups, output_dir, video_hash,
+                                            encoder, frame_records, start_position=first_frame)
+        return counts, frame_records, encoder.stats, encoder.images
+    finally:
+        video_capture.release()
+
+def split_contiguous_ranges(items: list, parts: int) -> list:
+    """Divide una lista ordenada en hasta `parts` tramos contiguos de tamaño similar."""
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    ranges, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(items[start:end])
+        start = end
+    return ranges
+
+def extract_frames_parallel(video_path: str, fps: float, total_frames: int, frame_groups: list, output_dir: str,
+                            video_hash: str, encoder: ScreenshotEncoder, frame_records: dict,
+                            workers: int = None) -> dict:
+    """
+    Modo 'parallel': reparte `frame_groups` (ordenados) en tramos contiguos, uno por proceso. Cada
+    proceso lee su tramo hacia adelante igual que el modo 'forward', así que las imágenes son
+    idénticas a las del modo serial.
+
+    Returns:
+        Conteo por resultado (ver `new_counts`).
+    """
+    parts = min(workers or EXTRACTION_WORKERS, len(frame_groups) // MIN_FRAMES_PER_WORKER)
+    if parts <= 1:
+        video_capture = cv2.VideoCapture(video_path)
+        try:
+            return extract_frames_forward(video_capture, fps, total_frames, frame_groups, output_dir, video_hash,
+                                          encoder, frame_records)
+        finally:
+            video_capture.release()
+
+    print(f"  - Repartiendo {len(frame_groups)} fotogramas en {parts} procesos...")
+    counts = new_counts()
+    # 'spawn' y no 'fork': en el pipeline esto corre en un hilo del planificador de etapas mientras otros
+    # hilos y pools siguen vivos, y un fork heredaría sus locks tomados (posible bloqueo del hijo).
+    # Los procesos nuevos no heredan la configuración modificada en tiempo de ejecución: se les pasa.
+    worker_config = {name: globals()[name] for name in WORKER_CONFIG_NAMES}
+    with ProcessPoolExecutor(max_workers=parts, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker_config, initargs=(worker_config,)) as executor:
+        futures = [executor.submit(_extract_range_worker, video_path, fps, total_frames, groups, output_dir,
+                                   video_hash, encoder.profile_name, encoder.keep_in_memory, encoder.write_to_disk)
+                   for groups in split_contiguous_ranges(frame_groups, parts)]
+        for future in futures:
+            worker_counts, worker_records, worker_stats, worker_images = future.result()
+            for status, count in worker_counts.items():
+                counts[status] += count
+            frame_records.update(worker_records)
+            encoder.merge_stats(worker_stats, worker_images)
+    return counts
+
+def apply_frame_offsets(steps_list: list, frame_records: dict, fps: float = None):
+    """
+    Registra en cada paso `screenshot_frame_offset`: cuántos fotogramas se desplazó el screenshot
+    elegido respecto al `timestamp_ms` del modelo (y `screenshot_timestamp_ms` si se indica `fps`).
+    """
+    for step in steps_list:
+        record = frame_records.get(step.get("step_number"))
+        if record is None:
             continue
+        step["screenshot_frame_offset"] = record["frame_index"] - record["target_frame"]
+        if fps:
+            step["screenshot_timestamp_ms"] = int(record["frame_index"] / fps * 1000)
+
+def extract_screenshots(json_path: str, video_path: str, output_dir: str, mode: str = None, profile: str = None,
+                        step_images: dict = None, write_to_disk: bool = True, video_hash: str = None):
+    """
+    Lee JSON complejo (v0.3), extrae fotogramas basados en los timestamps originales del JSON
+    y los guarda en `output_dir` con nombres direccionados por contenido (hash del video +
+    fotograma) más un manifiesto por paso. En re-ejecuciones solo se extraen los fotogramas que
+    todavía no están. Devuelve True/False.
+    (Versión v0.3 - Usa clave 'section_3_3_detailed_steps')
+
+    `mode` ('parallel', 'forward' o 'seek', por defecto EXTRACTION_MODE) elige cómo se recorre el video
+    y `profile` (por defecto SCREENSHOT_PROFILE, ver screenshot_encoding.py) cómo se codifican las imágenes.
+
+    Si se pasa un diccionario `step_images`, se completa con las imágenes codificadas en memoria
+    ({step_number: {data, width, height, format}}) para que el DOCX las incruste sin leer el disco.
+    Con `write_to_disk=False` no se escriben archivos (ni manifiesto): solo tiene sentido con `step_images`.
+    `video_hash` (opcional): SHA-256 del video si ya se calculó (evita volver a leer el original).
+    """
+    print(f"--- Iniciando Fase 2.2 (Adaptada para v0.3): Extracción de Screenshots ---")
+    print(f"JSON de entrada (Complejo): {json_path}")
+    print(f"Video de entrada: {video_path}")
+    print(f"Directorio de salida: {output_dir}")
 
-        print(f"  - Procesando Paso {step_number}: @ {timestamp_ms} ms")
-        timestamp_sec = timestamp_ms / 1000.0
-        target_frame = int(timestamp_sec * fps)
-
-        # Asegurar que el índice esté dentro de los límites
-        if target_frame >= total_frames:
-            print(f"    Advertencia: Timestamp {timestamp_ms}ms (fotograma {target_frame}) excede total ({total_frames}). Usando último.")
-            target_frame = total_frames - 1
-        elif target_frame < 0:
-             print(f"    Advertencia: Timestamp {timestamp_ms}ms resulta en fotograma negativo ({target_frame}). Usando primero (0).")
-             target_frame = 0
-
-        # Posicionar y leer el fotograma exacto del timestamp original
-        video_capture.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-        ret, frame = video_capture.read()
-
-        if ret:
-            screenshot_filename = f"screenshot_paso_{step_number}.png"
-            screenshot_path = os.path.join(output_dir, screenshot_filename)
-            try:
-                save_success = cv2.imwrite(screenshot_path, frame)
-                if save_success:
-                    print(f"    -> Screenshot guardado en: '{screenshot_path}'")
-                    extracted_count += 1
-                else:
-                     print(f"    Error: OpenCV reportó fallo al guardar '{screenshot_path}'.")
-                     error_count += 1
-            except Exception as e:
-                 print(f"    Error: Excepción inesperada al guardar screenshot para paso {step_number}: {e}")
-                 error_count += 1
+    # 1. Cargar datos del JSON Complejo
+    print(f"\n[Paso 1/5] Cargando datos complejos desde '{json_path}'...")
+    steps_list = [] # Inicializar como lista vacía
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            full_data = json.load(f)
+        print(f"Datos JSON complejos cargados exitosamente.")
+
+        # --- CORRECCIÓN AQUÍ: Usar la clave correcta del JSON v0.3 ---
+        steps_key_name = "section_3_3_detailed_steps" # <--- Clave v0.3
+        steps_list = full_data.get(steps_key_name, [])
+        # --- FIN CORRECCIÓN ---
+
+        if not steps_list:
+             # Mensaje de advertencia actualizado para reflejar la clave buscada
+             print(f"Advertencia: No se encontró la lista '{steps_key_name}' o está vacía en '{json_path}'. No se extraerán screenshots.")
+        print(f"Se encontraron {len(steps_list)} pasos detallados para procesar.")
+    except FileNotFoundError:
+        print(f"Error Crítico: No se encontró el archivo JSON en '{json_path}'")
+        return False
+    except json.JSONDecodeError as e:
+        print(f"Error Crítico: El archivo '{json_path}' no contiene un JSON válido.")
+        print(f"Detalle del error: {e}")
+        return False
+    except Exception as e:
+        print(f"Error Crítico inesperado al leer el JSON: {e}")
+        return False
+
+    # 2. Asegurar el Directorio de Salida (sin limpiarlo: se reutiliza lo ya extraído)
+    if write_to_disk and not prepare_output_dir(output_dir):
+        return False # Falla si no podemos asegurar el directorio
+
+    # Si no había pasos en el JSON, terminamos aquí exitosamente
+    if not steps_list:
+        print("\nNo hay pasos detallados para procesar. Finalizando extracción.")
+        return True
+
+    # 3-4. Abrir el archivo de video y obtener información (sin cambios)
+    video_capture, fps, total_frames = open_video(video_path)
+    if video_capture is None:
+        return False
+
+    # 5. Procesar cada paso: reutilizar lo que ya figura en el manifiesto y extraer el resto
+    mode = mode or EXTRACTION_MODE
+    print(f"\n[Paso 5/5] Procesando pasos y extrayendo fotogramas originales (modo '{mode}')...")
+    video_hash = video_hash or compute_file_hash(video_path)
+    encoder = ScreenshotEncoder(profile, keep_in_memory=step_images is not None, write_to_disk=write_to_disk)
+    manifest = load_manifest(output_dir, video_hash, selection_signature(encoder))
+    steps_by_frame, skipped = group_steps_by_frame(steps_list, fps, total_frames)
+    frame_records = {}
+    counts = new_counts()
+    pending_groups = []
+    for target_frame, step_numbers in sorted(steps_by_frame.items()):
+        record = lookup_target(manifest, output_dir, target_frame)
+        if record is None:
+            pending_groups.append((target_frame, step_numbers))
         else:
-            print(f"    Error: No se pudo leer el fotograma {target_frame} para el paso {step_number}.")
-            error_count += 1
-    # --- Fin del bucle for ---
+            reuse_target(record, target_frame, step_numbers, output_dir, encoder, counts, frame_records)
+    counts["skipped"] += skipped
+
+    with encoder:
+        if pending_groups and mode == "parallel":
+            video_capture.release() # Cada proceso abre su propio VideoCapture
+            mode_counts = extract_frames_parallel(video_path, fps, total_frames, pending_groups, output_dir,
+                                                  video_hash, encoder, frame_records)
+        elif pending_groups and mode == "forward":
+            mode_counts = extract_frames_forward(video_capture, fps, total_frames, pending_groups, output_dir,
+                                                 video_hash, encoder, frame_records)
+        else:
+            mode_counts = new_counts()
+            for target_frame, step_numbers in pending_groups:
+                _extract_group_seek(video_capture, fps, total_frames, target_frame, step_numbers, output_dir,
+                                    video_hash, encoder, mode_counts, frame_records)
+            collect_encoded(encoder, mode_counts, frame_records)
+    for status, count in mode_counts.items():
+        counts[status] += count
+    extracted_count, reused_count, skipped_count, error_count = (counts["extracted"], counts["reused"],
+                                                                 counts["skipped"], counts["error"])
+
+    if step_images is not None:
+        step_images.update(build_step_images(frame_records, encoder, output_dir))
+
+    # Registrar el manifiesto y, en el JSON, el desplazamiento del fotograma elegido por paso
+    try:
+        if write_to_disk:
+            record_extraction(manifest, frame_records)
+            save_manifest(output_dir, manifest)
+            prune_screenshots(output_dir, manifest)
+        apply_frame_offsets(steps_list, frame_records, fps)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(full_data, f, indent=2, ensure_ascii=False)
+    except OSError as e:
+        print(f"Advertencia: No se pudo guardar el manifiesto o actualizar '{json_path}': {e}")
 
     # --- Limpieza Final ---
     print("\n--- Proceso de Extracción Finalizado ---")
     print(f"Screenshots extraídos exitosamente: {extracted_count}")
+    print(f"Screenshots reutilizados (ya presentes): {reused_count}")
     print(f"Pasos omitidos (datos faltantes en JSON): {skipped_count}")
     print(f"Errores durante la extracción/guardado: {error_count}")
+    print_encoding_stats(encoder.stats, encoder.profile_name)
     video_capture.release()
     print("Recurso de video liberado.")
 
@@ -171,6 +600,119 @@ def extract_screenshots(json_path: str, video_path: str, output_dir: str):
         return False
     return True
 
+class IncrementalScreenshotExtractor:
+    """
+    Extrae screenshots en un hilo de fondo a medida que llegan los pasos.
+
+    Pensado para el modo streaming del análisis: cada paso se encola con `submit()`
+    en cuanto el modelo lo termina de escribir, y la extracción (búsqueda del fotograma
+    y guardado) ocurre mientras el modelo sigue generando el resto de la respuesta.
+    Los pasos ya procesados (por `step_number`) se ignoran si se vuelven a enviar, y los
+    fotogramas que ya figuran en el manifiesto de la carpeta se reutilizan.
+    Con `keep_in_memory=True`, tras `finish()` las imágenes quedan en `step_images`
+    (ver `extract_screenshots`).
+    """
+
+    _STOP = object()
+
+    def __init__(self, video_path: str, output_dir: str, profile: str = None, keep_in_memory: bool = False,
+                 write_to_disk: bool = True, video_hash: str = None):
+        self.video_path = video_path
+        self.output_dir = output_dir
+        self._encoder = ScreenshotEncoder(profile, keep_in_memory=keep_in_memory, write_to_disk=write_to_disk)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._seen_steps = set()
+        self._manifest = None
+        self._video_hash = video_hash # SHA-256 del video si ya se calculó (si no, se calcula en start())
+        self.counts = new_counts()
+        self.frame_records = {} # {step_number: {target_frame, frame_index, file, width, height}} (ver `apply_frame_offsets`)
+        self.step_images = {}
+        self.fps = None
+
+    def start(self) -> bool:
+        """Prepara el directorio de salida, abre el video y arranca el hilo. Devuelve True/False."""
+        print(f"--- Iniciando Fase 2.2 (Incremental): Extracción de Screenshots en paralelo al análisis ---")
+        if self._encoder.write_to_disk and not prepare_output_dir(self.output_dir):
+            return False
+        video_capture, fps, total_frames = open_video(self.video_path)
+        if video_capture is None:
+            return False
+        self.fps = fps
+        self._video_hash = self._video_hash or compute_file_hash(self.video_path)
+        self._manifest = load_manifest(self.output_dir, self._video_hash, selection_signature(self._encoder))
+        self._thread = threading.Thread(
+            target=self._run, args=(video_capture, fps, total_frames), name="screenshot-extractor", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def submit(self, step: dict):
+        """Encola un paso para extraer su screenshot (ignora pasos ya enviados)."""
+        step_number = step.get("step_number")
+        if step_number is not None and step_number in self._seen_steps:
+            return
+        self._seen_steps.add(step_number)
+        self._queue.put(step)
+
+    def finish(self, remaining_steps: list = None) -> bool:
+        """
+        Encola los pasos que falten, espera a que termine el hilo, guarda el manifiesto y libera el video.
+
+        Returns:
+            True si no hubo errores de extracción/guardado.
+        """
+        for step in remaining_steps or []:
+            self.submit(step)
+        if self._thread is None:
+            return False
+        self._queue.put(self._STOP)
+        self._thread.join()
+        collect_encoded(self._encoder, self.counts, self.frame_records)
+        self._encoder.close()
+        if self._encoder.keep_in_memory:
+            self.step_images = build_step_images(self.frame_records, self._encoder, self.output_dir)
+        try:
+            if self._encoder.write_to_disk:
+                record_extraction(self._manifest, self.frame_records)
+                save_manifest(self.output_dir, self._manifest)
+                prune_screenshots(self.output_dir, self._manifest)
+        except OSError as e:
+            print(f"Advertencia: No se pudo guardar el manifiesto de screenshots: {e}")
+        print("\n--- Proceso de Extracción Incremental Finalizado ---")
+        print(f"Screenshots extraídos exitosamente: {self.counts['extracted']}")
+        print(f"Screenshots reutilizados (ya presentes): {self.counts['reused']}")
+        print(f"Pasos omitidos (datos faltantes en JSON): {self.counts['skipped']}")
+        print(f"Errores durante la extracción/guardado: {self.counts['error']}")
+        print_encoding_stats(self._encoder.stats, self._encoder.profile_name)
+        return self.counts["error"] == 0
+
+    def _run(self, video_capture, fps, total_frames):
+        try:
+            while True:
+                step = self._queue.get()
+                if step is self._STOP:
+                    break
+                step_number = step.get("step_number")
+                try:
+                    target_frame = resolve_step_frame(step, fps, total_frames)
+                    if target_frame is None:
+                        self.counts["skipped"] += 1
+                        continue
+                    record = lookup_target(self._manifest, self.output_dir, target_frame)
+                    if record is not None:
+                        reuse_target(record, target_frame, [step_number], self.output_dir, self._encoder,
+                                     self.counts, self.frame_records)
+                        continue
+                    _extract_group_seek(video_capture, fps, total_frames, target_frame, [step_number],
+                                        self.output_dir, self._video_hash, self._encoder, self.counts,
+                                        self.frame_records)
+                except Exception as e:
+                    print(f"    Error: Excepción inesperada extrayendo el paso {step.get('step_number', '?')}: {e}")
+                    self.counts["error"] += 1
+        finally:
+            video_capture.release()
+
 # --- Bloque de Ejecución Principal ---
 if __name__ == "__main__":
     # Llamar a la función original
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Lock de archivo entre procesos (y entre hilos) para las lecturas-modificaciones-escrituras
+de archivos compartidos: estadísticas del caché, calibración de costos, etc.
+
+Usa `fcntl.flock` en Linux/macOS y `msvcrt.locking` en Windows. El lock se toma sobre un
+archivo auxiliar (ej: 'cost_calibration.json.lock'), nunca sobre el archivo de datos, que se
+sigue reemplazando de forma atómica con os.replace.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_SUFFIX = '.lock'
+WINDOWS_LOCK_RETRY_SEC = 0.05 # Intervalo de reintento de msvcrt (su bloqueo "bloqueante" desiste a los ~10 s)
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Mantiene un lock exclusivo sobre `path + LOCK_SUFFIX` durante el bloque `with`.
+
+    Cada uso abre su propio descriptor, por lo que excluye también a otros hilos del mismo proceso.
+    El archivo auxiliar no se elimina al terminar (eliminarlo abriría una carrera con quien espera).
+    """
+    fd = os.open(path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(WINDOWS_LOCK_RETRY_SEC)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
@@ -1,13 +1,33 @@
 # -*- coding: utf-8 -*-
-import json
+import io
+import re
+from collections import deque
+from itertools import islice
 import os
 import sys
-import cv2 # Necesario para leer dimensiones de imagen
+from xml.sax.saxutils import escape
+import cv2 # Necesario para leer dimensiones de imagen y remuestrear screenshots
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.enum.table import WD_ROW_HEIGHT_RULE, WD_CELL_VERTICAL_ALIGNMENT
-from datetime import datetime # Para fecha de generación
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.image.image import Image
+from docx.parts.image import ImagePart
+from docx.text.paragraph import Paragraph
+
+from docx_stream import StreamingDocxWriter
+from screenshot_store import load_step_records
+from screenshot_encoding import encode_frame, get_profile
+from pdd_model import (PDD_OUTLINE, AI_NOTE_TEXT, AI_NOTE_TEXT_SPECULATIVE, STEPS_NOTE_TEXT, STEPS_TABLE_HEADERS,
+                       DOCUMENT_TITLE, APPROVERS_PLACEHOLDER, load_analysis_json, build_pdd_model, exception_lines)
+from docx_template import (load_template_bytes, open_template, add_bookmark, find_bookmarks, set_bookmark_text,
+                           bookmark_paragraph, replace_paragraph)
 
 # --- Configuración ---
 # Asegúrate que coincidan con main.py y los outputs de fases anteriores
@@ -19,14 +39,40 @@ DEFAULT_USER_METADATA = { # Valores por defecto si no se pasan desde main.py
     "project_name": "PDD Agent Process", "project_acronym": "PDDAGENT",
     "author_name": "AutoGenerated", "version": "0.3", "status": "BORRADOR" # Status en Español
 }
+SCREENSHOT_DISPLAY_WIDTH_INCHES = 2.5   # Ancho de los screenshots en la tabla de pasos
+SCREENSHOT_TARGET_DPI = 150             # Resolución de incrustación (None: incrustar la imagen original)
+SCREENSHOT_EMBED_PROFILE = 'jpeg'       # Perfil (screenshot_encoding.py) de las imágenes remuestreadas
+DOCX_IMAGE_WORKERS = min(4, os.cpu_count() or 1)  # Hilos que preparan las imágenes antes de incrustarlas
+STEPS_TABLE_BULK = True                 # Generar las filas de la tabla de pasos como XML en bloque (más rápido)
+DOCX_TEMPLATE_MODE = True               # Partir de una plantilla cacheada en memoria en vez de reconstruir la estructura
+DOCX_TEMPLATE_PATH = None               # .docx con marcadores (ver README); None: esqueleto de `build_pdd_skeleton`
+DOCX_STREAMING_WRITER = False           # Escribir la tabla de pasos directamente en el .docx (memoria constante, ver docx_stream.py)
 # --- Fin Configuración ---
 
 # --- Constantes ---
-# Notas y placeholders en español
-AI_NOTE_TEXT = "(Nota: El siguiente texto fue generado por IA basado en el análisis del video y puede requerir revisión y edición.)"
-AI_NOTE_TEXT_SPECULATIVE = "(Nota: El siguiente texto es una sugerencia altamente especulativa generada por IA basada en el análisis del video y requiere revisión humana significativa, validación y potencialmente reescritura completa.)"
 PLACEHOLDER_STYLE_COLOR = RGBColor(128, 128, 128) # Gris para placeholders
 
+STEPS_TABLE_BOOKMARK = "pdd_steps_table"
+
+# Plantillas de la fila de pasos (mismo formato que producen las llamadas de python-docx de la tabla)
+_XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_STEP_ROW_XML = '<w:tr><w:trPr><w:trHeight w:hRule="auto"/></w:trPr>{cells}</w:tr>'
+_STEP_CELL_XML = ('<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/><w:vAlign w:val="{valign}"/></w:tcPr>'
+                  '<w:p><w:pPr><w:jc w:val="{align}"/></w:pPr>{runs}</w:p></w:tc>')
+_TEXT_RUN_XML = ('<w:r><w:rPr><w:b w:val="0"/><w:i w:val="0"/><w:sz w:val="20"/></w:rPr>'
+                 '<w:t xml:space="preserve">{text}</w:t></w:r>')
+_PLACEHOLDER_RUN_XML = ('<w:r><w:rPr><w:b w:val="0"/><w:i/><w:color w:val="808080"/><w:sz w:val="22"/></w:rPr>'
+                        '<w:t xml:space="preserve">{text}</w:t></w:r>')
+_PICTURE_RUN_XML = (
+    '<w:r><w:drawing><wp:inline><wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{shape_id}" name="Picture {shape_id}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="{filename}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rId}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/></pic:spPr>'
+    '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+)
+
 # --- Funciones Auxiliares ---
 # (Sin cambios funcionales)
 def set_run_font(run, size_pt=11, bold=False, italic=False, color=None):
@@ -60,55 +106,55 @@ def add_heading_with_level(document, text, level):
         run.bold = True
         print(f"Advertencia: Nivel de encabezado inválido ({level}) para '{text}'. Usando párrafo en negrita.")
 
-def add_ai_generated_section(document, title, level, json_data, json_key, speculative=False):
-    """Añade una sección con texto generado por IA (si existe) y la nota."""
-    print(f"  - Añadiendo sección '{title}'...")
-    add_heading_with_level(document, title, level) # Title can be mixed language
-    text_from_ai = json_data.get(json_key)
+def add_ai_generated_text(document, text_from_ai, json_key, speculative=False):
+    """Añade el párrafo con la nota de IA y el texto generado (o un placeholder si faltaba en el JSON)."""
     p = document.add_paragraph()
     add_ai_note(p, speculative)
     if text_from_ai:
         p.add_run(text_from_ai) # El texto ya viene en español del JSON
     else:
         add_placeholder(p, f"La IA no generó texto para '{json_key}' o faltaba en el JSON.")
+
+def add_ai_field_section(document, title, level, json_key):
+    """Añade una sección con texto de IA: el encabezado y un campo de bloque `json_key`."""
+    add_heading_with_level(document, title, level) # Title can be mixed language
+    add_bookmark(document.add_paragraph(), json_key)
     document.add_paragraph()
 
 def add_manual_placeholder_section(document, title, level, placeholder_text):
     """Añade una sección que debe ser completada manualmente."""
-    print(f"  - Añadiendo placeholder para sección '{title}'...")
     add_heading_with_level(document, title, level) # Title can be mixed language
     p = document.add_paragraph()
     add_placeholder(p, placeholder_text) # Placeholder text should be in Spanish
     document.add_paragraph()
 
 # --- Funciones Principales de Sección ---
-# (Sin cambios en add_title_page, add_toc_placeholder, handle_bpmn_section, add_detailed_steps_table, add_exceptions_suggestions)
-def add_title_page(document, user_metadata, ai_metadata):
-    """Añade la página de título y metadatos iniciales."""
-    print("  - Añadiendo página de título...")
-    process_name = ai_metadata.get('process_name_suggestion') or user_metadata.get('project_name', 'Proceso Desconocido')
-    acronym = ai_metadata.get('potential_acronym') or user_metadata.get('project_acronym', '')
-    acronym_str = f"({acronym})" if acronym else ""
-
+def add_title_page(document):
+    """Añade la página de título, con campos de texto (marcadores) para los metadatos del proceso."""
     # Título principal en inglés
-    document.add_heading("Process Description Document (PDD)", level=0)
+    document.add_heading(DOCUMENT_TITLE, level=0)
     p_name = document.add_paragraph()
-    run_name = p_name.add_run(f"{process_name} {acronym_str}") # Process name comes from AI (Spanish)
+    run_name = p_name.add_run("<Nombre del Proceso>")
     run_name.bold = True
     run_name.font.size = Pt(16)
+    add_bookmark(p_name, "pdd_process_name", run_name)
     p_name.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
 
     p_ver = document.add_paragraph()
     p_ver.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    # Usar estado en español
-    run_ver = p_ver.add_run(f"Version {user_metadata.get('version', '<x.x>')} - {user_metadata.get('status', 'BORRADOR')}")
-    run_ver.italic = True
+    for text, field in (("Version ", None), ("<x.x>", "pdd_version"), (" - ", None), ("BORRADOR", "pdd_status")):
+        run_ver = p_ver.add_run(text)
+        run_ver.italic = True
+        if field:
+            add_bookmark(p_ver, field, run_ver)
 
-    document.add_paragraph(f"Preparado por: {user_metadata.get('author_name', '<Nombre Autor>')}")
-    document.add_paragraph(f"Fecha: {datetime.now().strftime('%Y-%m-%d')}")
+    p_author = document.add_paragraph("Preparado por: ")
+    add_bookmark(p_author, "pdd_author", p_author.add_run("<Nombre Autor>"))
+    p_date = document.add_paragraph("Fecha: ")
+    add_bookmark(p_date, "pdd_date", p_date.add_run("<AAAA-MM-DD>"))
 
     p_app = document.add_paragraph()
-    add_placeholder(p_app, "Tabla o lista de Aprobadores: Nombre, Rol, Fecha Firma")
+    add_placeholder(p_app, APPROVERS_PLACEHOLDER)
     document.add_page_break()
 
 def add_toc_placeholder(document):
@@ -121,41 +167,341 @@ def add_toc_placeholder(document):
     add_placeholder(p, "Insertar Tabla de Contenidos aquí (Ej: En MS Word: Referencias -> Tabla de Contenidos -> Tabla Automática)")
     document.add_page_break()
 
-def handle_bpmn_section(document, bpmn_xml_string, output_bpmn_path):
-    """Guarda el archivo BPMN y añade instrucciones/placeholder en el DOCX."""
-    print("  - Manejando sección BPMN...")
-    # Título mixto
-    add_heading_with_level(document, "3.2 Process Flow Diagram As-Is (BPMN 2.0)", level=2)
-    if bpmn_xml_string:
-        try:
-            with open(output_bpmn_path, 'w', encoding='utf-8') as f_bpmn:
-                f_bpmn.write(bpmn_xml_string)
-            print(f"    -> Archivo BPMN XML guardado en: '{output_bpmn_path}'")
-            p = document.add_paragraph()
-            # Instrucciones en español
-            p.add_run("Instrucciones:").bold = True
-            p.add_run(f"\n1. Importar el archivo generado ")
-            run_fname = p.add_run(f"'{os.path.basename(output_bpmn_path)}'")
-            run_fname.italic = True
-            p.add_run(" en una herramienta de modelado BPMN (ej: bpmn.io online, draw.io, Camunda Modeler).")
-            p.add_run("\n2. Revisar y editar significativamente el diagrama para reflejar con precisión el flujo del proceso actual (As-Is), incluyendo decisiones, caminos paralelos, etc.")
-            p.add_run("\n3. Exportar el diagrama final como imagen (PNG recomendado).")
-            p.add_run("\n4. Eliminar este texto de instrucciones y pegar la imagen exportada a continuación.")
-            p_paste = document.add_paragraph("\n")
-            add_placeholder(p_paste, "<< PEGUE AQUÍ LA IMAGEN DEL DIAGRAMA BPMN AS-IS >>")
-            p_paste.add_run("\n")
-        except Exception as e:
-            print(f"    Error al guardar BPMN XML en '{output_bpmn_path}': {e}")
-            p_err = document.add_paragraph()
-            add_placeholder(p_err, f"Error al guardar el archivo BPMN XML: {e}. Revise la salida de la IA o los permisos.")
+def write_bpmn_file(bpmn_xml_string, output_bpmn_path):
+    """Guarda el archivo BPMN. Devuelve None si se guardó (o no hay BPMN) o un mensaje de error."""
+    if not bpmn_xml_string:
+        return None
+    try:
+        with open(output_bpmn_path, 'w', encoding='utf-8') as f_bpmn:
+            f_bpmn.write(bpmn_xml_string)
+        print(f"    -> Archivo BPMN XML guardado en: '{output_bpmn_path}'")
+        return None
+    except Exception as e:
+        print(f"    Error al guardar BPMN XML en '{output_bpmn_path}': {e}")
+        return str(e)
+
+def add_bpmn_instructions(document, bpmn_xml_string, output_bpmn_path, bpmn_error=None):
+    """Añade instrucciones/placeholder de la sección BPMN (el archivo se guarda con `write_bpmn_file`)."""
+    if bpmn_xml_string and not bpmn_error:
+        p = document.add_paragraph()
+        # Instrucciones en español
+        p.add_run("Instrucciones:").bold = True
+        p.add_run(f"\n1. Importar el archivo generado ")
+        run_fname = p.add_run(f"'{os.path.basename(output_bpmn_path)}'")
+        run_fname.italic = True
+        p.add_run(" en una herramienta de modelado BPMN (ej: bpmn.io online, draw.io, Camunda Modeler).")
+        p.add_run("\n2. Revisar y editar significativamente el diagrama para reflejar con precisión el flujo del proceso actual (As-Is), incluyendo decisiones, caminos paralelos, etc.")
+        p.add_run("\n3. Exportar el diagrama final como imagen (PNG recomendado).")
+        p.add_run("\n4. Eliminar este texto de instrucciones y pegar la imagen exportada a continuación.")
+        p_paste = document.add_paragraph("\n")
+        add_placeholder(p_paste, "<< PEGUE AQUÍ LA IMAGEN DEL DIAGRAMA BPMN AS-IS >>")
+        p_paste.add_run("\n")
+    elif bpmn_xml_string:
+        p_err = document.add_paragraph()
+        add_placeholder(p_err, f"Error al guardar el archivo BPMN XML: {bpmn_error}. Revise la salida de la IA o los permisos.")
     else:
         print("    Advertencia: No se encontró código BPMN XML en el JSON.")
         p_warn = document.add_paragraph()
         add_placeholder(p_warn, "No se encontró código BPMN XML en la salida del análisis de IA.")
+
+def add_bpmn_section(document, bpmn_xml_string, output_bpmn_path, bpmn_error=None):
+    """Añade la sección 3.2 completa (encabezado e instrucciones/placeholder del BPMN)."""
+    # Título mixto
+    add_heading_with_level(document, "3.2 Process Flow Diagram As-Is (BPMN 2.0)", level=2)
+    add_bpmn_instructions(document, bpmn_xml_string, output_bpmn_path, bpmn_error)
     document.add_paragraph()
 
-def add_detailed_steps_table(document, steps_list, screenshot_dir):
-    """Añade la tabla de pasos detallados con screenshots (CORREGIDO)."""
+def handle_bpmn_section(document, bpmn_xml_string, output_bpmn_path):
+    """Guarda el archivo BPMN y añade instrucciones/placeholder en el DOCX."""
+    add_bpmn_section(document, bpmn_xml_string, output_bpmn_path, write_bpmn_file(bpmn_xml_string, output_bpmn_path))
+
+def _prepare_picture(source: dict, target_width_px: int, profile: dict) -> dict:
+    """
+    Prepara la imagen de un paso para incrustarla: si es más ancha que `target_width_px` (o su
+    formato no se puede incrustar) se decodifica, se reduce y se re-codifica con `profile`;
+    si no, se usan sus bytes tal cual.
+
+    Returns:
+        {data, width, height, format}.
+    """
+    data = source.get("data")
+    if data is None:
+        with open(source["path"], 'rb') as f:
+            data = f.read()
+    width, height = source.get("width"), source.get("height")
+    embeddable = source.get("format", "png") in ("png", "jpeg")
+    if embeddable and width and height and (not target_width_px or width <= target_width_px):
+        return {"data": data, "width": width, "height": height, "format": source.get("format", "png")}
+
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("OpenCV no pudo leer la imagen.")
+    height, width = frame.shape[:2]
+    if target_width_px and width > target_width_px:
+        height = max(1, int(round(height * target_width_px / width)))
+        width = target_width_px
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    elif embeddable:
+        return {"data": data, "width": width, "height": height, "format": source.get("format", "png")}
+    data, (width, height) = encode_frame(frame, profile)
+    return {"data": data, "width": width, "height": height, "format": profile["format"]}
+
+def _picture_sources(steps_list, screenshot_dir, step_images=None, video_hash: str = None) -> dict:
+    """
+    Origen de la imagen de cada paso: `step_images` ({step_number: {data, width, height, format}}, ver
+    `extract_screenshots`) o, si no está, el archivo de `screenshot_dir` según su manifiesto. Con
+    `video_hash` se ignora el manifiesto de otro video (ej: pasos cuya extracción falló en esta ejecución).
+
+    Returns:
+        {step_number: {data o path, width, height, format}}; los pasos sin screenshot no aparecen.
+    """
+    step_images = step_images or {}
+    step_records = load_step_records(screenshot_dir, video_hash) # Manifiesto de la extracción
+    sources = {}
+    for step in steps_list:
+        step_number = step.get("step_number", "N/A")
+        if step_number in step_images:
+            sources[step_number] = step_images[step_number]
+            continue
+        record = step_records.get(str(step_number))
+        screenshot_path = record["path"] if record else None
+        if screenshot_path and os.path.exists(screenshot_path):
+            extension = os.path.splitext(screenshot_path)[1].lower()
+            sources[step_number] = {"path": screenshot_path, "width": record.get("width"), "height": record.get("height"),
+                                    "format": {".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}.get(extension, "png")}
+    return sources
+
+def _prepare_picture_safe(source: dict, target_width_px: int, profile: dict) -> dict:
+    """`_prepare_picture` que devuelve {error} en lugar de lanzar la excepción."""
+    try:
+        return _prepare_picture(source, target_width_px, profile)
+    except Exception as e:
+        return {"error": str(e)}
+
+def _target_width_px(display_width_inches: float = None, target_dpi: int = None):
+    """Ancho en píxeles de las imágenes incrustadas (None: sin remuestreo)."""
+    display_width_inches = display_width_inches or SCREENSHOT_DISPLAY_WIDTH_INCHES
+    target_dpi = SCREENSHOT_TARGET_DPI if target_dpi is None else target_dpi
+    return int(display_width_inches * target_dpi) if target_dpi else None
+
+def prepare_step_pictures(steps_list, screenshot_dir, step_images=None, display_width_inches: float = None,
+                          target_dpi: int = None, workers: int = None, video_hash: str = None) -> dict:
+    """
+    Prepara en un pool de hilos las imágenes de la tabla de pasos, remuestreadas a `target_dpi`
+    para su tamaño de presentación (así el DOCX no arrastra los originales a resolución completa).
+    El origen de cada imagen se resuelve con `_picture_sources` (`video_hash`: ver allí).
+
+    Returns:
+        {step_number: {data, width, height, format} o {error}}; los pasos sin screenshot no aparecen.
+    """
+    target_dpi = SCREENSHOT_TARGET_DPI if target_dpi is None else target_dpi
+    target_width_px = _target_width_px(display_width_inches, target_dpi)
+    profile = get_profile(SCREENSHOT_EMBED_PROFILE)
+    sources = _picture_sources(steps_list, screenshot_dir, step_images, video_hash)
+
+    with ThreadPoolExecutor(max_workers=workers or DOCX_IMAGE_WORKERS) as executor: # OpenCV libera el GIL
+        pictures = dict(zip(sources, executor.map(lambda source: _prepare_picture_safe(source, target_width_px, profile),
+                                                  sources.values())))
+    original_bytes = sum(len(source["data"]) if "data" in source else os.path.getsize(source["path"])
+                         for source in sources.values())
+    embedded_bytes = sum(len(picture.get("data", b"")) for picture in pictures.values())
+    if sources:
+        print(f"    -> {len(pictures)} imágenes preparadas"
+              f"{f' a {target_dpi} DPI' if target_dpi else ''}: "
+              f"{original_bytes / (1024 * 1024):.1f} MiB -> {embedded_bytes / (1024 * 1024):.1f} MiB.")
+    return pictures
+
+def iter_step_pictures(steps_list, screenshot_dir, step_images=None, pictures=None, workers: int = None,
+                       video_hash: str = None):
+    """
+    Devuelve (step_number, imagen o None) por cada paso, en orden, con la imagen preparada como en
+    `prepare_step_pictures` pero solo unas pocas por delante del paso en curso (ventana de
+    DOCX_IMAGE_WORKERS * 2), así la memoria no crece con el número de pasos.
+
+    Con `pictures` (ya preparadas, con `data` o con `path` a la imagen guardada) no se prepara nada:
+    cada imagen se lee en su turno. `video_hash`: ver `_picture_sources`.
+    """
+    if pictures is not None:
+        for step in steps_list:
+            step_number = step.get("step_number", "N/A")
+            picture = pictures.get(step_number)
+            if picture is not None and "data" not in picture and "path" in picture:
+                try:
+                    with open(picture["path"], 'rb') as f:
+                        picture = {**picture, "data": f.read()}
+                except OSError as e:
+                    picture = {"error": str(e)}
+            yield step_number, picture
+        return
+
+    target_width_px = _target_width_px()
+    profile = get_profile(SCREENSHOT_EMBED_PROFILE)
+    sources = _picture_sources(steps_list, screenshot_dir, step_images, video_hash)
+    workers = workers or DOCX_IMAGE_WORKERS
+    remaining = iter(steps_list)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(step):
+            step_number = step.get("step_number", "N/A")
+            source = sources.get(step_number)
+            pending.append((step_number, executor.submit(_prepare_picture_safe, source, target_width_px, profile)
+                            if source is not None else None))
+
+        for step in islice(remaining, workers * 2):
+            submit(step)
+        while pending:
+            step_number, future = pending.popleft()
+            next_step = next(remaining, None)
+            if next_step is not None:
+                submit(next_step)
+            yield step_number, future.result() if future is not None else None
+
+def _xml_text(value) -> str:
+    """Texto escapado para un `w:t` (saltos de línea como `w:br`, como hace `add_run`)."""
+    text = escape(_XML_INVALID_CHARS.sub('', "" if value is None else str(value)))
+    return text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+
+def attach_images_batch(part, blobs: list) -> list:
+    """
+    Registra en lote las imágenes `blobs` en el paquete y las relaciona con `part`.
+
+    Equivale a `part.get_or_add_image` por imagen (incluida la deduplicación por SHA-1), pero los
+    índices de partes, nombres y rIds existentes se leen una sola vez en lugar de recorrerse en
+    cada imagen (costo lineal, no cuadrático, en el número de imágenes).
+
+    Returns:
+        Lista de (rId, Image) en el orden de `blobs`.
+    """
+    image_parts = part.package.image_parts
+    parts_by_sha1 = {image_part.sha1: image_part for image_part in image_parts}
+    used_numbers = {image_part.partname.idx for image_part in image_parts}
+    rids_by_part = {rel.target_part: rel.rId for rel in part.rels.values()
+                    if rel.reltype == RT.IMAGE and not rel.is_external}
+    next_number, next_rid = 1, 1
+    attached = []
+    for blob in blobs:
+        image = Image.from_blob(blob)
+        image_part = parts_by_sha1.get(image.sha1)
+        if image_part is None:
+            while next_number in used_numbers:
+                next_number += 1
+            image_part = ImagePart.from_image(image, PackURI(f"/word/media/image{next_number}.{image.ext}"))
+            used_numbers.add(next_number)
+            image_parts.append(image_part)
+            parts_by_sha1[image.sha1] = image_part
+        rId = rids_by_part.get(image_part)
+        if rId is None:
+            while f"rId{next_rid}" in part.rels:
+                next_rid += 1
+            rId = f"rId{next_rid}"
+            part.rels.add_relationship(RT.IMAGE, image_part, rId)
+            rids_by_part[image_part] = rId
+        attached.append((rId, image))
+    return attached
+
+def _table_widths(table) -> list:
+    """Anchos (dxa) de las columnas según la fila de encabezado."""
+    return [tc.tcPr.tcW.w if tc.tcPr is not None and tc.tcPr.tcW is not None else 0
+            for tc in table.rows[0]._tr.tc_lst]
+
+def _picture_run_xml(image, rId: str, picture: dict, target_width_inches, shape_id: int) -> str:
+    """Run con la imagen `rId` escalada al ancho de presentación."""
+    aspect_ratio = float(picture["height"]) / float(picture["width"]) if picture["width"] > 0 else 1
+    cx, cy = image.scaled_dimensions(target_width_inches, int(target_width_inches * aspect_ratio))
+    return _PICTURE_RUN_XML.format(cx=cx, cy=cy, shape_id=shape_id, rId=rId,
+                                   filename=escape(image.filename, {'"': '&quot;'}))
+
+def _step_row_xml(step: dict, widths: list, picture_runs: str) -> str:
+    """XML de la fila de un paso a partir de las plantillas `_STEP_*_XML` (`picture_runs`: contenido de la celda del screenshot)."""
+    texts = [step.get("step_number", "N/A"), step.get("application_in_focus", "N/A"), step.get("description", "N/A"),
+             step.get("action_type_inferred", "N/A")]
+    cells = [_STEP_CELL_XML.format(width=width, valign="top", align="left", runs=_TEXT_RUN_XML.format(text=_xml_text(text)))
+             for width, text in zip(widths, texts)]
+    cells.append(_STEP_CELL_XML.format(width=widths[4], valign="center", align="center", runs=picture_runs))
+    return _STEP_ROW_XML.format(cells="".join(cells))
+
+def append_step_rows_bulk(document, table, steps_list, pictures: dict, target_width_inches) -> int:
+    """
+    Vía rápida de la tabla de pasos: registra primero todas las imágenes en el paquete (relaciones
+    en lote, ver `attach_images_batch`), genera el XML de todas las filas a partir de las plantillas `_STEP_*_XML` y lo
+    analiza con una sola llamada a `parse_xml`, en lugar de construir celda por celda.
+
+    Returns:
+        Número de screenshots insertados.
+    """
+    part = document.part
+    widths = _table_widths(table)
+    next_shape_id = part.next_id # Se calcula una vez: `next_id` recorre todo el documento
+    valid_pictures = {step_number: picture for step_number, picture in pictures.items() if "error" not in picture}
+    try:
+        attached = dict(zip(valid_pictures, attach_images_batch(part, [p["data"] for p in valid_pictures.values()])))
+    except Exception as e:
+        print(f"    Advertencia: No se pudieron registrar las imágenes en lote ({e}). Se registran una a una.")
+        attached = {}
+    rows_xml = []
+    screenshots_found_count = 0
+    for step in steps_list:
+        step_number = step.get("step_number", "N/A")
+        picture = pictures.get(step_number)
+        if picture is None:
+            runs = _PLACEHOLDER_RUN_XML.format(text=_xml_text("[[Screenshot no encontrado]]"))
+        else:
+            try:
+                if "error" in picture: raise ValueError(picture["error"])
+                rId, image = attached.get(step_number) or part.get_or_add_image(io.BytesIO(picture["data"]))
+                runs = _picture_run_xml(image, rId, picture, target_width_inches, next_shape_id)
+                next_shape_id += 1
+                screenshots_found_count += 1
+            except Exception as e:
+                print(f"    Advertencia: No se pudo leer/insertar la imagen del paso {step_number}: {e}")
+                runs = _PLACEHOLDER_RUN_XML.format(text=_xml_text("[[Error al leer/insertar imagen]]"))
+        rows_xml.append(_step_row_xml(step, widths, runs))
+
+    rows = parse_xml(f'<w:tbl {nsdecls("w", "wp", "a", "pic", "r")}>{"".join(rows_xml)}</w:tbl>')
+    table._tbl.extend(list(rows))
+    return screenshots_found_count
+
+def add_steps_table_shell(document):
+    """
+    Añade la nota y la tabla de pasos con solo la fila de encabezado (el título lo añade quien la llama).
+
+    Returns:
+        La tabla (`docx.table.Table`).
+    """
+    p_note = document.add_paragraph()
+    # Nota en español
+    run_note = p_note.add_run(STEPS_NOTE_TEXT)
+    set_run_font(run_note, 9, italic=True)
+
+    # Encabezados de tabla en inglés
+    headers = STEPS_TABLE_HEADERS
+    table = document.add_table(rows=1, cols=len(headers))
+    table.style = 'Table Grid'
+    table.autofit = False
+    table.allow_autofit = True
+
+    # Rellenar Encabezados
+    hdr_cells = table.rows[0].cells
+    table.rows[0].height_rule = WD_ROW_HEIGHT_RULE.AUTO
+    table.rows[0].height = None
+    for i, header_text in enumerate(headers):
+        cell_paragraph = hdr_cells[i].paragraphs[0]
+        cell_paragraph.clear()
+        run = cell_paragraph.add_run(header_text)
+        set_run_font(run, 10, bold=True)
+        cell_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        hdr_cells[i].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
+    return table
+
+def add_detailed_steps_table(document, steps_list, screenshot_dir, step_images=None, pictures=None):
+    """
+    Añade la tabla de pasos detallados con screenshots (CORREGIDO).
+
+    Las imágenes se preparan antes en paralelo (ver `prepare_step_pictures`: remuestreo a
+    SCREENSHOT_TARGET_DPI) y se incrustan desde memoria; `pictures` permite pasar las ya preparadas
+    (ej: las del modelo del documento, compartidas con los otros formatos). Con STEPS_TABLE_BULK las
+    filas se generan en bloque (ver `append_step_rows_bulk`).
+    """
     print("  - Añadiendo tabla de pasos detallados...")
     # Título mixto
     add_heading_with_level(document, "3.3 Detailed Process Steps As-Is", level=2)
@@ -164,75 +510,55 @@ def add_detailed_steps_table(document, steps_list, screenshot_dir):
         add_placeholder(p, "No se encontraron pasos detallados en la salida del análisis de IA.")
         return 0
 
-    p_note = document.add_paragraph()
-    # Nota en español
-    run_note = p_note.add_run("(Nota: Los siguientes pasos fueron extraídos por IA y pueden requerir revisión y edición para precisión y completitud. Los screenshots corresponden a fotogramas identificados por el script de extracción.)")
-    set_run_font(run_note, 9, italic=True)
-
-    # Encabezados de tabla en inglés
-    headers = ["Step ID", "Application", "Action", "Detailed Description", "Screenshot"]
     try:
-        table = document.add_table(rows=1, cols=len(headers))
-        table.style = 'Table Grid'
-        table.autofit = False
-        table.allow_autofit = True
-
-        # Rellenar Encabezados
-        hdr_cells = table.rows[0].cells
-        table.rows[0].height_rule = WD_ROW_HEIGHT_RULE.AUTO
-        table.rows[0].height = None
-        for i, header_text in enumerate(headers):
-            cell_paragraph = hdr_cells[i].paragraphs[0]
-            cell_paragraph.clear()
-            run = cell_paragraph.add_run(header_text)
-            set_run_font(run, 10, bold=True)
-            cell_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            hdr_cells[i].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
+        table = add_steps_table_shell(document)
 
         screenshots_found_count = 0
-        target_width_inches = Inches(2.5)
-
-        # Rellenar Filas con Pasos
-        for step in steps_list:
-            step_number = step.get("step_number", "N/A")
-            application = step.get("application_in_focus", "N/A")
-            action_summary = step.get("description", "N/A") # Ya viene en español del JSON
-            description_long = step.get("action_type_inferred", "N/A") # Ya viene en español del JSON
-
-            new_row = table.add_row()
-            new_row.height_rule = WD_ROW_HEIGHT_RULE.AUTO
-            new_row.height = None
-            row_cells = new_row.cells
-
-            # Añadir texto a cada celda directamente
-            p0 = row_cells[0].paragraphs[0]; p0.clear(); run0 = p0.add_run(str(step_number)); set_run_font(run0, 10); p0.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[0].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
-            p1 = row_cells[1].paragraphs[0]; p1.clear(); run1 = p1.add_run(application); set_run_font(run1, 10); p1.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[1].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
-            p2 = row_cells[2].paragraphs[0]; p2.clear(); run2 = p2.add_run(action_summary); set_run_font(run2, 10); p2.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[2].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
-            p3 = row_cells[3].paragraphs[0]; p3.clear(); run3 = p3.add_run(description_long); set_run_font(run3, 10); p3.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[3].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
-
-            # Incrustar Screenshot
-            screenshot_filename = f"screenshot_paso_{step_number}.png"
-            screenshot_path = os.path.join(screenshot_dir, screenshot_filename)
-            cell_paragraph_img = row_cells[4].paragraphs[0]
-            cell_paragraph_img.clear()
-            cell_paragraph_img.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            row_cells[4].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
-
-            if os.path.exists(screenshot_path):
-                try:
-                    img = cv2.imread(screenshot_path)
-                    if img is None: raise ValueError("OpenCV no pudo leer la imagen.")
-                    height_px, width_px, _ = img.shape
-                    aspect_ratio = float(height_px) / float(width_px) if width_px > 0 else 1
-                    target_height_inches = target_width_inches * aspect_ratio
-                    run_img = cell_paragraph_img.add_run()
-                    run_img.add_picture(screenshot_path, width=target_width_inches, height=target_height_inches)
-                    screenshots_found_count += 1
-                except Exception as e:
-                    print(f"    Advertencia: No se pudo leer/insertar imagen '{screenshot_path}': {e}")
-                    add_placeholder(cell_paragraph_img, "[Error al leer/insertar imagen]")
-            else:
-                add_placeholder(cell_paragraph_img, "[Screenshot no encontrado]")
+        target_width_inches = Inches(SCREENSHOT_DISPLAY_WIDTH_INCHES)
+        if pictures is None:
+            pictures = prepare_step_pictures(steps_list, screenshot_dir, step_images)
+        if STEPS_TABLE_BULK:
+            screenshots_found_count = append_step_rows_bulk(document, table, steps_list, pictures, target_width_inches)
+        else:
+            # Rellenar Filas con Pasos (vía celda por celda)
+            for step in steps_list:
+                step_number = step.get("step_number", "N/A")
+                application = step.get("application_in_focus", "N/A")
+                action_summary = step.get("description", "N/A") # Ya viene en español del JSON
+                description_long = step.get("action_type_inferred", "N/A") # Ya viene en español del JSON
+
+                new_row = table.add_row()
+                new_row.height_rule = WD_ROW_HEIGHT_RULE.AUTO
+                new_row.height = None
+                row_cells = new_row.cells
+
+                # Añadir texto a cada celda directamente
+                p0 = row_cells[0].paragraphs[0]; p0.clear(); run0 = p0.add_run(str(step_number)); set_run_font(run0, 10); p0.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[0].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
+                p1 = row_cells[1].paragraphs[0]; p1.clear(); run1 = p1.add_run(application); set_run_font(run1, 10); p1.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[1].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
+                p2 = row_cells[2].paragraphs[0]; p2.clear(); run2 = p2.add_run(action_summary); set_run_font(run2, 10); p2.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[2].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
+                p3 = row_cells[3].paragraphs[0]; p3.clear(); run3 = p3.add_run(description_long); set_run_font(run3, 10); p3.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT; row_cells[3].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.TOP
+
+                # Incrustar Screenshot
+                cell_paragraph_img = row_cells[4].paragraphs[0]
+                cell_paragraph_img.clear()
+                cell_paragraph_img.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                row_cells[4].vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
+
+                picture = pictures.get(step_number)
+                if picture is not None:
+                    try:
+                        if "error" in picture: raise ValueError(picture["error"])
+                        width_px, height_px = picture["width"], picture["height"]
+                        aspect_ratio = float(height_px) / float(width_px) if width_px > 0 else 1
+                        target_height_inches = target_width_inches * aspect_ratio
+                        run_img = cell_paragraph_img.add_run()
+                        run_img.add_picture(io.BytesIO(picture["data"]), width=target_width_inches, height=target_height_inches)
+                        screenshots_found_count += 1
+                    except Exception as e:
+                        print(f"    Advertencia: No se pudo leer/insertar la imagen del paso {step_number}: {e}")
+                        add_placeholder(cell_paragraph_img, "[Error al leer/insertar imagen]")
+                else:
+                    add_placeholder(cell_paragraph_img, "[Screenshot no encontrado]")
 
         print(f"    -> Tabla creada con {len(steps_list)} pasos.")
         print(f"    -> Se encontraron e intentaron insertar {screenshots_found_count} screenshots.")
@@ -247,44 +573,242 @@ def add_detailed_steps_table(document, steps_list, screenshot_dir):
         add_placeholder(p_err, f"[Error crítico al generar tabla de pasos detallados: {e}]")
         return 0
 
-def add_exceptions_suggestions(document, exceptions_list):
-    """Añade las sugerencias de excepciones de la IA."""
-    print("  - Añadiendo sugerencias de excepciones IA...")
-    business_exceptions = [e for e in exceptions_list if e.get("exception_type") == "Negocio"]
-    app_exceptions = [e for e in exceptions_list if e.get("exception_type") == "Aplicación"]
-
-    # Sección 5.1 (Título mixto)
-    add_heading_with_level(document, "5.1 Excepciones de Negocio (Business Exceptions)", level=2)
-    p51 = document.add_paragraph()
-    # Placeholder en español (SIN referencia a guía)
-    add_placeholder(p51, "Tabla o lista detallando las desviaciones conocidas del flujo estándar basadas en condiciones de negocio. Para cada una: ID, Descripción, Disparador (Trigger), Pasos de Manejo Requeridos (por robot o humano).")
-    if business_exceptions:
-        p51_ai = document.add_paragraph()
-        add_ai_note(p51_ai, speculative=True)
-        # Título sugerencias en español
-        p51_ai.add_run("Sugerencias IA (Revisar y Detallar):\n").bold = True
-        for ex in business_exceptions:
-            # Usar texto en español del JSON
-            p51_ai.add_run(f"- Desc: {ex.get('description', 'N/A')}\n  Trigger: {ex.get('potential_trigger', 'N/A')}\n  Idea Manejo: {ex.get('suggested_handling_idea', 'N/A')}\n")
-    document.add_paragraph()
+def insert_steps_table(document, anchor, steps_list, screenshot_dir, step_images=None, pictures=None):
+    """
+    Construye la sección 3.3 (tabla de pasos con screenshots) y la coloca en la posición de `anchor`,
+    el párrafo reservado por `build_pdd_document`. Permite generar el resto del documento mientras
+    los screenshots todavía se están extrayendo. `step_images` y `pictures`: ver `add_detailed_steps_table`.
 
-    # Sección 5.2 (Título mixto)
-    add_heading_with_level(document, "5.2 Errores de Aplicación/Sistema (Application/System Errors)", level=2)
-    p52 = document.add_paragraph()
-    # Placeholder en español (SIN referencia a guía)
-    add_placeholder(p52, "Tabla o lista detallando cómo el robot debe manejar errores técnicos. Para cada uno: ID, Descripción, Disparador, Lógica de Manejo (ej: reintentos, log, notificación, detener).")
-    if app_exceptions:
-         p52_ai = document.add_paragraph()
-         add_ai_note(p52_ai, speculative=True)
-         # Título sugerencias en español
-         p52_ai.add_run("Sugerencias IA (Revisar y Detallar):\n").bold = True
-         for ex in app_exceptions:
-             # Usar texto en español del JSON
-             p52_ai.add_run(f"- Desc: {ex.get('description', 'N/A')}\n  Trigger: {ex.get('potential_trigger', 'N/A')}\n  Idea Manejo: {ex.get('suggested_handling_idea', 'N/A')}\n")
-    document.add_paragraph()
+    Returns:
+        Número de screenshots insertados.
+    """
+    return replace_paragraph(document, anchor._p,
+                             lambda doc: add_detailed_steps_table(doc, steps_list, screenshot_dir, step_images, pictures))
 
+def stream_pdd_docx(document, anchor, steps_list, screenshot_dir, output_docx_path: str, step_images=None,
+                    pictures=None, video_hash: str = None) -> bool:
+    """
+    Equivalente a `insert_steps_table` + `save_pdd_document` para procesos muy largos
+    (DOCX_STREAMING_WRITER): el documento se guarda con la tabla de pasos vacía y cada fila y su
+    imagen se escriben directamente en el .docx (ver `docx_stream.StreamingDocxWriter`). Las
+    imágenes se preparan unas pocas por delante de la fila en curso (`iter_step_pictures`), así
+    la memoria no crece con el número de pasos. `step_images` y `pictures`: ver `add_detailed_steps_table`;
+    `video_hash`: ver `_picture_sources`.
+
+    Returns:
+        True si el documento se guardó.
+    """
+    if not steps_list: # Sin filas que escribir en streaming
+        insert_steps_table(document, anchor, steps_list, screenshot_dir)
+        return save_pdd_document(document, output_docx_path)
+
+    print(f"[Paso 3/3] Guardando documento DOCX final (en streaming) en '{output_docx_path}'...")
+    print("  - Añadiendo tabla de pasos detallados...")
+    try:
+        def build_shell(doc):
+            add_heading_with_level(doc, "3.3 Detailed Process Steps As-Is", level=2)
+            shell = add_steps_table_shell(doc)
+            doc.add_paragraph()
+            return shell
+
+        table = replace_paragraph(document, anchor._p, build_shell)
+        widths = _table_widths(table)
+        target_width_inches = Inches(SCREENSHOT_DISPLAY_WIDTH_INCHES)
+        screenshots_found_count = 0
+        with StreamingDocxWriter(document, table._tbl, output_docx_path) as writer:
+            step_pictures = iter_step_pictures(steps_list, screenshot_dir, step_images, pictures, video_hash=video_hash)
+            for step, (step_number, picture) in zip(steps_list, step_pictures):
+                if picture is None:
+                    runs = _PLACEHOLDER_RUN_XML.format(text=_xml_text("[[Screenshot no encontrado]]"))
+                else:
+                    try:
+                        if "error" in picture: raise ValueError(picture["error"])
+                        image = Image.from_blob(picture["data"])
+                        rId = writer.add_image(picture["data"], image.ext)
+                        runs = _picture_run_xml(image, rId, picture, target_width_inches, writer.next_shape_id())
+                        screenshots_found_count += 1
+                    except Exception as e:
+                        print(f"    Advertencia: No se pudo leer/insertar la imagen del paso {step_number}: {e}")
+                        runs = _PLACEHOLDER_RUN_XML.format(text=_xml_text("[[Error al leer/insertar imagen]]"))
+                writer.write_xml(_step_row_xml(step, widths, runs))
+    except Exception as e:
+        print(f"Error Crítico: No se pudo guardar el archivo DOCX en streaming '{output_docx_path}': {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    print(f"    -> Tabla creada con {len(steps_list)} pasos.")
+    print(f"    -> Se encontraron e intentaron insertar {screenshots_found_count} screenshots.")
+    print("¡Documento DOCX guardado exitosamente!")
+    return True
+
+def add_exception_suggestions(document, exceptions_list):
+    """Añade el párrafo de sugerencias de excepciones de la IA (nada si la lista está vacía)."""
+    if not exceptions_list:
+        return
+    p_ai = document.add_paragraph()
+    add_ai_note(p_ai, speculative=True)
+    # Título sugerencias en español
+    p_ai.add_run("Sugerencias IA (Revisar y Detallar):\n").bold = True
+    for ex in exceptions_list:
+        p_ai.add_run("- " + exception_lines(ex).replace("\n", "\n  ") + "\n")
+
+def add_user_roles(document, roles_list):
+    """Añade el párrafo de roles de usuario inferidos por la IA."""
+    p_roles = document.add_paragraph()
+    add_ai_note(p_roles)
+    p_roles.add_run("Roles de Usuario Implicados (Inferidos por IA):\n").bold = True
+    if roles_list:
+        for role in roles_list:
+            p_roles.add_run(f"- {role}\n") # Roles ya vienen en español del JSON
+    else:
+        add_placeholder(p_roles, "No se infirieron roles de usuario.")
 
 # --- Función Principal de Generación ---
+def build_pdd_skeleton():
+    """
+    Construye el esqueleto del PDD a partir de PDD_OUTLINE: toda la estructura fija (página de título,
+    TOC, encabezados y placeholders manuales) con marcadores en los campos que se completan en cada
+    trabajo (ver `fill_pdd_template`). Es también la plantilla por defecto del modo plantilla.
+
+    Returns:
+        El `Document` esqueleto.
+    """
+    document = Document()
+
+    # Página de Título y TOC
+    add_title_page(document)
+    add_toc_placeholder(document)
+
+    # Secciones 1-7
+    for entry in PDD_OUTLINE:
+        if entry["kind"] == "heading":
+            add_heading_with_level(document, entry["title"], entry["level"])
+        elif entry["kind"] == "ai_text":
+            add_ai_field_section(document, entry["title"], entry["level"], entry["key"])
+        elif entry["kind"] == "manual":
+            add_manual_placeholder_section(document, entry["title"], entry["level"], entry["placeholder"])
+            if entry.get("paste"):
+                p_spacer = document.paragraphs[-1]
+                p_spacer.insert_paragraph_before("\n")
+                add_placeholder(p_spacer.insert_paragraph_before(""), entry["paste"])
+                p_spacer.insert_paragraph_before("\n")
+        elif entry["kind"] == "field":
+            if entry.get("title"):
+                add_heading_with_level(document, entry["title"], entry["level"])
+            if entry.get("placeholder"):
+                add_placeholder(document.add_paragraph(), entry["placeholder"])
+            add_bookmark(document.add_paragraph(), f"pdd_{entry['field']}")
+            document.add_paragraph()
+        elif entry["kind"] == "steps":
+            add_bookmark(document.add_paragraph(), STEPS_TABLE_BOOKMARK) # La sección 3.3 se inserta aquí con `insert_steps_table`
+    return document
+
+def save_pdd_template(output_path: str) -> bool:
+    """Guarda el esqueleto por defecto como .docx, punto de partida para una plantilla con marca propia."""
+    try:
+        build_pdd_skeleton().save(output_path)
+    except Exception as e:
+        print(f"Error al guardar la plantilla DOCX '{output_path}': {e}")
+        return False
+    print(f"Plantilla DOCX guardada en: '{output_path}'")
+    return True
+
+def load_pdd_template() -> bytes:
+    """
+    Bytes de la plantilla del modo plantilla (cacheados por proceso): DOCX_TEMPLATE_PATH o, si no
+    está configurada o no se puede leer, el esqueleto por defecto.
+    """
+    if DOCX_TEMPLATE_PATH:
+        try:
+            return load_template_bytes(DOCX_TEMPLATE_PATH)
+        except OSError as e:
+            print(f"[Plantilla] Advertencia: No se pudo leer '{DOCX_TEMPLATE_PATH}' ({e}). Usando el esqueleto por defecto.")
+    return load_template_bytes(build_skeleton=build_pdd_skeleton, name='pdd')
+
+def fill_pdd_template(document, model: dict):
+    """
+    Completa los campos (marcadores) de un documento esqueleto/plantilla con el modelo del documento
+    (ver `pdd_model.build_pdd_model`). Los marcadores que falten en la plantilla se omiten con una advertencia.
+
+    Returns:
+        El párrafo ancla de la tabla de pasos (3.3), para `insert_steps_table`.
+    """
+    bookmarks = find_bookmarks(document)
+    for name, text in model["title"].items():
+        if name in bookmarks:
+            set_bookmark_text(bookmarks[name], text)
+
+    bpmn = model["bpmn"]
+    block_fields = {entry["key"]: (lambda doc, entry=entry: add_ai_generated_text(doc, model["ai_text"].get(entry["key"]),
+                                                                                  entry["key"], entry["speculative"]))
+                    for entry in PDD_OUTLINE if entry["kind"] == "ai_text"}
+    block_fields.update({
+        "pdd_user_roles": lambda doc: add_user_roles(doc, model["roles"]),
+        "pdd_bpmn": lambda doc: add_bpmn_instructions(doc, bpmn["xml"], bpmn["path"] or "", bpmn["error"]),
+        "pdd_exceptions_business": lambda doc: add_exception_suggestions(doc, model["exceptions"]["business"]),
+        "pdd_exceptions_application": lambda doc: add_exception_suggestions(doc, model["exceptions"]["application"]),
+        "pdd_applications": lambda doc: add_placeholder(doc.add_paragraph(), model["applications_text"]),
+    })
+    missing = []
+    for name, fill in block_fields.items():
+        paragraph = bookmark_paragraph(bookmarks[name]) if name in bookmarks else None
+        if paragraph is None:
+            missing.append(name)
+            continue
+        replace_paragraph(document, paragraph, fill)
+
+    steps_paragraph = bookmark_paragraph(bookmarks[STEPS_TABLE_BOOKMARK]) if STEPS_TABLE_BOOKMARK in bookmarks else None
+    if steps_paragraph is None:
+        missing.append(STEPS_TABLE_BOOKMARK)
+        steps_anchor = document.add_paragraph() # Sin marcador: la tabla de pasos va al final
+    else:
+        steps_anchor = Paragraph(steps_paragraph, document._body)
+    if missing:
+        print(f"[Plantilla] Advertencia: La plantilla no tiene los marcadores {', '.join(missing)}; se omiten.")
+    return steps_anchor
+
+def build_pdd_document(model: dict):
+    """
+    Construye todas las secciones del documento salvo la tabla de pasos (3.3), que depende de los
+    screenshots: en su lugar deja un párrafo ancla. Con DOCX_TEMPLATE_MODE parte de una copia de la
+    plantilla cacheada; si no, reconstruye el esqueleto.
+
+    Args:
+        model: Modelo del documento (ver `pdd_model.build_pdd_model`).
+
+    Returns:
+        Una tupla (document, steps_anchor).
+    """
+    print("\n[Paso 1/3] Añadiendo secciones al documento...")
+    document = open_template(load_pdd_template()) if DOCX_TEMPLATE_MODE else build_pdd_skeleton()
+    steps_anchor = fill_pdd_template(document, model)
+    print("\n[Paso 2/3] Estructura DOCX completada.")
+    return document, steps_anchor
+
+def render_docx(model: dict, output_docx_path: str, screenshot_dir: str) -> bool:
+    """
+    Renderiza el modelo completo como DOCX (secciones, tabla de pasos con `model["pictures"]` y guardado).
+    Sin imágenes preparadas en el modelo, se preparan desde `screenshot_dir`.
+    """
+    document, steps_anchor = build_pdd_document(model)
+    if DOCX_STREAMING_WRITER:
+        return stream_pdd_docx(document, steps_anchor, model["steps"], screenshot_dir, output_docx_path,
+                               pictures=model["pictures"])
+    insert_steps_table(document, steps_anchor, model["steps"], screenshot_dir, pictures=model["pictures"])
+    return save_pdd_document(document, output_docx_path)
+
+def save_pdd_document(document, output_docx_path: str) -> bool:
+    """Guarda el documento DOCX. Devuelve True/False."""
+    print(f"[Paso 3/3] Guardando documento DOCX final en '{output_docx_path}'...")
+    try:
+        document.save(output_docx_path)
+    except Exception as e:
+        print(f"Error Crítico al guardar el DOCX '{output_docx_path}': {e}")
+        return False
+    print("¡Documento DOCX guardado exitosamente!")
+    return True
+
 def generate_pdd_docx_v0_3(json_path: str, screenshot_dir: str, output_docx_path: str, output_bpmn_path: str, user_metadata: dict):
     """
     Genera el documento DOCX completo para v0.3 usando la estructura acordada,
@@ -297,18 +821,8 @@ def generate_pdd_docx_v0_3(json_path: str, screenshot_dir: str, output_docx_path
     print(f"Guardando BPMN en: {output_bpmn_path}")
 
     # Cargar Datos del JSON
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-        print("Datos JSON cargados exitosamente.")
-    except FileNotFoundError:
-        print(f"Error Crítico: No se pudo encontrar el archivo JSON '{json_path}'.")
-        return False
-    except json.JSONDecodeError as e:
-        print(f"Error Crítico: El archivo JSON '{json_path}' no es válido: {e}")
-        return False
-    except Exception as e:
-        print(f"Error Crítico inesperado al cargar JSON: {e}")
+    json_data = load_analysis_json(json_path)
+    if json_data is None:
         return False
 
     # Verificar Directorio de Screenshots
@@ -317,89 +831,9 @@ def generate_pdd_docx_v0_3(json_path: str, screenshot_dir: str, output_docx_path
 
     # Crear Documento DOCX
     try:
-        document = Document()
-        print("\n[Paso 1/3] Añadiendo secciones al documento...")
-
-        # Página de Título y TOC
-        add_title_page(document, user_metadata, json_data.get("pdd_metadata_inferred", {}))
-        add_toc_placeholder(document)
-
-        # --- Sección 1: Introducción ---
-        add_heading_with_level(document, "1.0 Introduction", level=1) # Título EN
-        add_ai_generated_section(document, "1.1 Propósito del Documento", 2, json_data, "section_1_1_purpose_text") # Título ES
-        add_ai_generated_section(document, "1.2 Objetivos de la Automatización", 2, json_data, "section_1_2_objectives_text", speculative=True) # Título ES
-        add_heading_with_level(document, "1.3 Alcance de la Automatización (Scope)", level=2) # Título Mixto
-        add_ai_generated_section(document, "1.3.1 Dentro del Alcance (In Scope)", 3, json_data, "section_1_3_1_scope_in_suggestion", speculative=True) # Título Mixto
-        add_ai_generated_section(document, "1.3.2 Fuera del Alcance (Out of Scope)", 3, json_data, "section_1_3_2_scope_out_suggestion", speculative=True) # Título Mixto
-        # Placeholder sin referencia a guía
-        add_manual_placeholder_section(document, "1.4 Contactos Clave / Interesados (Stakeholders)", 2, "Tabla o lista con Nombre, Rol (SME, Propietario Proceso, BA, etc.), Información de Contacto.") # Título Mixto
-        # Placeholder sin referencia a guía
-        add_manual_placeholder_section(document, "1.5 Prerrequisitos Mínimos para la Automatización", 2, "Listar elementos necesarios ANTES de iniciar el desarrollo (ej: PDD aprobado, datos prueba, accesos, entorno listo).") # Título ES
-
-        # --- Sección 2: Contexto del Negocio ---
-        # CORRECCIÓN: Llamar solo a add_ai_generated_section que ya incluye el título
-        add_ai_generated_section(document, "2.0 Business Context", 1, json_data, "section_2_0_context_text") # Título EN
-
-        # --- Sección 3: Descripción del Proceso As-Is ---
-        add_heading_with_level(document, "3.0 Process Description As-Is", level=1) # Título EN/Mixto
-        add_ai_generated_section(document, "3.1 Overview of the As-Is Process", 2, json_data, "section_3_1_as_is_summary_text") # Título EN/Mixto
-        # Añadir roles inferidos
-        roles_list = json_data.get("section_3_1_user_roles_inferred", [])
-        p_roles = document.add_paragraph()
-        add_ai_note(p_roles)
-        p_roles.add_run("Roles de Usuario Implicados (Inferidos por IA):\n").bold = True
-        if roles_list:
-            for role in roles_list:
-                p_roles.add_run(f"- {role}\n") # Roles ya vienen en español del JSON
-        else:
-            add_placeholder(p_roles, "No se infirieron roles de usuario.")
-        document.add_paragraph()
-
-        handle_bpmn_section(document, json_data.get("section_3_2_bpmn_xml_code"), output_bpmn_path) # Título interno mixto
-        add_detailed_steps_table(document, json_data.get("section_3_3_detailed_steps", []), screenshot_dir) # Título interno mixto
-        add_ai_generated_section(document, "3.4 Datos de Entrada (Inputs)", 2, json_data, "section_3_4_inputs_suggestion", speculative=True) # Título Mixto
-        add_ai_generated_section(document, "3.5 Datos de Salida (Outputs)", 2, json_data, "section_3_5_outputs_suggestion", speculative=True) # Título Mixto
-        add_ai_generated_section(document, "3.6 Reglas de Negocio (Business Rules)", 2, json_data, "section_3_6_rules_suggestion", speculative=True) # Título Mixto
-
-        # --- Sección 4: Descripción del Proceso To-Be ---
-        add_heading_with_level(document, "4.0 Process Description To-Be", level=1) # Título EN/Mixto
-        add_ai_generated_section(document, "4.1 Overview of the To-Be Process", 2, json_data, "section_4_1_tobe_summary_suggestion", speculative=True) # Título EN/Mixto
-        # Placeholder sin referencia a guía
-        add_manual_placeholder_section(document, "4.2 Process Flow Diagram To-Be", 2, "Crear (manualmente) un diagrama de flujo futuro (To-Be) (BPMN o simple) diferenciando pasos de robot y manuales. Pegar la imagen aquí.") # Título EN/Mixto
-        p_paste_tobe = document.paragraphs[-1]
-        p_paste_tobe.insert_paragraph_before("\n")
-        add_placeholder(p_paste_tobe.insert_paragraph_before(""), "<< PEGUE AQUÍ LA IMAGEN DEL DIAGRAMA TO-BE >>")
-        p_paste_tobe.insert_paragraph_before("\n")
-        add_ai_generated_section(document, "4.3 Interacción Humano-Robot", 2, json_data, "section_4_3_interaction_suggestion", speculative=True) # Título ES
-
-        # --- Sección 5: Manejo de Excepciones y Errores ---
-        add_heading_with_level(document, "5.0 Exception and Error Handling", level=1) # Título EN
-        add_exceptions_suggestions(document, json_data.get("section_5_exceptions_suggestions", [])) # Títulos internos mixtos
-        # Placeholder sin referencia a guía
-        add_manual_placeholder_section(document, "5.3 Manejo de Errores/Excepciones Desconocidas", 2, "Definir el procedimiento estándar cuando ocurre un error o excepción no contemplado (ej: tomar screenshot, guardar estado, notificar a soporte, detener proceso).") # Título ES
-
-        # --- Sección 6: Información Contextual Adicional ---
-        add_heading_with_level(document, "6.0 Additional Contextual Information", level=1) # Título EN
-        # Placeholder sin referencia a guía y texto de aplicaciones detectadas en español
-        add_manual_placeholder_section(document, "6.1 Applications Used", 2, "Tabla listando TODAS las aplicaciones involucradas (Nombre, Tipo, Versión, Entorno, Acceso).\nAplicaciones Detectadas por IA (Verificar y Completar):\n" + "\n".join([f"- {app}" for app in sorted(list(set(step.get("application_in_focus", "N/A") for step in json_data.get("section_3_3_detailed_steps", []) if step.get("application_in_focus") != "N/A")))] or ["- Ninguna detectada"])) # Título EN
-        add_ai_generated_section(document, "6.2 Dependencies", 2, json_data, "section_6_2_dependencies_suggestion", speculative=True) # Título EN
-        # Placeholder sin referencia a guía
-        add_manual_placeholder_section(document, "6.3 As-Is Process Statistics/Metrics", 2, "Incluir datos cuantitativos clave del proceso manual (Volumen, AHT, Tasa Error, FTEs, Costo, etc.). Obtener estos datos del negocio.") # Título EN/Mixto
-        add_ai_generated_section(document, "6.4 Reporting and Logging Requirements", 2, json_data, "section_6_4_reporting_suggestion", speculative=True) # Título EN
-
-        # --- Sección 7: Apéndice ---
-        add_heading_with_level(document, "7.0 Appendix", level=1) # Título EN
-        add_manual_placeholder_section(document, "7.1 Glossary of Terms", 2, "Definir acrónimos y términos técnicos o de negocio específicos utilizados.") # Título EN
-        add_manual_placeholder_section(document, "7.2 Document Revision History", 2, "Tabla con Versión, Fecha, Autor, Descripción de Cambios, Aprobador.") # Título EN
-        add_manual_placeholder_section(document, "7.3 Other Reference Documents", 2, "Listar cualquier otro documento relevante (SOPs existentes, guías de usuario, etc.).") # Título EN
-
-        print("\n[Paso 2/3] Estructura DOCX completada.")
-
-        # Guardar Documento DOCX
-        print(f"[Paso 3/3] Guardando documento DOCX final en '{output_docx_path}'...")
-        document.save(output_docx_path)
-        print("¡Documento DOCX guardado exitosamente!")
-        return True
+        bpmn_error = write_bpmn_file(json_data.get("section_3_2_bpmn_xml_code"), output_bpmn_path)
+        model = build_pdd_model(json_data, user_metadata, output_bpmn_path, bpmn_error)
+        return render_docx(model, output_docx_path, screenshot_dir)
 
     except Exception as e:
         print(f"Error Crítico inesperado durante la generación del DOCX: {e}")
@@ -409,6 +843,9 @@ def generate_pdd_docx_v0_3(json_path: str, screenshot_dir: str, output_docx_path
 
 # --- Bloque de Ejecución Principal (para pruebas standalone) ---
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == '--export-template':
+        # Exporta el esqueleto por defecto para editarlo en Word (conservando los marcadores)
+        sys.exit(0 if save_pdd_template(sys.argv[2]) else 1)
     user_meta = DEFAULT_USER_METADATA
     print("Ejecutando en modo standalone con metadata por defecto.")
     success = generate_pdd_docx_v0_3(
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+from html import escape
+
+from pdd_model import (DOCUMENT_TITLE, APPROVERS_PLACEHOLDER, STEPS_TABLE_HEADERS, load_analysis_json, build_pdd_model,
+                       attach_pictures, write_model_media, media_link)
+from generar_docx_pdd import prepare_step_pictures, SCREENSHOT_DISPLAY_WIDTH_INCHES
+
+# --- Configuración ---
+JSON_INPUT_PATH = 'full_analysis_output.json'
+SCREENSHOT_DIR = 'screenshots_output'
+OUTPUT_HTML_PATH = 'PDD_Generated_Output_v0.3.html'
+HTML_IMAGE_WIDTH_PX = int(SCREENSHOT_DISPLAY_WIDTH_INCHES * 96) # Mismo ancho de presentación que en el DOCX
+# --- Fin Configuración ---
+
+HTML_STYLE = """
+body { font-family: Calibri, Arial, sans-serif; font-size: 11pt; max-width: 60em; margin: 2em auto; }
+.subtitle { text-align: center; font-size: 16pt; font-weight: bold; }
+.version { text-align: center; font-style: italic; }
+.ai-note { font-size: 9pt; font-style: italic; }
+.placeholder { font-style: italic; color: #808080; }
+table.steps { border-collapse: collapse; font-size: 10pt; }
+table.steps th, table.steps td { border: 1px solid #000; padding: 4px; vertical-align: top; }
+table.steps td.screenshot { text-align: center; vertical-align: middle; }
+"""
+
+
+def _html_text(text) -> str:
+    """Texto escapado para HTML (saltos de línea como <br>)."""
+    return escape("" if text is None else str(text)).replace("\n", "<br>\n")
+
+def html_steps_table(model: dict, output_html_path: str) -> list:
+    """Líneas de la tabla de pasos, con el screenshot de cada paso (relativo al .html) si existe."""
+    lines = ['<table class="steps">', "<tr>" + "".join(f"<th>{escape(h)}</th>" for h in STEPS_TABLE_HEADERS) + "</tr>"]
+    for step in model["steps"]:
+        step_number = step.get("step_number", "N/A")
+        link = media_link(model, step_number, output_html_path)
+        screenshot = (f'<img src="{escape(link)}" alt="Screenshot Paso {escape(str(step_number))}" width="{HTML_IMAGE_WIDTH_PX}">'
+                      if link else '<span class="placeholder">[Screenshot no encontrado]</span>')
+        cells = [step_number, step.get("application_in_focus", "N/A"), step.get("description", "N/A"),
+                 step.get("action_type_inferred", "N/A")]
+        lines.append("<tr>" + "".join(f"<td>{_html_text(cell)}</td>" for cell in cells)
+                     + f'<td class="screenshot">{screenshot}</td></tr>')
+    lines.append("</table>")
+    return lines
+
+def render_html(model: dict, output_html_path: str) -> bool:
+    """
+    Renderiza el modelo del documento (ver `pdd_model.build_pdd_model`) como una página HTML. Las
+    imágenes se enlazan desde `model["media"]` (ver `write_model_media`).
+
+    Returns:
+        True si se escribió el archivo.
+    """
+    title = model["title"]
+    lines = ["<!DOCTYPE html>", '<html lang="es">', "<head>", '<meta charset="utf-8">',
+             f"<title>{escape(DOCUMENT_TITLE)} - {escape(title['pdd_process_name'])}</title>",
+             f"<style>{HTML_STYLE}</style>", "</head>", "<body>",
+             f"<h1>{escape(DOCUMENT_TITLE)}</h1>",
+             f'<p class="subtitle">{escape(title["pdd_process_name"])}</p>',
+             f'<p class="version">Version {escape(title["pdd_version"])} - {escape(title["pdd_status"])}</p>',
+             f"<p>Preparado por: {escape(title['pdd_author'])}<br>\nFecha: {escape(title['pdd_date'])}</p>",
+             f'<p class="placeholder">[{escape(APPROVERS_PLACEHOLDER)}]</p>']
+    for block in model["blocks"]:
+        if block["type"] == "heading":
+            level = min(6, block["level"] + 1)
+            lines.append(f"<h{level}>{escape(block['text'])}</h{level}>")
+        elif block["type"] == "note":
+            lines.append(f'<p class="ai-note">{_html_text(block["text"])}</p>')
+        elif block["type"] == "text":
+            lines.append(f"<p>{_html_text(block['text'])}</p>")
+        elif block["type"] == "placeholder":
+            lines.append(f'<p class="placeholder">[{_html_text(block["text"])}]</p>')
+        elif block["type"] == "label":
+            lines.append(f"<p><strong>{_html_text(block['text'])}</strong></p>")
+        elif block["type"] == "list":
+            tag = "ol" if block.get("ordered") else "ul"
+            lines.append(f"<{tag}>" + "".join(f"<li>{_html_text(item)}</li>" for item in block["items"]) + f"</{tag}>")
+        elif block["type"] == "steps":
+            lines.extend(html_steps_table(model, output_html_path))
+    lines += ["</body>", "</html>", ""]
+
+    try:
+        with open(output_html_path, 'w', encoding='utf-8') as html_file:
+            html_file.write("\n".join(lines))
+    except IOError as e:
+        print(f"Error Crítico: No se pudo escribir el HTML '{output_html_path}': {e}")
+        return False
+    print(f"Archivo HTML '{output_html_path}' generado exitosamente.")
+    return True
+
+def generate_html_pdd(json_path: str, screenshot_dir: str, output_html_path: str, user_metadata: dict = None):
+    """
+    Genera el PDD como página HTML a partir del JSON de análisis v0.3 y la carpeta de screenshots.
+    Las imágenes se preparan como para el DOCX y se guardan junto al .html en `<nombre>_media/`.
+    """
+    print(f"--- Iniciando Generación de Documento HTML ---")
+    json_data = load_analysis_json(json_path)
+    if json_data is None:
+        return False
+    model = build_pdd_model(json_data, user_metadata or {})
+    if not os.path.isdir(screenshot_dir):
+        print(f"Advertencia: No se encontró el directorio de screenshots '{screenshot_dir}'. El documento no tendrá imágenes.")
+    attach_pictures(model, prepare_step_pictures(model["steps"], screenshot_dir))
+    write_model_media(model, os.path.splitext(output_html_path)[0] + "_media")
+    return render_html(model, output_html_path)
+
+# --- Bloque de Ejecución Principal (para pruebas standalone) ---
+if __name__ == "__main__":
+    success = generate_html_pdd(JSON_INPUT_PATH, SCREENSHOT_DIR, OUTPUT_HTML_PATH)
+    if success:
+        print("\n--- Generación HTML (Standalone Test) Completada Exitosamente ---")
+    else:
+        print("\n--- Generación HTML (Standalone Test) Fallida o con Errores ---")
+        sys.exit(1)
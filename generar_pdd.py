@@ -1,22 +1,86 @@
 # -*- coding: utf-8 -*-
-import json # Para leer el archivo JSON con los pasos
 import os   # Para construir rutas de archivo y verificar si existen
 import sys  # Para mensajes de error
 
+from pdd_model import (DOCUMENT_TITLE, APPROVERS_PLACEHOLDER, STEPS_TABLE_HEADERS, load_analysis_json, build_pdd_model,
+                       attach_pictures, write_model_media, media_link)
+from generar_docx_pdd import prepare_step_pictures
+
 # --- Configuración ---
 # Asegúrate que estas rutas/nombres coincidan con tu proyecto
-# El JSON generado y validado en la Fase 1
-JSON_INPUT_PATH = 'pasos_ia_api_example.json'
+# El JSON de análisis (v0.3; también acepta la lista de pasos del formato anterior)
+JSON_INPUT_PATH = 'full_analysis_output.json'
 # La carpeta donde se guardaron los screenshots en la Fase 2
 SCREENSHOT_DIR = 'screenshots_output'
 # Nombre del archivo Markdown de salida que se generará
 OUTPUT_MD_PATH = 'pdd_output.md'
 # --- Fin de la Configuración ---
 
-def generate_markdown_pdd(json_path: str, screenshot_dir: str, output_md_path: str):
+def _md_text(text) -> str:
+    """Texto de párrafo Markdown (los saltos de línea se conservan como saltos forzados)."""
+    return str(text).replace("\n", "  \n")
+
+def _md_cell(text) -> str:
+    """Texto de una celda de tabla Markdown (sin '|' ni saltos de línea sin escapar)."""
+    return "N/A" if text is None else str(text).replace("|", "\\|").replace("\n", "<br>")
+
+def markdown_steps_table(model: dict, output_md_path: str) -> list:
+    """Líneas de la tabla de pasos, con el screenshot de cada paso (relativo al .md) si existe."""
+    lines = ["| " + " | ".join(STEPS_TABLE_HEADERS) + " |", "|" + "---|" * len(STEPS_TABLE_HEADERS)]
+    for step in model["steps"]:
+        step_number = step.get("step_number", "N/A")
+        link = media_link(model, step_number, output_md_path)
+        screenshot = f"![Screenshot Paso {step_number}]({link})" if link else "*[Screenshot no encontrado]*"
+        lines.append(f"| {_md_cell(step_number)} | {_md_cell(step.get('application_in_focus', 'N/A'))} | "
+                     f"{_md_cell(step.get('description', 'N/A'))} | {_md_cell(step.get('action_type_inferred', 'N/A'))} | {screenshot} |")
+    return lines
+
+def render_markdown(model: dict, output_md_path: str) -> bool:
     """
-    Genera un archivo Markdown (.md) básico a partir de un JSON de pasos
-    y una carpeta de screenshots.
+    Renderiza el modelo del documento (ver `pdd_model.build_pdd_model`) como Markdown. Las imágenes
+    se enlazan desde `model["media"]` (ver `write_model_media`).
+
+    Returns:
+        True si se escribió el archivo.
+    """
+    title = model["title"]
+    lines = [f"# {DOCUMENT_TITLE}", "", f"**{title['pdd_process_name']}**", "",
+             f"*Version {title['pdd_version']} - {title['pdd_status']}*", "",
+             f"Preparado por: {title['pdd_author']}  ", f"Fecha: {title['pdd_date']}", "",
+             f"*[{APPROVERS_PLACEHOLDER}]*", ""]
+    for block in model["blocks"]:
+        if block["type"] == "heading":
+            lines.append("#" * min(6, block["level"] + 1) + " " + block["text"])
+        elif block["type"] == "note":
+            lines.append(f"*{block['text']}*")
+        elif block["type"] == "text":
+            lines.append(_md_text(block["text"]))
+        elif block["type"] == "placeholder":
+            lines.append(f"*[{_md_text(block['text'])}]*")
+        elif block["type"] == "label":
+            lines.append(f"**{block['text']}**")
+        elif block["type"] == "list":
+            for i, item in enumerate(block["items"], start=1):
+                marker = f"{i}." if block.get("ordered") else "-"
+                lines.append(f"{marker} " + _md_text(item).replace("\n", "\n" + " " * (len(marker) + 1)))
+        elif block["type"] == "steps":
+            lines.extend(markdown_steps_table(model, output_md_path))
+        lines.append("")
+
+    try:
+        with open(output_md_path, 'w', encoding='utf-8') as md_file:
+            md_file.write("\n".join(lines))
+    except IOError as e:
+        print(f"Error Crítico: Ocurrió un error de E/S al escribir en '{output_md_path}'.")
+        print(f"Detalle: {e}")
+        return False
+    print(f"Archivo Markdown '{output_md_path}' generado exitosamente.")
+    return True
+
+def generate_markdown_pdd(json_path: str, screenshot_dir: str, output_md_path: str, user_metadata: dict = None):
+    """
+    Genera el PDD en Markdown (.md) a partir del JSON de análisis v0.3 y la carpeta de screenshots.
+    Las imágenes se preparan como para el DOCX y se guardan junto al .md en `<nombre>_media/`.
     """
     print(f"--- Iniciando Fase 3: Generación de Documento Markdown ---")
     print(f"JSON de entrada: {json_path}")
@@ -24,93 +88,23 @@ def generate_markdown_pdd(json_path: str, screenshot_dir: str, output_md_path: s
     print(f"Archivo Markdown de salida: {output_md_path}")
 
     # 1. Cargar datos del JSON
-    print(f"\n[Paso 1/4] Cargando datos desde '{json_path}'...")
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            steps_data = json.load(f)
-        print(f"Datos JSON cargados exitosamente ({len(steps_data)} pasos encontrados).")
-    except FileNotFoundError:
-        print(f"Error Crítico: No se encontró el archivo JSON en '{json_path}'")
-        return False
-    except json.JSONDecodeError as e:
-        print(f"Error Crítico: El archivo '{json_path}' no contiene un JSON válido.")
-        print(f"Detalle del error: {e}")
-        return False
-    except Exception as e:
-        print(f"Error Crítico inesperado al leer el JSON: {e}")
+    print(f"\n[Paso 1/3] Cargando datos desde '{json_path}'...")
+    json_data = load_analysis_json(json_path)
+    if json_data is None:
         return False
+    model = build_pdd_model(json_data, user_metadata or {})
+    print(f"Modelo del documento construido ({len(model['steps'])} pasos encontrados).")
 
-    # 2. Verificar existencia del directorio de screenshots
-    print(f"\n[Paso 2/4] Verificando directorio de screenshots '{screenshot_dir}'...")
+    # 2. Preparar los screenshots
+    print(f"\n[Paso 2/3] Preparando screenshots desde '{screenshot_dir}'...")
     if not os.path.isdir(screenshot_dir):
-        print(f"Error Crítico: El directorio de screenshots '{screenshot_dir}' no fue encontrado.")
-        print("Asegúrate de haber ejecutado el script de la Fase 2 primero.")
-        return False
-    else:
-        print("Directorio de screenshots encontrado.")
-
-    # 3. Abrir archivo Markdown para escritura
-    print(f"\n[Paso 3/4] Abriendo archivo '{output_md_path}' para escritura...")
-    try:
-        # Abrimos el archivo en modo escritura ('w'). Si ya existe, se sobrescribirá.
-        # Usamos utf-8 para asegurar compatibilidad con acentos, etc.
-        with open(output_md_path, 'w', encoding='utf-8') as md_file:
-            # Escribir un título general para el documento
-            md_file.write("# Documento de Procedimiento (Generado Automáticamente)\n\n")
-            print("Archivo Markdown abierto. Escribiendo contenido...")
-
-            # 4. Iterar sobre los pasos y escribir en el archivo
-            step_count = 0
-            missing_screenshot_count = 0
-            for step in steps_data:
-                step_number = step.get("step_number")
-                description = step.get("description", "Sin descripción") # Valor por defecto
-
-                if step_number is None:
-                    print("  - Advertencia: Se encontró un paso sin 'step_number'. Omitiendo.")
-                    continue
-
-                # --- Escribir contenido del paso en Markdown ---
-                # Escribir el número de paso como un encabezado de nivel 2
-                md_file.write(f"## Paso {step_number}\n\n")
-                # Escribir la descripción
-                md_file.write(f"**Descripción:** {description}\n\n")
-
-                # Construir la ruta esperada para el screenshot de este paso
-                screenshot_filename = f"screenshot_paso_{step_number}.png"
-                screenshot_path = os.path.join(screenshot_dir, screenshot_filename)
-
-                # Verificar si el archivo de screenshot realmente existe
-                if os.path.exists(screenshot_path):
-                    # Escribir la sintaxis de Markdown para mostrar la imagen
-                    # Usamos rutas relativas, asumiendo que el .md estará en la raíz
-                    # y los screenshots en la subcarpeta.
-                    # Ej: ![Texto alternativo](ruta/a/la/imagen.png)
-                    md_file.write(f"![Screenshot Paso {step_number}]({screenshot_path})\n\n")
-                else:
-                    # Si no se encuentra el screenshot, escribir una advertencia
-                    md_file.write(f"*Advertencia: No se encontró el screenshot en '{screenshot_path}'*\n\n")
-                    missing_screenshot_count += 1
-
-                # Añadir un separador horizontal para mayor claridad (opcional)
-                md_file.write("---\n\n")
-                step_count += 1
-
-            print(f"Contenido escrito para {step_count} pasos.")
-            if missing_screenshot_count > 0:
-                print(f"Advertencia: Faltaron {missing_screenshot_count} archivos de screenshot.")
-
-        print(f"\n[Paso 4/4] Archivo Markdown '{output_md_path}' generado exitosamente.")
-
-    except IOError as e:
-        print(f"Error Crítico: Ocurrió un error de E/S al escribir en '{output_md_path}'.")
-        print(f"Detalle: {e}")
-        return False
-    except Exception as e:
-        print(f"Error Crítico inesperado durante la escritura del archivo Markdown: {e}")
-        return False
+        print(f"Advertencia: No se encontró el directorio de screenshots '{screenshot_dir}'. El documento no tendrá imágenes.")
+    attach_pictures(model, prepare_step_pictures(model["steps"], screenshot_dir))
+    write_model_media(model, os.path.splitext(output_md_path)[0] + "_media")
 
-    return True # Indica éxito
+    # 3. Escribir el Markdown
+    print(f"\n[Paso 3/3] Escribiendo '{output_md_path}'...")
+    return render_markdown(model, output_md_path)
 
 # --- Bloque de Ejecución Principal ---
 if __name__ == "__main__":
@@ -122,4 +116,4 @@ if __name__ == "__main__":
         print(f"Puedes encontrar el documento generado en: {OUTPUT_MD_PATH}")
     else:
         print("\n--- Fase 3 Fallida o Completada con Errores ---")
-        print("Revisa los mensajes anteriores para más detalles.")
\ No newline at end of file
+        print("Revisa los mensajes anteriores para más detalles.")
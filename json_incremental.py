@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+
+
+class IncrementalJsonScanner:
+    """
+    Analizador incremental de la respuesta JSON del modelo.
+
+    Recibe el texto por fragmentos (streaming) y devuelve cada elemento de un
+    arreglo de primer nivel (ej: 'section_3_3_detailed_steps') en cuanto su
+    objeto queda cerrado, sin esperar al resto de la respuesta. Ignora cualquier
+    texto previo al primer '{' (ej: marcado ```json).
+
+    También conserva cada miembro de primer nivel en cuanto su valor queda completo,
+    de modo que una respuesta truncada puede recuperarse con `salvage()`.
+    """
+
+    def __init__(self, watched_keys=("section_3_3_detailed_steps",)):
+        self.watched_keys = set(watched_keys)
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None   # Último string cerrado en el primer nivel (candidato a clave)
+        self.current_key = None   # Clave de primer nivel cuyo valor se está leyendo
+        self.array_key = None     # Clave del arreglo observado en el que estamos (profundidad 2)
+        self.item_start = None    # Inicio del elemento actual del arreglo observado
+        self.value_start = None   # Inicio del valor del miembro de primer nivel actual
+        self.members = {}         # Miembros de primer nivel completos {clave: valor}
+        self.items = {}           # Elementos completos de cada arreglo observado {clave: [elementos]}
+        self._text = ""           # Texto completo recibido
+
+    def feed(self, chunk: str) -> list:
+        """
+        Procesa un nuevo fragmento de texto.
+
+        Returns:
+            Lista de tuplas (clave, elemento) completadas en este fragmento.
+        """
+        completed = []
+        base = len(self._text)
+        self._text += chunk
+        for offset, char in enumerate(chunk):
+            index = base + offset
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = self._text[self.string_start + 1:index]
+                continue
+
+            if (self.depth == 1 and self.current_key is not None and self.value_start is None
+                    and not char.isspace() and char not in ",}"):
+                self.value_start = index
+
+            if char == '"':
+                if self.depth > 0:
+                    self.in_string = True
+                    self.string_start = index
+            elif char == ":" and self.depth == 1:
+                self.current_key = self.last_string
+                self.value_start = None
+            elif char == "," and self.depth == 1:
+                self._close_member(index)
+                self.current_key = None
+            elif char in "{[":
+                self.depth += 1
+                if char == "[" and self.depth == 2 and self.current_key in self.watched_keys:
+                    self.array_key = self.current_key
+                elif char == "{" and self.depth == 3 and self.array_key:
+                    self.item_start = index
+            elif char in "}]":
+                if char == "}" and self.depth == 3 and self.array_key and self.item_start is not None:
+                    item = self._load_item(self.item_start, index + 1)
+                    if item is not None:
+                        completed.append((self.array_key, item))
+                        self.items.setdefault(self.array_key, []).append(item)
+                    self.item_start = None
+                elif char == "]" and self.depth == 2:
+                    self.array_key = None
+                if self.depth == 2:
+                    self._close_member(index + 1) # Objeto o arreglo de primer nivel completo
+                elif self.depth == 1:
+                    self._close_member(index) # Fin del objeto raíz: cierra el último valor escalar
+                self.depth -= 1
+        return completed
+
+    def _close_member(self, end: int):
+        """Registra el valor del miembro de primer nivel actual si está completo y es JSON válido."""
+        if self.current_key is None or self.value_start is None:
+            return
+        value_text = self._text[self.value_start:end].strip()
+        self.value_start = None
+        try:
+            self.members[self.current_key] = json.loads(value_text)
+        except json.JSONDecodeError:
+            pass
+
+    def salvage(self) -> dict:
+        """
+        Recupera lo aprovechable de una respuesta (posiblemente truncada o malformada).
+
+        Returns:
+            Diccionario con los miembros de primer nivel completos y, para los arreglos
+            observados que quedaron abiertos, los elementos completos recibidos.
+        """
+        data = dict(self.members)
+        for key, items in self.items.items():
+            if key not in data:
+                data[key] = list(items)
+        return data
+
+    @property
+    def truncated_keys(self) -> list:
+        """Arreglos observados con elementos recibidos pero sin cierre (respuesta cortada dentro de ellos)."""
+        return [key for key in self.items if key not in self.members]
+
+    def _load_item(self, start: int, end: int):
+        """Parsea el texto de un elemento completo; devuelve None si no es JSON válido."""
+        try:
+            return json.loads(self._text[start:end])
+        except json.JSONDecodeError:
+            return None
+
+    @property
+    def text(self) -> str:
+        """Texto completo recibido hasta el momento."""
+        return self._text
@@ -7,7 +7,9 @@ import json # Necesario para cargar la metadata por defecto si se usa archivo
 # Importar las funciones principales de los scripts de las fases v0.3
 try:
     # Asegúrate que los nombres de archivo coincidan con los tuyos!
-    from video_analyzer import analyze_video_steps
+    from video_analyzer import analyze_video_steps, ANALYSIS_PROMPT_V0_3, GENERATION_CONFIG
+    # Caché persistente de resultados de análisis
+    from analysis_cache import compute_file_hash, build_cache_key, cache_get, cache_put
     # Usamos la versión de extraer_screenshots sin precisión OpenCV por ahora
     from extraer_screenshots import extract_screenshots
     # Importamos la función actualizada de generación DOCX v0.3
@@ -45,6 +47,9 @@ SCREENSHOT_DIR = 'screenshots_output'
 OUTPUT_DOCX_PATH = 'PDD_Generated_Output_v0.3.docx' # Nombre archivo v0.3
 OUTPUT_BPMN_PATH = 'Generated_Process.bpmn'
 
+# Caché de análisis: reutiliza el JSON si el video, prompt, modelo y configuración no cambian
+ANALYSIS_CACHE_ENABLED = True
+
 # --- Fin de la Configuración ---
 
 def run_full_pipeline_v0_3(input_video_path: str):
@@ -64,15 +69,33 @@ def run_full_pipeline_v0_3(input_video_path: str):
         print("Error Crítico: Falta configuración esencial de API (PROJECT_ID, LOCATION, MODEL_NAME) en main.py.")
         return False
 
-    # Llama a la función de análisis (del script video_analyzer.py)
-    # Devuelve el diccionario complejo v0.3 o None y un error
-    complex_analysis_data, error_fase1 = analyze_video_steps(
-        project_id=PROJECT_ID,
-        location=LOCATION,
-        model_name=MODEL_NAME,
-        video_path=input_video_path
-        # Asegúrate que video_analyzer.py guarda el JSON en JSON_OUTPUT_PATH
-    )
+    # Consultar el caché antes de pagar por una inferencia completa
+    cache_key = None
+    complex_analysis_data, error_fase1 = None, None
+    if ANALYSIS_CACHE_ENABLED:
+        try:
+            video_hash = compute_file_hash(input_video_path)
+            cache_key = build_cache_key(video_hash, ANALYSIS_PROMPT_V0_3, MODEL_NAME, GENERATION_CONFIG)
+            complex_analysis_data = cache_get(cache_key)
+        except Exception as e:
+            print(f"Advertencia: No se pudo consultar el caché de análisis: {e}")
+
+    if complex_analysis_data is not None:
+        print("Análisis encontrado en caché. Se omite la llamada a la API.")
+    else:
+        # Llama a la función de análisis (del script video_analyzer.py)
+        # Devuelve el diccionario complejo v0.3 o None y un error
+        complex_analysis_data, error_fase1 = analyze_video_steps(
+            project_id=PROJECT_ID,
+            location=LOCATION,
+            model_name=MODEL_NAME,
+            video_path=input_video_path
+        )
+        if complex_analysis_data and cache_key:
+            try:
+                cache_put(cache_key, complex_analysis_data)
+            except Exception as e:
+                print(f"Advertencia: No se pudo guardar el análisis en caché: {e}")
 
     if error_fase1:
         print("\n--- FALLO EN FASE 1.3 ---")
@@ -86,10 +109,12 @@ def run_full_pipeline_v0_3(input_video_path: str):
         return False
     else:
         print("\n--- Fase 1.3 Completada Exitosamente ---")
-        # Verifica que el archivo JSON se guardó (video_analyzer.py debería hacerlo)
-        if not os.path.exists(JSON_OUTPUT_PATH):
-            print(f"Error Crítico post-Fase 1.3: No se encontró el archivo JSON esperado '{JSON_OUTPUT_PATH}'.")
-            print("Asegúrate que video_analyzer.py esté guardando el archivo correctamente.")
+        # Guardar el JSON que consumen las Fases 2.2 y 3.3 (análisis nuevo o cacheado)
+        try:
+            with open(JSON_OUTPUT_PATH, 'w', encoding='utf-8') as f:
+                json.dump(complex_analysis_data, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"Error Crítico post-Fase 1.3: No se pudo guardar el archivo JSON '{JSON_OUTPUT_PATH}': {e}")
             return False
         print(f"Archivo JSON v0.3 '{JSON_OUTPUT_PATH}' listo.")
 
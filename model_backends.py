@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+Backends de modelo intercambiables para el análisis de video.
+
+- 'vertex': llamada real a Vertex AI Gemini (comportamiento original).
+- 'record': igual que 'vertex', pero guarda cada respuesta en `RECORDINGS_DIR`.
+- 'replay': sirve respuestas grabadas por hash de la solicitud, sin red ni costo.
+- 'stub':   genera un JSON v0.3 sintético y determinista a partir de la duración del video,
+            con solo las claves que pide el prompt (análisis completo, etapas o continuación).
+
+Todos reciben una solicitud normalizada (dict) y devuelven un resultado normalizado:
+    {"text": str, "usage": {"input_tokens", "output_tokens", "total_tokens"} | None,
+     "finish_reason": str | None, "error": str | None}
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import threading
+from abc import ABC, abstractmethod
+import cv2
+
+# --- Configuración del Backend ---
+# Backend activo: "vertex", "record", "replay" o "stub" (la variable de entorno PDD_MODEL_BACKEND lo sobrescribe)
+MODEL_BACKEND = os.environ.get("PDD_MODEL_BACKEND", "vertex")
+RECORDINGS_DIR = 'model_recordings'      # Carpeta de respuestas grabadas (record/replay)
+BILLED_BACKENDS = ("vertex", "record")  # Backends que llaman al modelo real (generan costo)
+STUB_LATENCY_SEC = 0.0                   # Latencia artificial del stub (por solicitud)
+STUB_SECONDS_PER_STEP = 8.0              # Densidad de pasos sintéticos
+STUB_SEED = 0                            # Semilla base del stub (determinismo)
+
+# --- Configuración de Carga del Video (Memoria Acotada) ---
+# Tamaño de bloque para leer el video en streaming.
+VIDEO_READ_CHUNK_BYTES = 3 * 1024 * 1024  # 3 MiB
+# Tamaño máximo (bytes del archivo) para enviar el video inline en la solicitud.
+# Por encima de este límite el video se sube a Cloud Storage y se referencia por URI,
+# de forma que la memoria pico no depende del tamaño del video. Nunca se envía inline por
+# encima del límite: sin bucket configurado el análisis falla con un error explicativo
+# (activa el proxy de análisis / redimensionamiento o configura el bucket).
+INLINE_VIDEO_MAX_BYTES = 20 * 1024 * 1024  # 20 MiB
+# Bucket de Cloud Storage para videos grandes (ej: "mi-bucket-pdd"); la variable de entorno
+# PDD_VIDEO_UPLOAD_BUCKET lo configura sin editar el código. None = solo videos inline.
+VIDEO_UPLOAD_GCS_BUCKET = os.environ.get("PDD_VIDEO_UPLOAD_BUCKET") or None
+VIDEO_UPLOAD_GCS_PREFIX = "pdd-videos/"
+# Tamaño de bloque de la subida resumible a GCS (múltiplo de 256 KiB según la API).
+VIDEO_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # 8 MiB
+# --- Fin Configuración ---
+
+
+# <<< --- FUNCIONES DE CONSTRUCCIÓN DEL PAYLOAD DE VIDEO --- >>>
+def iter_file_chunks(file_path: str, chunk_size: int = VIDEO_READ_CHUNK_BYTES):
+    """
+    Lee un archivo en bloques de tamaño fijo sin cargarlo completo en memoria.
+
+    Args:
+        file_path: Ruta al archivo a leer.
+        chunk_size: Tamaño de cada bloque en bytes.
+
+    Yields:
+        Bloques de bytes (el último puede ser más corto).
+    """
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def read_video_inline(file_path: str) -> bytes:
+    """
+    Lee el video completo para enviarlo inline en la solicitud.
+
+    Se envían los bytes crudos: `Part.from_data` decodifica de todas formas un str
+    Base64 a bytes, así que codificar antes solo añadía dos copias de 1.33x en memoria.
+    Solo debe usarse para archivos de hasta `INLINE_VIDEO_MAX_BYTES`.
+
+    Args:
+        file_path: Ruta al video local.
+
+    Returns:
+        El contenido del archivo en bytes.
+    """
+    with open(file_path, "rb") as f:
+        return f.read()
+
+def upload_video_to_gcs(video_path: str, bucket_name: str, prefix: str = VIDEO_UPLOAD_GCS_PREFIX,
+                        mime_type: str = "video/mp4") -> str:
+    """
+    Sube un video a Cloud Storage mediante subida resumible por bloques.
+
+    La librería de GCS lee y envía `VIDEO_UPLOAD_CHUNK_BYTES` por petición, por lo que
+    la memoria usada es constante independientemente del tamaño del video.
+
+    Args:
+        video_path: Ruta al video local.
+        bucket_name: Nombre del bucket de destino.
+        prefix: Prefijo (carpeta) para el objeto.
+        mime_type: Tipo MIME del video.
+
+    Returns:
+        La URI 'gs://...' del objeto subido.
+    """
+    from google.cloud import storage # Importación diferida: solo necesaria en modo referencia
+
+    client = storage.Client()
+    blob_name = f"{prefix}{uuid.uuid4().hex}_{os.path.basename(video_path)}"
+    blob = client.bucket(bucket_name).blob(blob_name, chunk_size=VIDEO_UPLOAD_CHUNK_BYTES)
+    blob.upload_from_filename(video_path, content_type=mime_type)
+    return f"gs://{bucket_name}/{blob_name}"
+
+def build_video_part(video_path: str, mime_type: str = "video/mp4"):
+    """
+    Construye el `Part` de video para la solicitud con memoria pico acotada.
+
+    - Videos de hasta `INLINE_VIDEO_MAX_BYTES`: se envían inline (bytes crudos).
+    - Videos mayores: se suben a `VIDEO_UPLOAD_GCS_BUCKET` y se referencian por URI.
+      Sin bucket configurado se devuelve un error sin leer el archivo (la memoria pico
+      nunca depende del tamaño del video).
+
+    Args:
+        video_path: Ruta al video local.
+        mime_type: Tipo MIME del video.
+
+    Returns:
+        Una tupla (video_part, error). video_part es None si falla.
+    """
+    from vertexai.preview.generative_models import Part # Solo necesario con Vertex AI
+
+    file_size = os.path.getsize(video_path)
+    if file_size <= INLINE_VIDEO_MAX_BYTES:
+        print(f"Leyendo el video para envío inline ({file_size / (1024 * 1024):.1f} MiB)...")
+        return Part.from_data(data=read_video_inline(video_path), mime_type=mime_type), None
+
+    if not VIDEO_UPLOAD_GCS_BUCKET:
+        error_msg = (f"El video ocupa {file_size / (1024 * 1024):.1f} MiB y supera el límite inline "
+                     f"({INLINE_VIDEO_MAX_BYTES / (1024 * 1024):.0f} MiB). Configura un bucket de Cloud Storage "
+                     "(variable de entorno PDD_VIDEO_UPLOAD_BUCKET o VIDEO_UPLOAD_GCS_BUCKET) para enviarlo por "
+                     "referencia, o activa el proxy de análisis / RESIZE_VIDEO para reducirlo antes del análisis.")
+        return None, error_msg
+
+    print(f"Subiendo el video a gs://{VIDEO_UPLOAD_GCS_BUCKET} por bloques ({file_size / (1024 * 1024):.1f} MiB)...")
+    video_uri = upload_video_to_gcs(video_path, VIDEO_UPLOAD_GCS_BUCKET, mime_type=mime_type)
+    print(f"Video disponible en: {video_uri}")
+    return Part.from_uri(uri=video_uri, mime_type=mime_type), None
+# <<< --- FIN DE FUNCIONES DE PAYLOAD --- >>>
+
+
+def build_request(model_name: str, prompt: str, generation_config: dict, video_path: str = None,
+                  mime_type: str = "video/mp4") -> dict:
+    """Construye la solicitud normalizada que consumen todos los backends."""
+    return {
+        "model_name": model_name,
+        "prompt": prompt,
+        "generation_config": generation_config,
+        "video_path": video_path,
+        "mime_type": mime_type,
+    }
+
+def request_hash(request: dict) -> str:
+    """Hash estable de una solicitud (contenido del video + prompt + modelo + configuración)."""
+    from analysis_cache import compute_file_hash, build_cache_key
+
+    video_path = request.get("video_path")
+    video_hash = compute_file_hash(video_path) if video_path else ""
+    return build_cache_key(video_hash, request["prompt"], request["model_name"], request["generation_config"],
+                           extra={"mime_type": request.get("mime_type") if video_path else None})
+
+def _result(text: str = "", usage: dict = None, finish_reason: str = None, error: str = None) -> dict:
+    return {"text": text, "usage": usage, "finish_reason": finish_reason, "error": error}
+
+
+class ModelBackend(ABC):
+    """Interfaz común de los backends de modelo."""
+
+    name = "base"
+
+    @abstractmethod
+    def generate(self, request: dict) -> dict:
+        """Ejecuta la solicitud y devuelve el resultado normalizado completo."""
+
+    def generate_stream(self, request: dict):
+        """
+        Ejecuta la solicitud en streaming.
+
+        Yields:
+            Resultados normalizados parciales; `usage` suele llegar solo en el último.
+        """
+        # Implementación por defecto: un único fragmento con la respuesta completa
+        yield self.generate(request)
+
+
+class VertexBackend(ModelBackend):
+    """Backend real contra Vertex AI Gemini (comportamiento original del analizador)."""
+
+    name = "vertex"
+
+    def __init__(self, project_id: str, location: str):
+        self.project_id = project_id
+        self.location = location
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _get_model(self, model_name: str):
+        import vertexai
+        from vertexai.preview.generative_models import GenerativeModel
+
+        with self._lock:
+            if not self._models:
+                print(f"Inicializando Vertex AI para el proyecto {self.project_id} en {self.location}...")
+                vertexai.init(project=self.project_id, location=self.location)
+            if model_name not in self._models:
+                print(f"Cargando el modelo: {model_name}")
+                self._models[model_name] = GenerativeModel(model_name)
+            return self._models[model_name]
+
+    def _prepare_call(self, request: dict):
+        """Devuelve (modelo, contents, safety_settings, error)."""
+        import vertexai.preview.generative_models as generative_models
+
+        try:
+            model = self._get_model(request["model_name"])
+        except Exception as e:
+            print("Asegúrate de haber ejecutado 'gcloud auth application-default login' y de que el modelo exista en la región.")
+            return None, None, None, f"Error al inicializar Vertex AI o cargar el modelo: {e}"
+
+        contents = [request["prompt"]]
+        if request.get("video_path"):
+            print("Preparando el video para la solicitud (esto puede tardar)...")
+            try:
+                video_part, payload_error = build_video_part(request["video_path"], mime_type=request.get("mime_type", "video/mp4"))
+            except Exception as e:
+                return None, None, None, f"Error al leer, codificar o subir el video: {e}"
+            if payload_error:
+                return None, None, None, payload_error
+            print("Video preparado exitosamente.")
+            contents = [video_part, request["prompt"]]
+
+        # Configuración de seguridad
+        safety_settings = {
+            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+        }
+        return model, contents, safety_settings, None
+
+    @staticmethod
+    def _usage(usage_metadata) -> dict:
+        if not usage_metadata:
+            return None
+        return {
+            "input_tokens": usage_metadata.prompt_token_count,
+            "output_tokens": usage_metadata.candidates_token_count,
+            "total_tokens": usage_metadata.total_token_count,
+        }
+
+    def generate(self, request: dict) -> dict:
+        model, contents, safety_settings, error = self._prepare_call(request)
+        if error:
+            return _result(error=error)
+
+        response = model.generate_content(
+            contents,
+            generation_config=request["generation_config"],
+            safety_settings=safety_settings,
+            stream=False,
+        )
+        usage = self._usage(getattr(response, "usage_metadata", None))
+        if response.candidates and response.candidates[0].content.parts:
+            return _result(response.candidates[0].content.parts[0].text, usage,
+                           str(response.candidates[0].finish_reason))
+
+        finish_reason = response.candidates[0].finish_reason if response.candidates else "N/A"
+        safety_ratings = response.candidates[0].safety_ratings if response.candidates else "N/A"
+        # Imprimir feedback del prompt si existe
+        if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
+            print(f"Prompt Feedback: {response.prompt_feedback}")
+        return _result(usage=usage, finish_reason=str(finish_reason),
+                       error=f"Respuesta vacía o bloqueada. Razón: {finish_reason}, Ratings: {safety_ratings}")
+
+    def generate_stream(self, request: dict):
+        model, contents, safety_settings, error = self._prepare_call(request)
+        if error:
+            yield _result(error=error)
+            return
+
+        responses = model.generate_content(
+            contents,
+            generation_config=request["generation_config"],
+            safety_settings=safety_settings,
+            stream=True,
+        )
+        for chunk in responses:
+            usage = self._usage(getattr(chunk, "usage_metadata", None))
+            finish_reason = str(chunk.candidates[0].finish_reason) if chunk.candidates else None
+            text = ""
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                text = chunk.candidates[0].content.parts[0].text
+            yield _result(text, usage, finish_reason)
+
+
+class RecordReplayBackend(ModelBackend):
+    """
+    Graba respuestas de otro backend ('record') o las sirve desde disco ('replay').
+
+    Las grabaciones se guardan como JSON en `recordings_dir`, con nombre igual al hash
+    de la solicitud. En streaming se conservan los fragmentos originales.
+    """
+
+    def __init__(self, mode: str, inner: ModelBackend = None, recordings_dir: str = RECORDINGS_DIR):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Modo de grabación inválido: '{mode}'")
+        if mode == "record" and inner is None:
+            raise ValueError("El modo 'record' necesita un backend interno.")
+        self.name = mode
+        self.mode = mode
+        self.inner = inner
+        self.recordings_dir = recordings_dir
+
+    def _recording_path(self, request: dict) -> str:
+        return os.path.join(self.recordings_dir, f"{request_hash(request)}.json")
+
+    def _load(self, request: dict):
+        path = self._recording_path(request)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, request: dict, chunks: list):
+        os.makedirs(self.recordings_dir, exist_ok=True)
+        recording = {
+            "model_name": request["model_name"],
+            "video_path": request.get("video_path"),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "chunks": chunks,
+        }
+        path = self._recording_path(request)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(recording, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        print(f"[Backend] Respuesta grabada en '{path}'.")
+
+    def _missing(self, request: dict) -> dict:
+        return _result(error=f"No hay grabación para esta solicitud ({os.path.basename(self._recording_path(request))}). "
+                             "Ejecuta primero con MODEL_BACKEND='record'.")
+
+    def generate(self, request: dict) -> dict:
+        if self.mode == "replay":
+            recording = self._load(request)
+            if recording is None:
+                return self._missing(request)
+            chunks = recording["chunks"]
+            usage = next((c["usage"] for c in reversed(chunks) if c.get("usage")), None)
+            return _result("".join(c.get("text") or "" for c in chunks), usage,
+                           chunks[-1].get("finish_reason") if chunks else None,
+                           next((c["error"] for c in chunks if c.get("error")), None))
+        result = self.inner.generate(request)
+        if not result.get("error"):
+            self._save(request, [result])
+        return result
+
+    def generate_stream(self, request: dict):
+        if self.mode == "replay":
+            recording = self._load(request)
+            if recording is None:
+                yield self._missing(request)
+                return
+            yield from recording["chunks"]
+            return
+        chunks = []
+        for chunk in self.inner.generate_stream(request):
+            chunks.append(chunk)
+            yield chunk
+        if not any(c.get("error") for c in chunks):
+            self._save(request, chunks)
+
+
+# Claves pedidas explícitamente (prompts narrativos por etapas y de continuación)
+STUB_REQUESTED_KEYS_PATTERN = re.compile(r"con estas claves(?: faltantes)?: (\w+(?:, \w+)*)")
+# Claves de la estructura JSON de salida del prompt (análisis completo o etapa de pasos)
+STUB_STRUCTURE_KEY_PATTERN = re.compile(r'"((?:pdd|section)_\w+)":')
+# Continuación de pasos: solo los posteriores al último recuperado
+STUB_STEPS_AFTER_PATTERN = re.compile(r"posteriores al paso (\d+) \(timestamp (-?\d+) ms\)")
+STUB_STEPS_KEY = "section_3_3_detailed_steps"
+
+
+class SyntheticStubBackend(ModelBackend):
+    """
+    Backend local y determinista para pruebas de carga y benchmarks del resto del pipeline.
+
+    Genera un JSON v0.3 plausible: un paso cada `seconds_per_step` segundos de video,
+    textos de ejemplo en todas las secciones narrativas y un BPMN lineal válido. Responde
+    solo con las claves que pide el prompt (`requested_keys`), de modo que el análisis por
+    etapas y las continuaciones reciben lo mismo que devolvería el modelo real.
+    La misma solicitud produce siempre la misma respuesta.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_sec: float = STUB_LATENCY_SEC, seconds_per_step: float = STUB_SECONDS_PER_STEP,
+                 seed: int = STUB_SEED):
+        self.latency_sec = latency_sec
+        self.seconds_per_step = seconds_per_step
+        self.seed = seed
+
+    @staticmethod
+    def _video_duration_ms(video_path: str) -> int:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return 0
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        cap.release()
+        return int(total_frames / fps * 1000) if fps and fps > 0 and total_frames > 0 else 0
+
+    def build_analysis(self, duration_ms: int, rng: random.Random) -> dict:
+        """Construye el JSON v0.3 sintético para un video de `duration_ms`."""
+        from bpmn_builder import build_bpmn_xml_from_steps
+
+        applications = ["Microsoft Edge", "Microsoft Excel", "Explorador de Archivos"]
+        actions = ["Hacer clic en el botón 'Aceptar'", "Escribir el valor en la celda 'B2' de la hoja 'Hoja1'",
+                   "Abrir el menú 'Archivo'", "Seleccionar el rango 'A1:C10' en la hoja 'Datos'",
+                   "Navegar a la URL del portal", "Pegar datos (Ctrl+V) en la celda 'A2'"]
+        step_count = max(1, int(duration_ms / 1000 / self.seconds_per_step))
+        step_span_ms = duration_ms / step_count if duration_ms > 0 else 1000
+        steps = []
+        for index in range(step_count):
+            action = rng.choice(actions)
+            steps.append({
+                "step_number": index + 1,
+                "description": f"Paso sintético {index + 1}: {action.split(' ')[0].lower()} elemento",
+                "timestamp_ms": int(index * step_span_ms + rng.uniform(0.2, 0.8) * step_span_ms),
+                "application_in_focus": rng.choice(applications),
+                "action_type_inferred": f"{action} (generado por el backend stub).",
+            })
+
+        stub_text = "Texto sintético generado por el backend stub para pruebas."
+        return {
+            "pdd_metadata_inferred": {"process_name_suggestion": "Proceso Sintético de Prueba", "potential_acronym": "PSP"},
+            "section_1_1_purpose_text": stub_text,
+            "section_1_2_objectives_text": stub_text,
+            "section_1_3_1_scope_in_suggestion": stub_text,
+            "section_1_3_2_scope_out_suggestion": stub_text,
+            "section_2_0_context_text": stub_text,
+            "section_3_1_as_is_summary_text": stub_text,
+            "section_3_1_user_roles_inferred": sorted({f"Usuario {s['application_in_focus']}" for s in steps}),
+            "section_3_2_bpmn_xml_code": build_bpmn_xml_from_steps(steps),
+            "section_3_3_detailed_steps": steps,
+            "section_3_4_inputs_suggestion": stub_text,
+            "section_3_5_outputs_suggestion": stub_text,
+            "section_3_6_rules_suggestion": stub_text,
+            "section_4_1_tobe_summary_suggestion": stub_text,
+            "section_4_3_interaction_suggestion": stub_text,
+            "section_5_exceptions_suggestions": [
+                {"exception_type": "Negocio", "description": "Datos de entrada incompletos.",
+                 "potential_trigger": "Archivo sin filas.", "suggested_handling_idea": "Notificar al usuario."},
+                {"exception_type": "Aplicación", "description": "La aplicación no responde.",
+                 "potential_trigger": "Tiempo de espera agotado.", "suggested_handling_idea": "Reintentar 3 veces."},
+            ],
+            "section_6_2_dependencies_suggestion": stub_text,
+            "section_6_4_reporting_suggestion": stub_text,
+        }
+
+    @staticmethod
+    def requested_keys(prompt: str) -> list:
+        """
+        Devuelve las claves que pide el prompt: la lista explícita de los prompts narrativos y de
+        continuación o, si no la hay, las de su estructura JSON de salida. Lista vacía = todas.
+        """
+        match = STUB_REQUESTED_KEYS_PATTERN.search(prompt)
+        if match:
+            return match.group(1).split(", ")
+        return list(dict.fromkeys(STUB_STRUCTURE_KEY_PATTERN.findall(prompt)))
+
+    def build_response(self, prompt: str, duration_ms: int, rng: random.Random) -> dict:
+        """Construye la respuesta sintética con las claves pedidas por `prompt`."""
+        analysis = self.build_analysis(duration_ms, rng)
+        steps_after = STUB_STEPS_AFTER_PATTERN.search(prompt)
+        if steps_after: # Continuación: solo los pasos posteriores al último recuperado
+            last_step, last_ms = int(steps_after.group(1)), int(steps_after.group(2))
+            steps = [step for step in analysis[STUB_STEPS_KEY] if step["timestamp_ms"] > last_ms]
+            for number, step in enumerate(steps, start=last_step + 1):
+                step["step_number"] = number
+            analysis[STUB_STEPS_KEY] = steps
+        keys = self.requested_keys(prompt)
+        if not keys:
+            return analysis
+        return {key: analysis[key] for key in keys if key in analysis}
+
+    def generate(self, request: dict) -> dict:
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+        video_path = request.get("video_path")
+        duration_ms = self._video_duration_ms(video_path) if video_path else 0
+        rng = random.Random(f"{self.seed}:{request['model_name']}:{duration_ms}:{len(request['prompt'])}")
+        text = json.dumps(self.build_response(request["prompt"], duration_ms, rng), ensure_ascii=False, indent=2)
+        # Estimación aproximada: ~290 tokens por segundo de video y ~4 caracteres por token
+        input_tokens = int(duration_ms / 1000 * 290) + len(request["prompt"]) // 4
+        output_tokens = len(text) // 4
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        return _result(text, usage, "STOP")
+
+    def generate_stream(self, request: dict):
+        result = self.generate(request)
+        text = result["text"]
+        chunk_size = 512
+        for start in range(0, len(text), chunk_size):
+            is_last = start + chunk_size >= len(text)
+            yield _result(text[start:start + chunk_size], result["usage"] if is_last else None,
+                          result["finish_reason"] if is_last else None)
+
+
+def get_backend_name(name: str = None) -> str:
+    """Devuelve el nombre normalizado del backend indicado (o del activo, `MODEL_BACKEND`, si es None)."""
+    return (name or MODEL_BACKEND).lower()
+
+def is_billed_backend(name: str = None) -> bool:
+    """Indica si el backend llama al modelo real: 'replay' y 'stub' no generan costo."""
+    return get_backend_name(name) in BILLED_BACKENDS
+
+def get_backend(name: str = None, project_id: str = None, location: str = None) -> ModelBackend:
+    """
+    Crea el backend indicado por `name` (o por `MODEL_BACKEND` si es None).
+    """
+    name = get_backend_name(name)
+    if name == "vertex":
+        return VertexBackend(project_id, location)
+    if name == "record":
+        return RecordReplayBackend("record", inner=VertexBackend(project_id, location))
+    if name == "replay":
+        return RecordReplayBackend("replay")
+    if name == "stub":
+        return SyntheticStubBackend()
+    raise ValueError(f"Backend de modelo desconocido: '{name}'. Usa 'vertex', 'record', 'replay' o 'stub'.")
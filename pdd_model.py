@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+from datetime import datetime # Para fecha de generación
+
+# Modelo intermedio del PDD: se construye una vez por trabajo a partir del JSON de análisis (v0.3) y
+# lo consumen todos los renderizadores (DOCX, Markdown, HTML). El modelo no se modifica al renderizar,
+# así que los renderizadores pueden ejecutarse a la vez.
+
+# --- Configuración del Modelo ---
+MEDIA_FORMAT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg"} # Imágenes preparadas (ver `prepare_step_pictures`)
+# --- Fin Configuración ---
+
+# Notas y placeholders en español
+AI_NOTE_TEXT = "(Nota: El siguiente texto fue generado por IA basado en el análisis del video y puede requerir revisión y edición.)"
+AI_NOTE_TEXT_SPECULATIVE = "(Nota: El siguiente texto es una sugerencia altamente especulativa generada por IA basada en el análisis del video y requiere revisión humana significativa, validación y potencialmente reescritura completa.)"
+STEPS_NOTE_TEXT = "(Nota: Los siguientes pasos fueron extraídos por IA y pueden requerir revisión y edición para precisión y completitud. Los screenshots corresponden a fotogramas identificados por el script de extracción.)"
+STEPS_TABLE_HEADERS = ["Step ID", "Application", "Action", "Detailed Description", "Screenshot"] # Encabezados en inglés
+DOCUMENT_TITLE = "Process Description Document (PDD)"
+APPROVERS_PLACEHOLDER = "Tabla o lista de Aprobadores: Nombre, Rol, Fecha Firma"
+
+# Estructura del documento (secciones 1-7), compartida por el esqueleto DOCX y los renderizadores de texto.
+#   heading:  solo encabezado.
+#   ai_text:  encabezado + texto de IA de `key` en el JSON (marcador `key` en la plantilla DOCX).
+#   manual:   encabezado + placeholder a completar a mano (`paste`: placeholder adicional para pegar una imagen).
+#   field:    encabezado y placeholder opcionales + contenido generado `field` (marcador `pdd_<field>`).
+#   steps:    tabla de pasos detallados (marcador `pdd_steps_table`).
+PDD_OUTLINE = [
+    # --- Sección 1: Introducción ---
+    {"kind": "heading", "level": 1, "title": "1.0 Introduction"}, # Título EN
+    {"kind": "ai_text", "level": 2, "title": "1.1 Propósito del Documento", "key": "section_1_1_purpose_text", "speculative": False}, # Título ES
+    {"kind": "ai_text", "level": 2, "title": "1.2 Objetivos de la Automatización", "key": "section_1_2_objectives_text", "speculative": True}, # Título ES
+    {"kind": "heading", "level": 2, "title": "1.3 Alcance de la Automatización (Scope)"}, # Título Mixto
+    {"kind": "ai_text", "level": 3, "title": "1.3.1 Dentro del Alcance (In Scope)", "key": "section_1_3_1_scope_in_suggestion", "speculative": True}, # Título Mixto
+    {"kind": "ai_text", "level": 3, "title": "1.3.2 Fuera del Alcance (Out of Scope)", "key": "section_1_3_2_scope_out_suggestion", "speculative": True}, # Título Mixto
+    {"kind": "manual", "level": 2, "title": "1.4 Contactos Clave / Interesados (Stakeholders)", "placeholder": "Tabla o lista con Nombre, Rol (SME, Propietario Proceso, BA, etc.), Información de Contacto."}, # Título Mixto
+    {"kind": "manual", "level": 2, "title": "1.5 Prerrequisitos Mínimos para la Automatización", "placeholder": "Listar elementos necesarios ANTES de iniciar el desarrollo (ej: PDD aprobado, datos prueba, accesos, entorno listo)."}, # Título ES
+    # --- Sección 2: Contexto del Negocio ---
+    {"kind": "ai_text", "level": 1, "title": "2.0 Business Context", "key": "section_2_0_context_text", "speculative": False}, # Título EN
+    # --- Sección 3: Descripción del Proceso As-Is ---
+    {"kind": "heading", "level": 1, "title": "3.0 Process Description As-Is"}, # Título EN/Mixto
+    {"kind": "ai_text", "level": 2, "title": "3.1 Overview of the As-Is Process", "key": "section_3_1_as_is_summary_text", "speculative": False}, # Título EN/Mixto
+    {"kind": "field", "field": "user_roles"}, # Roles inferidos
+    {"kind": "field", "level": 2, "title": "3.2 Process Flow Diagram As-Is (BPMN 2.0)", "field": "bpmn"}, # Título mixto
+    {"kind": "steps", "level": 2, "title": "3.3 Detailed Process Steps As-Is"}, # Título mixto
+    {"kind": "ai_text", "level": 2, "title": "3.4 Datos de Entrada (Inputs)", "key": "section_3_4_inputs_suggestion", "speculative": True}, # Título Mixto
+    {"kind": "ai_text", "level": 2, "title": "3.5 Datos de Salida (Outputs)", "key": "section_3_5_outputs_suggestion", "speculative": True}, # Título Mixto
+    {"kind": "ai_text", "level": 2, "title": "3.6 Reglas de Negocio (Business Rules)", "key": "section_3_6_rules_suggestion", "speculative": True}, # Título Mixto
+    # --- Sección 4: Descripción del Proceso To-Be ---
+    {"kind": "heading", "level": 1, "title": "4.0 Process Description To-Be"}, # Título EN/Mixto
+    {"kind": "ai_text", "level": 2, "title": "4.1 Overview of the To-Be Process", "key": "section_4_1_tobe_summary_suggestion", "speculative": True}, # Título EN/Mixto
+    {"kind": "manual", "level": 2, "title": "4.2 Process Flow Diagram To-Be", "placeholder": "Crear (manualmente) un diagrama de flujo futuro (To-Be) (BPMN o simple) diferenciando pasos de robot y manuales. Pegar la imagen aquí.",
+     "paste": "<< PEGUE AQUÍ LA IMAGEN DEL DIAGRAMA TO-BE >>"}, # Título EN/Mixto
+    {"kind": "ai_text", "level": 2, "title": "4.3 Interacción Humano-Robot", "key": "section_4_3_interaction_suggestion", "speculative": True}, # Título ES
+    # --- Sección 5: Manejo de Excepciones y Errores ---
+    {"kind": "heading", "level": 1, "title": "5.0 Exception and Error Handling"}, # Título EN
+    {"kind": "field", "level": 2, "title": "5.1 Excepciones de Negocio (Business Exceptions)", "field": "exceptions_business",
+     "placeholder": "Tabla o lista detallando las desviaciones conocidas del flujo estándar basadas en condiciones de negocio. Para cada una: ID, Descripción, Disparador (Trigger), Pasos de Manejo Requeridos (por robot o humano)."}, # Título mixto
+    {"kind": "field", "level": 2, "title": "5.2 Errores de Aplicación/Sistema (Application/System Errors)", "field": "exceptions_application",
+     "placeholder": "Tabla o lista detallando cómo el robot debe manejar errores técnicos. Para cada uno: ID, Descripción, Disparador, Lógica de Manejo (ej: reintentos, log, notificación, detener)."}, # Título mixto
+    {"kind": "manual", "level": 2, "title": "5.3 Manejo de Errores/Excepciones Desconocidas", "placeholder": "Definir el procedimiento estándar cuando ocurre un error o excepción no contemplado (ej: tomar screenshot, guardar estado, notificar a soporte, detener proceso)."}, # Título ES
+    # --- Sección 6: Información Contextual Adicional ---
+    {"kind": "heading", "level": 1, "title": "6.0 Additional Contextual Information"}, # Título EN
+    {"kind": "field", "level": 2, "title": "6.1 Applications Used", "field": "applications"}, # Título EN
+    {"kind": "ai_text", "level": 2, "title": "6.2 Dependencies", "key": "section_6_2_dependencies_suggestion", "speculative": True}, # Título EN
+    {"kind": "manual", "level": 2, "title": "6.3 As-Is Process Statistics/Metrics", "placeholder": "Incluir datos cuantitativos clave del proceso manual (Volumen, AHT, Tasa Error, FTEs, Costo, etc.). Obtener estos datos del negocio."}, # Título EN/Mixto
+    {"kind": "ai_text", "level": 2, "title": "6.4 Reporting and Logging Requirements", "key": "section_6_4_reporting_suggestion", "speculative": True}, # Título EN
+    # --- Sección 7: Apéndice ---
+    {"kind": "heading", "level": 1, "title": "7.0 Appendix"}, # Título EN
+    {"kind": "manual", "level": 2, "title": "7.1 Glossary of Terms", "placeholder": "Definir acrónimos y términos técnicos o de negocio específicos utilizados."}, # Título EN
+    {"kind": "manual", "level": 2, "title": "7.2 Document Revision History", "placeholder": "Tabla con Versión, Fecha, Autor, Descripción de Cambios, Aprobador."}, # Título EN
+    {"kind": "manual", "level": 2, "title": "7.3 Other Reference Documents", "placeholder": "Listar cualquier otro documento relevante (SOPs existentes, guías de usuario, etc.)."}, # Título EN
+]
+
+
+def load_analysis_json(json_path: str):
+    """
+    Carga el JSON de análisis. Un JSON con el formato anterior (lista plana de pasos) se adapta
+    al esquema v0.3 como `section_3_3_detailed_steps`.
+
+    Returns:
+        El diccionario, o None si falla.
+    """
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            json_data = json.load(f)
+        if isinstance(json_data, list):
+            print("Advertencia: JSON con el formato anterior (lista de pasos); se usa como pasos detallados.")
+            json_data = {"section_3_3_detailed_steps": json_data}
+        print("Datos JSON cargados exitosamente.")
+        return json_data
+    except FileNotFoundError:
+        print(f"Error Crítico: No se pudo encontrar el archivo JSON '{json_path}'.")
+    except json.JSONDecodeError as e:
+        print(f"Error Crítico: El archivo JSON '{json_path}' no es válido: {e}")
+    except Exception as e:
+        print(f"Error Crítico inesperado al cargar JSON: {e}")
+    return None
+
+def title_fields(user_metadata: dict, ai_metadata: dict) -> dict:
+    """Valores de los campos de la página de título."""
+    process_name = ai_metadata.get('process_name_suggestion') or user_metadata.get('project_name', 'Proceso Desconocido')
+    acronym = ai_metadata.get('potential_acronym') or user_metadata.get('project_acronym', '')
+    acronym_str = f"({acronym})" if acronym else ""
+    return {
+        "pdd_process_name": f"{process_name} {acronym_str}", # Process name comes from AI (Spanish)
+        "pdd_version": str(user_metadata.get('version', '<x.x>')),
+        "pdd_status": user_metadata.get('status', 'BORRADOR'), # Usar estado en español
+        "pdd_author": user_metadata.get('author_name', '<Nombre Autor>'),
+        "pdd_date": datetime.now().strftime('%Y-%m-%d'),
+    }
+
+def applications_placeholder_text(steps_list: list) -> str:
+    """Texto del placeholder de la sección 6.1 con las aplicaciones detectadas en los pasos."""
+    applications = sorted(set(step.get("application_in_focus", "N/A") for step in steps_list
+                              if step.get("application_in_focus") != "N/A"))
+    return ("Tabla listando TODAS las aplicaciones involucradas (Nombre, Tipo, Versión, Entorno, Acceso).\n"
+            "Aplicaciones Detectadas por IA (Verificar y Completar):\n" + "\n".join([f"- {app}" for app in applications] or ["- Ninguna detectada"]))
+
+def exception_lines(exception: dict) -> str:
+    """Texto de una sugerencia de excepción (usa el texto en español del JSON)."""
+    return (f"Desc: {exception.get('description', 'N/A')}\nTrigger: {exception.get('potential_trigger', 'N/A')}\n"
+            f"Idea Manejo: {exception.get('suggested_handling_idea', 'N/A')}")
+
+def build_pdd_model(json_data: dict, user_metadata: dict, output_bpmn_path: str = None, bpmn_error: str = None) -> dict:
+    """
+    Construye el modelo del documento a partir del JSON de análisis (una vez por trabajo).
+
+    Args:
+        bpmn_error: Error devuelto por `write_bpmn_file` (None si el BPMN se guardó).
+
+    Returns:
+        {title: {campo: texto}, ai_text: {clave: texto o None}, roles, bpmn: {xml, path, error},
+        exceptions: {business, application}, applications_text, steps, blocks, pictures, media}.
+        `blocks` es la secuencia de bloques de texto de las secciones 1-7 (ver `build_blocks`);
+        `pictures` y `media` se completan después con `attach_pictures` y `write_model_media`.
+    """
+    exceptions_list = json_data.get("section_5_exceptions_suggestions", [])
+    steps_list = json_data.get("section_3_3_detailed_steps", [])
+    model = {
+        "title": title_fields(user_metadata, json_data.get("pdd_metadata_inferred", {})),
+        "ai_text": {entry["key"]: json_data.get(entry["key"]) for entry in PDD_OUTLINE if entry["kind"] == "ai_text"},
+        "roles": json_data.get("section_3_1_user_roles_inferred", []),
+        "bpmn": {"xml": json_data.get("section_3_2_bpmn_xml_code"), "path": output_bpmn_path, "error": bpmn_error},
+        "exceptions": {
+            "business": [e for e in exceptions_list if e.get("exception_type") == "Negocio"],
+            "application": [e for e in exceptions_list if e.get("exception_type") == "Aplicación"],
+        },
+        "applications_text": applications_placeholder_text(steps_list),
+        "steps": steps_list,
+        "pictures": None,
+        "media": {},
+    }
+    model["blocks"] = build_blocks(model)
+    return model
+
+def _field_blocks(model: dict, field: str) -> list:
+    """Bloques del contenido generado de un campo `field` del esquema."""
+    if field == "user_roles":
+        blocks = [{"type": "note", "text": AI_NOTE_TEXT}, {"type": "label", "text": "Roles de Usuario Implicados (Inferidos por IA):"}]
+        if model["roles"]:
+            return blocks + [{"type": "list", "items": list(model["roles"])}]
+        return blocks + [{"type": "placeholder", "text": "No se infirieron roles de usuario."}]
+    if field == "bpmn":
+        bpmn = model["bpmn"]
+        if bpmn["xml"] and bpmn["path"] and not bpmn["error"]:
+            file_name = os.path.basename(bpmn["path"])
+            return [
+                {"type": "label", "text": "Instrucciones:"},
+                {"type": "list", "ordered": True, "items": [
+                    f"Importar el archivo generado '{file_name}' en una herramienta de modelado BPMN (ej: bpmn.io online, draw.io, Camunda Modeler).",
+                    "Revisar y editar significativamente el diagrama para reflejar con precisión el flujo del proceso actual (As-Is), incluyendo decisiones, caminos paralelos, etc.",
+                    "Exportar el diagrama final como imagen (PNG recomendado).",
+                    "Eliminar este texto de instrucciones y pegar la imagen exportada a continuación.",
+                ]},
+                {"type": "placeholder", "text": "<< PEGUE AQUÍ LA IMAGEN DEL DIAGRAMA BPMN AS-IS >>"},
+            ]
+        if bpmn["xml"] and not bpmn["path"]:
+            return [{"type": "placeholder", "text": "El BPMN XML está en el JSON de análisis ('section_3_2_bpmn_xml_code'). Guárdelo como archivo .bpmn para importarlo."}]
+        if bpmn["xml"]:
+            return [{"type": "placeholder", "text": f"Error al guardar el archivo BPMN XML: {bpmn['error']}. Revise la salida de la IA o los permisos."}]
+        return [{"type": "placeholder", "text": "No se encontró código BPMN XML en la salida del análisis de IA."}]
+    if field in ("exceptions_business", "exceptions_application"):
+        exceptions = model["exceptions"][field.split("_", 1)[1]]
+        if not exceptions:
+            return []
+        return [{"type": "note", "text": AI_NOTE_TEXT_SPECULATIVE}, {"type": "label", "text": "Sugerencias IA (Revisar y Detallar):"},
+                {"type": "list", "items": [exception_lines(ex) for ex in exceptions]}]
+    if field == "applications":
+        return [{"type": "placeholder", "text": model["applications_text"]}]
+    raise ValueError(f"Campo desconocido en el esquema del PDD: '{field}'.")
+
+def build_blocks(model: dict) -> list:
+    """
+    Recorre PDD_OUTLINE y devuelve las secciones 1-7 como bloques independientes del formato:
+    {type: heading (level, text) | note | text | placeholder | label (text) | list (items, ordered) | steps}.
+    """
+    blocks = []
+    for entry in PDD_OUTLINE:
+        if entry.get("title"):
+            blocks.append({"type": "heading", "level": entry["level"], "text": entry["title"]})
+        if entry["kind"] == "ai_text":
+            text = model["ai_text"].get(entry["key"])
+            blocks.append({"type": "note", "text": AI_NOTE_TEXT_SPECULATIVE if entry["speculative"] else AI_NOTE_TEXT})
+            blocks.append({"type": "text", "text": text} if text else
+                          {"type": "placeholder", "text": f"La IA no generó texto para '{entry['key']}' o faltaba en el JSON."})
+        elif entry["kind"] == "manual":
+            blocks.append({"type": "placeholder", "text": entry["placeholder"]})
+            if entry.get("paste"):
+                blocks.append({"type": "placeholder", "text": entry["paste"]})
+        elif entry["kind"] == "field":
+            if entry.get("placeholder"):
+                blocks.append({"type": "placeholder", "text": entry["placeholder"]})
+            blocks.extend(_field_blocks(model, entry["field"]))
+        elif entry["kind"] == "steps":
+            if model["steps"]:
+                blocks.append({"type": "note", "text": STEPS_NOTE_TEXT})
+                blocks.append({"type": "steps"})
+            else:
+                blocks.append({"type": "placeholder", "text": "No se encontraron pasos detallados en la salida del análisis de IA."})
+    return blocks
+
+def attach_pictures(model: dict, pictures: dict):
+    """Guarda en el modelo las imágenes de los pasos ya preparadas (una sola vez para todos los formatos)."""
+    model["pictures"] = pictures
+
+def _media_path(media_dir: str, step_number, picture: dict) -> str:
+    return os.path.join(media_dir, f"paso_{step_number}{MEDIA_FORMAT_EXTENSIONS.get(picture.get('format'), '.png')}")
+
+def spill_pictures(step_pictures, media_dir: str) -> dict:
+    """
+    Guarda en `media_dir` las imágenes de `step_pictures` (iterable de (step_number, imagen o None),
+    ver `generar_docx_pdd.iter_step_pictures`) a medida que llegan, sin retenerlas en memoria.
+
+    Returns:
+        {step_number: {path, width, height, format} o {error}}, para `attach_pictures`.
+    """
+    pictures = {}
+    for step_number, picture in step_pictures:
+        if picture is None:
+            continue
+        if "data" not in picture:
+            pictures[step_number] = picture
+            continue
+        os.makedirs(media_dir, exist_ok=True)
+        path = _media_path(media_dir, step_number, picture)
+        try:
+            with open(path, 'wb') as f:
+                f.write(picture["data"])
+        except OSError as e:
+            print(f"    Advertencia: No se pudo escribir la imagen del paso {step_number} en '{path}': {e}")
+            pictures[step_number] = {"error": str(e)}
+            continue
+        pictures[step_number] = {"path": path, "width": picture["width"], "height": picture["height"],
+                                 "format": picture["format"]}
+    return pictures
+
+def write_model_media(model: dict, media_dir: str) -> dict:
+    """
+    Escribe las imágenes preparadas del modelo en `media_dir` (para Markdown/HTML) y registra sus
+    rutas en `model["media"]` ({step_number: ruta}). Las imágenes ya guardadas (con `path`, ver
+    `spill_pictures`) se registran sin copiarlas; las imágenes con error se omiten.
+
+    Returns:
+        model["media"].
+    """
+    media = {}
+    if any("data" in picture for picture in (model["pictures"] or {}).values()):
+        os.makedirs(media_dir, exist_ok=True)
+    for step_number, picture in (model["pictures"] or {}).items():
+        if "data" not in picture:
+            if "path" in picture:
+                media[step_number] = picture["path"]
+            continue
+        path = _media_path(media_dir, step_number, picture)
+        try:
+            with open(path, 'wb') as f:
+                f.write(picture["data"])
+        except OSError as e:
+            print(f"    Advertencia: No se pudo escribir la imagen del paso {step_number} en '{path}': {e}")
+            continue
+        media[step_number] = path
+    model["media"] = media
+    return media
+
+def media_link(model: dict, step_number, output_path: str):
+    """Ruta de la imagen de un paso relativa al documento `output_path` (None si no hay imagen)."""
+    path = model["media"].get(step_number)
+    if path is None:
+        return None
+    return os.path.relpath(path, os.path.dirname(os.path.abspath(output_path))).replace(os.sep, '/')
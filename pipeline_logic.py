@@ -3,16 +3,38 @@ import sys
 import os
 import traceback # Para obtener más detalles de errores
 import tempfile
+import json
+import asyncio
 import cv2 # Necesario para redimensionar
 
 # Importar las funciones principales de los scripts de las fases v0.3
 try:
-    from video_analyzer import analyze_video_steps
-    from extraer_screenshots import extract_screenshots
-    from generar_docx_pdd import generate_pdd_docx_v0_3
+    from video_analyzer import analyze_video_steps, ANALYSIS_PROMPT_V0_3, GENERATION_CONFIG
+    from model_backends import get_backend_name
+    from extraer_screenshots import extract_screenshots, apply_frame_offsets, IncrementalScreenshotExtractor
+    from generar_docx_pdd import (write_bpmn_file, build_pdd_document, insert_steps_table, save_pdd_document,
+                                  prepare_step_pictures, iter_step_pictures, stream_pdd_docx)
+    from pdd_model import build_pdd_model, attach_pictures, spill_pictures, write_model_media
+    from generar_pdd import render_markdown
+    from generar_html_pdd import render_html
+    from analysis_cache import compute_file_hash, build_cache_key, cache_get, cache_put, get_cache_stats
+    from segmented_analysis import (analyze_video_segmented, get_video_duration_ms, SEGMENTED_MIN_DURATION_SEC,
+                                    SEGMENTED_WINDOW_SEC, SEGMENTED_OVERLAP_SEC)
+    from staged_analysis import (analyze_video_staged, narrative_prompt_chars, STEPS_PROMPT_V0_3, TEXT_MODEL_NAME,
+                                 NARRATIVE_SECTION_GROUPS)
+    from cost_estimator import plan_within_budget, record_run_cost
+    from async_client import AsyncModelClient, get_shared_client
+    from video_proxy import (transcode_video, print_transcode_stats, build_analysis_proxy, remap_analysis_timestamps,
+                             remap_step_timestamp, PROXY_TARGET_FPS, PROXY_FOURCC)
+    from scene_detection import detect_scene_segments
+    from proxy_cache import get_or_build_proxy, release_proxy_pin
+    from stage_scheduler import Stage, StageError, run_stages, first_stage_error, print_stage_report
 except ImportError as e:
     print(f"Error Crítico: No se pudieron importar funciones de los scripts de fases.")
-    print(f"Asegúrate de que 'video_analyzer.py', 'extraer_screenshots.py', y 'generar_docx_pdd.py' estén en la misma carpeta.")
+    if e.name and os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{e.name}.py")):
+        print(f"El módulo '{e.name}.py' existe pero falla al importar (revisa sus propias dependencias).")
+    elif e.name:
+        print(f"Falta el módulo '{e.name}': copia '{e.name}.py' en la misma carpeta o instálalo (pip install -r requirements.txt).")
     print(f"Detalle: {e}")
     sys.exit(1)
 
@@ -38,6 +60,65 @@ DEFAULT_USER_METADATA = {
 # --- Configuración de Redimensionamiento (NUEVO) ---
 RESIZE_VIDEO = True # Poner en False para deshabilitar el redimensionamiento
 RESIZE_TARGET_WIDTH = 1280 # Ancho objetivo en píxeles (ej: 1280 para ~720p si es 16:9)
+
+# --- Configuración del Caché de Análisis ---
+# Reutiliza el JSON de la IA si el mismo video se analiza con el mismo prompt, modelo y configuración.
+ANALYSIS_CACHE_ENABLED = True
+
+# --- Configuración del Análisis Segmentado ---
+# Videos de al menos SEGMENTED_MIN_DURATION_SEC se analizan en ventanas solapadas concurrentes
+# (ver segmented_analysis.py) para evitar respuestas truncadas por max_output_tokens.
+SEGMENTED_ANALYSIS_ENABLED = True
+
+# --- Configuración del Análisis en Streaming ---
+# Pide la respuesta en streaming y extrae cada screenshot en cuanto su paso llega completo,
+# ocultando la Fase 2.2 detrás de la latencia del modelo (solo en análisis de una llamada).
+STREAMING_ANALYSIS_ENABLED = True
+
+# --- Configuración del Control de Presupuesto ---
+# Estima el costo antes de llamar a la API y rechaza o reduce la resolución si excede los límites
+# de cost_estimator.py (MAX_COST_PER_JOB_USD, MAX_COST_PER_DAY_USD, BUDGET_ACTION).
+BUDGET_CONTROL_ENABLED = True
+
+# --- Configuración de Entrega de Screenshots ---
+# Los screenshots se entregan codificados en memoria a la Fase 3.3 (sin releerlos del disco ni decodificarlos
+# de nuevo). Con SCREENSHOTS_WRITE_TO_DISK = False no se escriben en `screenshots_output/` (sin reutilización
+# entre ejecuciones).
+SCREENSHOTS_IN_MEMORY = True
+SCREENSHOTS_WRITE_TO_DISK = True
+
+# --- Configuración de Formatos de Salida ---
+# Además del DOCX, formatos generados desde el mismo modelo del documento (pdd_model.py), en paralelo y
+# con una sola preparación de imágenes: 'markdown' y/o 'html'. Las imágenes se comparten en OUTPUT_MEDIA_DIR.
+EXTRA_OUTPUT_FORMATS = ()
+OUTPUT_MD_PATH = 'PDD_Generated_Output_v0.3.md'
+OUTPUT_HTML_PATH = 'PDD_Generated_Output_v0.3.html'
+OUTPUT_MEDIA_DIR = 'PDD_Generated_Output_v0.3_media'
+
+# --- Configuración del DOCX en Streaming ---
+# Para procesos muy largos: la tabla de pasos y sus imágenes se escriben directamente en el .docx a medida
+# que se preparan (ver docx_stream.py), con memoria acotada por paso en lugar de por documento. Con
+# SCREENSHOTS_WRITE_TO_DISK los screenshots ya no se retienen en memoria (se leen del disco al escribir cada fila).
+DOCX_STREAMING_WRITER = False
+
+# --- Configuración de Detección de Escenas ---
+# Envía al modelo solo los tramos con cambios de interfaz (ver scene_detection.py); los timestamps
+# de la respuesta se traducen de vuelta al tiempo del video original.
+SCENE_DETECTION_ENABLED = True
+
+# --- Configuración del Proxy de Análisis ---
+# El modelo recibe siempre un proxy sin audio, a video_proxy.PROXY_TARGET_FPS y con el codec
+# video_proxy.PROXY_FOURCC; los timestamps se traducen al original fotograma a fotograma.
+ANALYSIS_PROXY_ENABLED = True
+# Reutiliza los proxies entre ejecuciones y reintentos (ver proxy_cache.py: clave por hash del original,
+# ancho, fps, codec y tramos; cuota de disco PROXY_CACHE_MAX_BYTES).
+PROXY_CACHE_ENABLED = True
+
+# --- Configuración del Análisis por Etapas ---
+# La llamada con video devuelve solo metadata y pasos; las secciones narrativas se generan con llamadas
+# concurrentes de solo texto (staged_analysis.TEXT_MODEL_NAME) y el BPMN localmente desde los pasos (no el
+# del modelo). Opcional: cambia el contenido del documento respecto de la llamada única.
+STAGED_ANALYSIS_ENABLED = False
 # --- Fin Configuración ---
 
 
@@ -62,7 +143,6 @@ def resize_video(input_path: str, output_path: str, target_width: int) -> bool:
     # Obtener propiedades originales
     original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    original_fps = cap.get(cv2.CAP_PROP_FPS)
 
     if original_width == 0 or original_height == 0:
         print(f"[Resize] Error: Dimensiones originales inválidas ({original_width}x{original_height}).")
@@ -78,182 +158,486 @@ def resize_video(input_path: str, output_path: str, target_width: int) -> bool:
         # Devolvemos False para indicar que no se creó un *nuevo* archivo redimensionado.
         return False # No se creó archivo nuevo
 
-    # Calcular nueva altura manteniendo proporción
-    aspect_ratio = original_height / original_width
-    target_height = int(target_width * aspect_ratio)
-    new_size = (target_width, target_height)
-    print(f"[Resize] Dimensiones originales: {original_width}x{original_height}. Nuevas: {target_width}x{target_height}")
-
-    # Definir codec y crear VideoWriter (usar .mp4 para compatibilidad)
-    # El codec 'mp4v' es común para .mp4
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    writer = cv2.VideoWriter(output_path, fourcc, original_fps, new_size)
-    if not writer.isOpened():
-        print(f"[Resize] Error: No se pudo crear el VideoWriter para '{output_path}'")
-        cap.release()
+    cap.release()
+
+    # Decodificación, redimensionamiento y codificación en etapas concurrentes (ver video_proxy.py)
+    stats = transcode_video(input_path, output_path, target_width)
+    if stats is None:
+        print(f"[Resize] Error: Falló la transcodificación de '{input_path}'.")
         return False
+    print_transcode_stats(stats, "Resize")
+    print(f"[Resize] Proceso completado. Video redimensionado guardado en '{output_path}'.")
+    return True
 
-    # Leer, redimensionar y escribir cada fotograma
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break # Fin del video o error de lectura
 
-        resized_frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
-        writer.write(resized_frame)
-        frame_count += 1
+def save_analysis_json(analysis_data: dict, json_path: str):
+    """
+    Guarda el resultado del análisis IA en el JSON que consumen las fases siguientes.
 
-    print(f"[Resize] Proceso completado. {frame_count} fotogramas redimensionados y guardados en '{output_path}'.")
-    cap.release()
-    writer.release()
-    return True
+    Returns:
+        None si se guardó correctamente, o un mensaje de error.
+    """
+    try:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(analysis_data, f, indent=2, ensure_ascii=False)
+        return None
+    except Exception as e:
+        return f"No se pudo guardar el JSON de análisis en '{json_path}': {e}"
 
 
-def run_pdd_pipeline(video_path: str, user_metadata: dict) -> tuple[bool, dict | str]:
+def select_analysis_mode(video_path: str) -> str:
     """
-    Ejecuta el pipeline completo de generación de PDD v0.3.
-    Incluye redimensionamiento opcional del video.
+    Decide si el análisis se hace en una sola llamada ('single'), por etapas ('staged')
+    o por ventanas ('segmented').
     """
-    print("--- Iniciando Ejecución del Pipeline PDD v0.3 ---")
-    print(f"Video de entrada original: {video_path}")
-    print(f"Metadatos de usuario: {user_metadata}")
+    if SEGMENTED_ANALYSIS_ENABLED:
+        duration_ms = get_video_duration_ms(video_path)
+        if duration_ms >= SEGMENTED_MIN_DURATION_SEC * 1000:
+            print(f"[Pipeline] Video de {duration_ms / 1000:.0f}s: se usará análisis segmentado por ventanas.")
+            return "segmented"
+    return "staged" if STAGED_ANALYSIS_ENABLED else "single"
 
-    video_to_analyze = video_path # Por defecto, usar el original
-    resized_video_path = None # Ruta al video redimensionado si se crea
-    resized_created = False
 
-    # --- PASO NUEVO: Redimensionamiento Opcional ---
-    if RESIZE_VIDEO:
-        # Crear un nombre de archivo temporal para el video redimensionado
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_resized_file:
-            resized_video_path = tmp_resized_file.name
+def lookup_cached_analysis(video_path: str, analysis_mode: str = "single", video_hash: str = None):
+    """
+    Calcula la clave de caché del video y busca un análisis previo. `video_hash`: SHA-256 del
+    original si ya se calculó.
 
-        try:
-            resize_success = resize_video(video_path, resized_video_path, RESIZE_TARGET_WIDTH)
-            if resize_success:
-                video_to_analyze = resized_video_path # Usar el video redimensionado para el análisis
-                resized_created = True
-                print(f"[Pipeline] Usando video redimensionado para análisis: {video_to_analyze}")
-            else:
-                # Si resize_video devolvió False porque no era necesario o falló al crear writer
-                print("[Pipeline] No se usará video redimensionado (ya era pequeño o falló la creación). Usando original.")
-                # Asegurarse de eliminar el archivo temporal vacío si se creó
-                if os.path.exists(resized_video_path):
-                    os.unlink(resized_video_path)
-                resized_video_path = None # Indicar que no hay archivo redimensionado
-        except Exception as e:
-            print(f"[Pipeline] Error inesperado durante el redimensionamiento: {e}\n{traceback.format_exc()}")
-            print("[Pipeline] Continuando con el video original.")
-            if resized_video_path and os.path.exists(resized_video_path):
-                 os.unlink(resized_video_path) # Limpiar si falló
-            resized_video_path = None
-            # No consideramos esto un fallo fatal del pipeline completo, pero sí un log.
-    else:
+    Returns:
+        Una tupla (cache_key, cached_analysis). Ambos None si el caché está deshabilitado o falla.
+    """
+    if not ANALYSIS_CACHE_ENABLED:
+        return None, None
+    try:
+        video_hash = video_hash or compute_file_hash(video_path)
+        cache_key = build_cache_key(
+            video_hash, ANALYSIS_PROMPT_V0_3, MODEL_NAME, GENERATION_CONFIG,
+            extra={
+                "resize_target_width": RESIZE_TARGET_WIDTH if RESIZE_VIDEO else None,
+                "analysis_mode": analysis_mode,
+                "segmented_windows": [SEGMENTED_WINDOW_SEC, SEGMENTED_OVERLAP_SEC] if analysis_mode == "segmented" else None,
+                "text_model_name": TEXT_MODEL_NAME if analysis_mode in ("staged", "segmented") else None,
+                "scene_detection": SCENE_DETECTION_ENABLED,
+                "analysis_proxy": [PROXY_TARGET_FPS, PROXY_FOURCC] if ANALYSIS_PROXY_ENABLED else None,
+            }
+        )
+        cached_analysis = cache_get(cache_key)
+        stats = get_cache_stats()
+        status = "ACIERTO" if cached_analysis is not None else "FALLO"
+        print(f"[Cache] {status} para clave {cache_key[:12]}... (aciertos={stats['hits']}, fallos={stats['misses']}, tasa={stats['hit_rate']:.0%})")
+        return cache_key, cached_analysis
+    except Exception as e:
+        print(f"[Cache] Advertencia: No se pudo consultar el caché de análisis: {e}")
+        return None, None
+
+
+def resolve_output_paths(output_dir: str = None) -> tuple[str, str, str, str]:
+    """
+    Devuelve las rutas (json, screenshots, docx, bpmn) de una ejecución.
+
+    Sin `output_dir` se usan las rutas configuradas; con él, cada ejecución escribe en su
+    propia carpeta (necesario para ejecutar varios pipelines en paralelo).
+    """
+    return _resolve_paths((JSON_OUTPUT_PATH, SCREENSHOT_DIR, OUTPUT_DOCX_PATH, OUTPUT_BPMN_PATH), output_dir)
+
+
+def resolve_extra_output_paths(output_dir: str = None) -> tuple[str, str, str]:
+    """Devuelve las rutas (markdown, html, carpeta de imágenes) de EXTRA_OUTPUT_FORMATS, como `resolve_output_paths`."""
+    return _resolve_paths((OUTPUT_MD_PATH, OUTPUT_HTML_PATH, OUTPUT_MEDIA_DIR), output_dir)
+
+
+def _resolve_paths(paths: tuple, output_dir: str = None) -> tuple:
+    if not output_dir:
+        return paths
+    os.makedirs(output_dir, exist_ok=True)
+    return tuple(os.path.join(output_dir, os.path.basename(path)) for path in paths)
+
+
+def _screenshots_in_memory() -> bool:
+    """Si la Fase 2.2 entrega los screenshots en memoria (no con DOCX_STREAMING_WRITER si ya están en disco)."""
+    return SCREENSHOTS_IN_MEMORY and not (DOCX_STREAMING_WRITER and SCREENSHOTS_WRITE_TO_DISK)
+
+
+def _stage_cache(ctx: dict):
+    """Caché de Análisis: si hay acierto se omiten la detección de escenas, el proxy y la Fase 1.3."""
+    ctx["analysis_mode"] = select_analysis_mode(ctx["video_path"])
+    try:
+        # Una sola lectura del original: la reutilizan el caché de análisis, el de proxies y los screenshots
+        ctx["video_hash"] = compute_file_hash(ctx["video_path"])
+    except OSError as e:
+        print(f"[Pipeline] Advertencia: No se pudo calcular el hash del video: {e}")
+    ctx["cache_key"], ctx["cached_analysis"] = lookup_cached_analysis(ctx["video_path"], ctx["analysis_mode"],
+                                                                      ctx["video_hash"])
+
+def _stage_scenes(ctx: dict):
+    """Detección de Escenas: tramos con cambios de interfaz (el resto no se envía al modelo)."""
+    if ctx["cached_analysis"] is not None or not SCENE_DETECTION_ENABLED:
+        return
+    try:
+        scene_mapping, error_scene = detect_scene_segments(ctx["video_path"])
+        if error_scene:
+            print(f"[Pipeline] Advertencia: Detección de escenas fallida ({error_scene}). Se enviará el video completo.")
+        elif not scene_mapping["condensed"]:
+            print("[Pipeline] El video tiene poca inactividad; no se condensará.")
+        else:
+            ctx["scene_mapping"] = scene_mapping
+    except Exception as e:
+        print(f"[Pipeline] Advertencia: Error inesperado en la detección de escenas: {e}. Se enviará el video completo.")
+
+def _stage_budget(ctx: dict):
+    """Control de Presupuesto: estimar el costo antes de subir el video."""
+    if ctx["cached_analysis"] is not None or not BUDGET_CONTROL_ENABLED:
+        return
+    scene_mapping = ctx["scene_mapping"]
+    staged = ctx["analysis_mode"] in ("staged", "segmented") # Pasos con video + secciones narrativas de solo texto
+    budget_plan = plan_within_budget(ctx["video_path"], len(STEPS_PROMPT_V0_3 if staged else ANALYSIS_PROMPT_V0_3),
+                                     GENERATION_CONFIG.get("max_output_tokens"), ctx["resize_width"],
+                                     has_audio=not ANALYSIS_PROXY_ENABLED, # El proxy no lleva pista de audio
+                                     duration_sec=scene_mapping["proxy_duration_ms"] / 1000 if scene_mapping else None,
+                                     model_name=MODEL_NAME,
+                                     staged={"text_model_name": TEXT_MODEL_NAME, "calls": len(NARRATIVE_SECTION_GROUPS),
+                                             "prompt_chars": narrative_prompt_chars()} if staged else None,
+                                     target_fps=ctx["proxy_fps"])
+    ctx["budget_estimate"] = budget_plan["estimate"]
+    if not budget_plan["allowed"]:
+        record_run_cost(ctx["video_path"], MODEL_NAME, "rejected", ctx["budget_estimate"])
+        raise StageError(f"Ejecución rechazada por presupuesto: {budget_plan['reason']}")
+    if budget_plan["target_fps"] != ctx["proxy_fps"]:
+        ctx["proxy_fps"] = budget_plan["target_fps"] # Se envía un proxy con menos fotogramas por segundo
+        ctx["cache_key"] = None # Un análisis reducido por presupuesto no debe responder consultas a resolución completa
+        print(f"[Pipeline] {budget_plan['reason']}")
+
+def _stage_proxy(ctx: dict):
+    """Redimensionamiento / proxy de análisis (condensado, decimado y sin audio)."""
+    video_path, resize_width, scene_mapping, proxy_fps = ctx["video_path"], ctx["resize_width"], ctx["scene_mapping"], ctx["proxy_fps"]
+    if ctx["cached_analysis"] is not None:
+        print("[Pipeline] Análisis encontrado en caché. Se omite el redimensionamiento.")
+        record_run_cost(video_path, MODEL_NAME, "cache_hit")
+        return
+    if not (proxy_fps or resize_width or scene_mapping):
         print("[Pipeline] Redimensionamiento de video deshabilitado.")
-    # --- FIN PASO NUEVO ---
+        return
 
+    # Crear un nombre de archivo temporal para el video redimensionado
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_resized_file:
+        resized_video_path = tmp_resized_file.name
+    ctx["temp_files"].append(resized_video_path) # Se elimina en la limpieza final
+    try:
+        proxy_mapping = None
+        if proxy_fps or scene_mapping:
+            # Condensar, decimar y redimensionar en una sola pasada
+            segments = [(s["original_start_frame"], s["original_end_frame"])
+                        for s in scene_mapping["segments"]] if scene_mapping else None
+            build_proxy = lambda output_path: build_analysis_proxy(video_path, output_path, resize_width,
+                                                                   target_fps=proxy_fps, segments=segments)
+            if PROXY_CACHE_ENABLED:
+                proxy_params = {"target_width": resize_width, "target_fps": proxy_fps, "fourcc": PROXY_FOURCC,
+                                "segments": segments}
+                cached_proxy_path, proxy_mapping, error_proxy = get_or_build_proxy(video_path, build_proxy, proxy_params,
+                                                                                    source_hash=ctx["video_hash"],
+                                                                                    pins_out=ctx["proxy_pins"])
+                if cached_proxy_path:
+                    resized_video_path = cached_proxy_path # El proxy vive en el caché (fijado hasta terminar la Fase 1.3)
+            else:
+                proxy_mapping, error_proxy = build_proxy(resized_video_path)
+            resize_success = proxy_mapping is not None
+            if not resize_success:
+                print(f"[Pipeline] Advertencia: {error_proxy}")
+                resize_success = bool(resize_width) and resize_video(video_path, resized_video_path, resize_width)
+        else:
+            resize_success = resize_video(video_path, resized_video_path, resize_width)
+        if resize_success:
+            ctx["video_to_analyze"] = resized_video_path # Usar el video redimensionado para el análisis
+            ctx["proxy_mapping"] = proxy_mapping
+            print(f"[Pipeline] Usando video redimensionado para análisis: {resized_video_path}")
+        else:
+            # Si resize_video devolvió False porque no era necesario o falló al crear writer
+            print("[Pipeline] No se usará video redimensionado (ya era pequeño o falló la creación). Usando original.")
+    except Exception as e:
+        # No consideramos esto un fallo fatal del pipeline completo, pero sí un log.
+        print(f"[Pipeline] Error inesperado durante el redimensionamiento: {e}\n{traceback.format_exc()}")
+        print("[Pipeline] Continuando con el video original.")
+
+def _stage_analysis(ctx: dict):
+    """Fase 1.3: Análisis con IA (o JSON cacheado). Con streaming, la Fase 2.2 arranca aquí."""
+    video_path, json_output_path = ctx["video_path"], ctx["json_output_path"]
+    if ctx["cached_analysis"] is not None:
+        print("\n[Pipeline] Fase 1.3 omitida: usando el análisis cacheado.")
+        ctx["analysis_data"] = ctx["cached_analysis"]
+        error_save = save_analysis_json(ctx["analysis_data"], json_output_path)
+        if error_save:
+            raise StageError(error_save)
+        return
+
+    print(f"\n[Pipeline] Ejecutando Fase 1.3: Análisis con API sobre '{os.path.basename(ctx['video_to_analyze'])}'...")
+    if "tu-gcp-project-id" in PROJECT_ID or not PROJECT_ID or not LOCATION or not MODEL_NAME:
+        raise StageError("Configuración API incompleta (PROJECT_ID, LOCATION, MODEL_NAME).")
+
+    # Modo streaming: la Fase 2.2 arranca en paralelo mientras el modelo escribe la respuesta
+    analysis_mode, proxy_mapping = ctx["analysis_mode"], ctx["proxy_mapping"]
+    analyze_kwargs = {"request_runner": ctx["request_runner"]} if ctx["request_runner"] else {}
+    if STREAMING_ANALYSIS_ENABLED and analysis_mode in ("single", "staged"):
+        streaming_extractor = IncrementalScreenshotExtractor(video_path, ctx["screenshot_dir"], # Video ORIGINAL
+                                                             keep_in_memory=_screenshots_in_memory(),
+                                                             write_to_disk=SCREENSHOTS_WRITE_TO_DISK,
+                                                             video_hash=ctx["video_hash"])
+        if streaming_extractor.start():
+            ctx["streaming_extractor"] = streaming_extractor
+            if proxy_mapping:
+                analyze_kwargs["on_step"] = lambda step: streaming_extractor.submit(remap_step_timestamp(step, proxy_mapping))
+            else:
+                analyze_kwargs["on_step"] = streaming_extractor.submit
+        else:
+            print("[Pipeline] Advertencia: No se pudo iniciar la extracción incremental. Se usará la extracción secuencial.")
 
-    # --- Fase 1.3: Análisis con IA ---
-    print(f"\n[Pipeline] Ejecutando Fase 1.3: Análisis con API sobre '{os.path.basename(video_to_analyze)}'...")
+    analyze_fns = {"segmented": analyze_video_segmented, "staged": analyze_video_staged}
+    analyze_fn = analyze_fns.get(analysis_mode, analyze_video_steps)
+    backend_name = get_backend_name() # Backend que crearán las fases de análisis ('stub'/'replay' no cuestan)
+    usage = {}
     try:
-        if "tu-gcp-project-id" in PROJECT_ID or not PROJECT_ID or not LOCATION or not MODEL_NAME:
-             error_msg = "Configuración API incompleta (PROJECT_ID, LOCATION, MODEL_NAME)."
-             print(f"[Pipeline] Error: {error_msg}")
-             # Limpiar video redimensionado si existe antes de salir
-             if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
-             return False, error_msg
-
-        _, error_fase1 = analyze_video_steps(
+        analysis_data, error_fase1 = analyze_fn(
             project_id=PROJECT_ID,
             location=LOCATION,
             model_name=MODEL_NAME,
-            video_path=video_to_analyze # <--- Pasar el video correcto (original o redimensionado)
+            video_path=ctx["video_to_analyze"], # <--- Pasar el video correcto (original o redimensionado)
+            usage_out=usage,
+            **analyze_kwargs
         )
+    finally:
+        _release_proxy_pins(ctx) # El proxy ya no se necesita: el LRU del caché puede expulsarlo
+    record_run_cost(video_path, MODEL_NAME, "failed" if error_fase1 else "completed", ctx["budget_estimate"], usage or None,
+                    extra={"analysis_mode": analysis_mode, "resize_width": ctx["resize_width"], "proxy_fps": ctx["proxy_fps"]},
+                    calibrate=analysis_mode in ("single", "staged"), # Segmentado: varias llamadas por estimado
+                    backend_name=backend_name)
+    if analysis_data and proxy_mapping:
+        remap_analysis_timestamps(analysis_data, proxy_mapping) # Timestamps del proxy -> video original
+    error_save = save_analysis_json(analysis_data, json_output_path) if analysis_data else None
+
+    if error_fase1:
+        raise StageError(f"Fallo en Fase 1.3 (Análisis Video): {error_fase1}")
+    if not analysis_data or error_save:
+        raise StageError(f"Fallo post-Fase 1.3: {error_save or 'El análisis no devolvió datos estructurados.'}")
+    ctx["analysis_data"] = analysis_data
+    print("[Pipeline] Fase 1.3 completada exitosamente.")
+    if ctx["cache_key"]:
+        try:
+            cache_put(ctx["cache_key"], analysis_data)
+            print(f"[Cache] Análisis guardado en caché (clave {ctx['cache_key'][:12]}...).")
+        except Exception as e:
+            print(f"[Cache] Advertencia: No se pudo guardar el análisis en caché: {e}")
 
-        if error_fase1:
-            error_msg = f"Fallo en Fase 1.3 (Análisis Video): {error_fase1}"
-            print(f"[Pipeline] Error: {error_msg}")
-            if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
-            return False, error_msg
-        elif not os.path.exists(JSON_OUTPUT_PATH):
-            error_msg = f"Fallo post-Fase 1.3: Archivo JSON no encontrado en '{JSON_OUTPUT_PATH}'."
-            print(f"[Pipeline] Error: {error_msg}")
-            if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
-            return False, error_msg
-        else:
-            print("[Pipeline] Fase 1.3 completada exitosamente.")
-
-    except Exception as e:
-        error_msg = f"Error inesperado en Fase 1.3: {e}\n{traceback.format_exc()}"
-        print(f"[Pipeline] Error: {error_msg}")
-        if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
-        return False, error_msg
+def _stage_bpmn(ctx: dict):
+    """Guarda el archivo BPMN (independiente de los screenshots y del resto del DOCX)."""
+    ctx["bpmn_error"] = write_bpmn_file(ctx["analysis_data"].get("section_3_2_bpmn_xml_code"), ctx["output_bpmn_path"])
 
-    # --- Fase 2.2 (Adaptada): Extracción de Screenshots ---
-    # IMPORTANTE: Los screenshots SIEMPRE se deben extraer del video ORIGINAL
-    # para mantener la calidad visual en el PDD.
-    print(f"\n[Pipeline] Ejecutando Fase 2.2: Extracción de Screenshots desde video ORIGINAL '{os.path.basename(video_path)}'...")
-    try:
+def _stage_screenshots(ctx: dict):
+    """
+    Fase 2.2 (Adaptada): Extracción de Screenshots.
+    IMPORTANTE: Los screenshots SIEMPRE se deben extraer del video ORIGINAL
+    para mantener la calidad visual en el PDD.
+    """
+    print(f"\n[Pipeline] Ejecutando Fase 2.2: Extracción de Screenshots desde video ORIGINAL '{os.path.basename(ctx['video_path'])}'...")
+    streaming_extractor = ctx["streaming_extractor"]
+    if streaming_extractor is not None:
+        # La mayoría de los pasos ya se extrajeron durante el streaming; completar los restantes
+        print("[Pipeline] Completando la extracción incremental iniciada durante el análisis...")
+        ctx["streaming_extractor"] = None
+        success_fase2 = streaming_extractor.finish(ctx["analysis_data"].get("section_3_3_detailed_steps", []))
+        ctx["step_images"] = streaming_extractor.step_images
+        if streaming_extractor.frame_records:
+            apply_frame_offsets(ctx["analysis_data"].get("section_3_3_detailed_steps", []),
+                                streaming_extractor.frame_records, streaming_extractor.fps)
+            error_save = save_analysis_json(ctx["analysis_data"], ctx["json_output_path"])
+            if error_save:
+                print(f"[Pipeline] Advertencia: {error_save}")
+    else:
+        ctx["step_images"] = {} if _screenshots_in_memory() or not SCREENSHOTS_WRITE_TO_DISK else None
         success_fase2 = extract_screenshots(
-            json_path=JSON_OUTPUT_PATH,
-            video_path=video_path, # <--- Usar video ORIGINAL aquí
-            output_dir=SCREENSHOT_DIR
+            json_path=ctx["json_output_path"],
+            video_path=ctx["video_path"], # <--- Usar video ORIGINAL aquí
+            output_dir=ctx["screenshot_dir"],
+            step_images=ctx["step_images"],
+            write_to_disk=SCREENSHOTS_WRITE_TO_DISK,
+            video_hash=ctx["video_hash"]
         )
-        if not success_fase2:
-            print("[Pipeline] Advertencia: Hubo errores durante la extracción de screenshots (Fase 2.2).")
-        else:
-            print("[Pipeline] Fase 2.2 completada.")
-    except Exception as e:
-        error_msg = f"Error inesperado en Fase 2.2: {e}\n{traceback.format_exc()}"
-        print(f"[Pipeline] Error: {error_msg}")
-        if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
-        return False, error_msg
+    if not success_fase2:
+        print("[Pipeline] Advertencia: Hubo errores durante la extracción de screenshots (Fase 2.2).")
+    else:
+        print("[Pipeline] Fase 2.2 completada.")
 
-    # --- Fase 3.3: Generación DOCX y BPMN ---
+def _stage_model(ctx: dict):
+    """Fase 3.3 (parte 1): modelo del documento, construido una vez y compartido por todos los formatos."""
     print("\n[Pipeline] Ejecutando Fase 3.3: Generación DOCX y BPMN...")
+    user_metadata = ctx["user_metadata"]
+    final_metadata = DEFAULT_USER_METADATA.copy()
+    if "project_name" in user_metadata: final_metadata["project_name"] = user_metadata["project_name"]
+    if "project_acronym" in user_metadata: final_metadata["project_acronym"] = user_metadata["project_acronym"]
+    if "author_name" in user_metadata: final_metadata["author_name"] = user_metadata["author_name"]
+    print(f"[Pipeline] Usando metadata final: {final_metadata}")
+    ctx["pdd_model"] = build_pdd_model(ctx["analysis_data"], final_metadata, ctx["output_bpmn_path"], ctx["bpmn_error"])
+
+def _stage_docx_sections(ctx: dict):
+    """Fase 3.3 (parte 2): todas las secciones del DOCX salvo la tabla de pasos, en paralelo a la Fase 2.2."""
+    ctx["document"], ctx["steps_anchor"] = build_pdd_document(ctx["pdd_model"])
+
+def _stage_pictures(ctx: dict):
+    """Prepara una sola vez las imágenes de los pasos para todos los formatos (y las guarda si hay Markdown/HTML)."""
+    model = ctx["pdd_model"]
+    if DOCX_STREAMING_WRITER:
+        # Sin retener las imágenes: el DOCX las prepara al escribir cada fila y Markdown/HTML las leen del disco
+        if EXTRA_OUTPUT_FORMATS:
+            step_pictures = iter_step_pictures(model["steps"], ctx["screenshot_dir"], ctx["step_images"],
+                                               video_hash=ctx["video_hash"])
+            attach_pictures(model, spill_pictures(step_pictures, ctx["output_media_dir"]))
+            write_model_media(model, ctx["output_media_dir"])
+        return
+    attach_pictures(model, prepare_step_pictures(model["steps"], ctx["screenshot_dir"], ctx["step_images"],
+                                                 video_hash=ctx["video_hash"]))
+    if EXTRA_OUTPUT_FORMATS:
+        write_model_media(model, ctx["output_media_dir"])
+
+def _stage_docx(ctx: dict):
+    """Fase 3.3 (parte 3): inserta la tabla de pasos con los screenshots y guarda el DOCX."""
+    if DOCX_STREAMING_WRITER:
+        if not stream_pdd_docx(ctx["document"], ctx["steps_anchor"], ctx["pdd_model"]["steps"], ctx["screenshot_dir"],
+                               ctx["output_docx_path"], step_images=ctx["step_images"], pictures=ctx["pdd_model"]["pictures"],
+                               video_hash=ctx["video_hash"]):
+            raise StageError("Fallo en Fase 3.3 (Generación DOCX/BPMN).")
+        print("[Pipeline] Fase 3.3 completada exitosamente.")
+        return
+    insert_steps_table(ctx["document"], ctx["steps_anchor"], ctx["pdd_model"]["steps"], ctx["screenshot_dir"],
+                       pictures=ctx["pdd_model"]["pictures"])
+    if not save_pdd_document(ctx["document"], ctx["output_docx_path"]):
+        raise StageError("Fallo en Fase 3.3 (Generación DOCX/BPMN).")
+    print("[Pipeline] Fase 3.3 completada exitosamente.")
+
+def _stage_markdown(ctx: dict):
+    """Renderiza el modelo como Markdown (si 'markdown' está en EXTRA_OUTPUT_FORMATS)."""
+    if "markdown" in EXTRA_OUTPUT_FORMATS and not render_markdown(ctx["pdd_model"], ctx["output_md_path"]):
+        raise StageError(f"No se pudo generar el Markdown '{ctx['output_md_path']}'.")
+
+def _stage_html(ctx: dict):
+    """Renderiza el modelo como HTML (si 'html' está en EXTRA_OUTPUT_FORMATS)."""
+    if "html" in EXTRA_OUTPUT_FORMATS and not render_html(ctx["pdd_model"], ctx["output_html_path"]):
+        raise StageError(f"No se pudo generar el HTML '{ctx['output_html_path']}'.")
+
+PIPELINE_STAGES = [
+    Stage("cache", _stage_cache),
+    Stage("scenes", _stage_scenes, deps=["cache"]),
+    Stage("budget", _stage_budget, deps=["scenes"]),
+    Stage("proxy", _stage_proxy, deps=["budget"]),
+    Stage("analysis", _stage_analysis, deps=["proxy"]),
+    Stage("bpmn", _stage_bpmn, deps=["analysis"]),
+    Stage("screenshots", _stage_screenshots, deps=["analysis"]),
+    Stage("model", _stage_model, deps=["analysis", "bpmn"]),
+    Stage("docx_sections", _stage_docx_sections, deps=["model"]),
+    Stage("pictures", _stage_pictures, deps=["model", "screenshots"]),
+    Stage("docx", _stage_docx, deps=["docx_sections", "pictures"]),
+    Stage("markdown", _stage_markdown, deps=["pictures"]),
+    Stage("html", _stage_html, deps=["pictures"]),
+]
+
+def _release_proxy_pins(ctx: dict):
+    """Libera los pines de los proxies cacheados usados en el análisis."""
+    while ctx["proxy_pins"]:
+        release_proxy_pin(ctx["proxy_pins"].pop())
+
+def _cleanup_pipeline(ctx: dict):
+    """Limpieza centralizada: cierra la extracción incremental pendiente, libera los proxies y elimina los temporales."""
+    _release_proxy_pins(ctx)
+    if ctx["streaming_extractor"] is not None:
+        ctx["streaming_extractor"].finish()
+        ctx["streaming_extractor"] = None
+    for temp_path in ctx["temp_files"]:
+        if os.path.exists(temp_path):
+            try:
+                os.unlink(temp_path)
+                print(f"[Pipeline] Video redimensionado temporal eliminado: {temp_path}")
+            except Exception as e:
+                print(f"[Pipeline] Advertencia: Error al eliminar video redimensionado {temp_path}: {e}")
+
+def run_pdd_pipeline(video_path: str, user_metadata: dict, output_dir: str = None,
+                     request_runner=None) -> tuple[bool, dict | str]:
+    """
+    Ejecuta el pipeline completo de generación de PDD v0.3.
+    Incluye redimensionamiento opcional del video.
+
+    Las fases se declaran como un grafo de etapas (`PIPELINE_STAGES`, ver stage_scheduler.py):
+    el BPMN, las secciones del DOCX y los screenshots se generan en paralelo tras el análisis, y los
+    formatos de salida (DOCX y EXTRA_OUTPUT_FORMATS) se renderizan en paralelo desde el mismo modelo.
+
+    Args:
+        video_path: Ruta al video original.
+        user_metadata: Metadatos del proyecto ingresados por el usuario.
+        output_dir: (Opcional) Carpeta propia para los archivos de salida de esta ejecución.
+        request_runner: (Opcional) Ejecutor de las llamadas al modelo (ver `run_pdd_pipeline_async`).
+    """
+    print("--- Iniciando Ejecución del Pipeline PDD v0.3 ---")
+    print(f"Video de entrada original: {video_path}")
+    print(f"Metadatos de usuario: {user_metadata}")
+    json_output_path, screenshot_dir, output_docx_path, output_bpmn_path = resolve_output_paths(output_dir)
+    output_md_path, output_html_path, output_media_dir = resolve_extra_output_paths(output_dir)
+    ctx = {
+        "video_path": video_path,
+        "user_metadata": user_metadata,
+        "request_runner": request_runner,
+        "json_output_path": json_output_path,
+        "screenshot_dir": screenshot_dir,
+        "output_docx_path": output_docx_path,
+        "output_bpmn_path": output_bpmn_path,
+        "output_md_path": output_md_path,
+        "output_html_path": output_html_path,
+        "output_media_dir": output_media_dir,
+        "video_to_analyze": video_path, # Por defecto, usar el original
+        "video_hash": None, # SHA-256 del original (se calcula una vez en la etapa de caché)
+        "resize_width": RESIZE_TARGET_WIDTH if RESIZE_VIDEO else None,
+        "scene_mapping": None,
+        "proxy_fps": PROXY_TARGET_FPS if ANALYSIS_PROXY_ENABLED else None, # El control de presupuesto puede reducirlos
+        "proxy_mapping": None, # Correspondencia proxy -> original (None: se analiza el original, sin traducir timestamps)
+        "proxy_pins": [], # Pines del proxy cacheado (proxy_cache.py): evitan su expulsión durante la Fase 1.3
+        "budget_estimate": None,
+        "streaming_extractor": None, # Extractor incremental de screenshots (modo streaming)
+        "bpmn_error": None,
+        "pdd_model": None, # Modelo del documento (pdd_model.py) para todos los formatos de salida
+        "step_images": None, # Screenshots codificados en memoria para la Fase 3.3 (SCREENSHOTS_IN_MEMORY)
+        "temp_files": [],
+    }
     try:
-        final_metadata = DEFAULT_USER_METADATA.copy()
-        if "project_name" in user_metadata: final_metadata["project_name"] = user_metadata["project_name"]
-        if "project_acronym" in user_metadata: final_metadata["project_acronym"] = user_metadata["project_acronym"]
-        if "author_name" in user_metadata: final_metadata["author_name"] = user_metadata["author_name"]
-        print(f"[Pipeline] Usando metadata final: {final_metadata}")
-
-        success_fase3 = generate_pdd_docx_v0_3(
-            json_path=JSON_OUTPUT_PATH,
-            screenshot_dir=SCREENSHOT_DIR,
-            output_docx_path=OUTPUT_DOCX_PATH,
-            output_bpmn_path=OUTPUT_BPMN_PATH,
-            user_metadata=final_metadata
-        )
-        if not success_fase3:
-            error_msg = "Fallo en Fase 3.3 (Generación DOCX/BPMN)."
-            print(f"[Pipeline] Error: {error_msg}")
-            if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
-            return False, error_msg
-        else:
-            print("[Pipeline] Fase 3.3 completada exitosamente.")
+        report = run_stages(PIPELINE_STAGES, ctx)
+    finally:
+        _cleanup_pipeline(ctx)
+    print_stage_report(report)
 
-    except Exception as e:
-        error_msg = f"Error inesperado en Fase 3.3: {e}\n{traceback.format_exc()}"
+    error_msg = first_stage_error(report)
+    if error_msg:
         print(f"[Pipeline] Error: {error_msg}")
-        if resized_created and resized_video_path and os.path.exists(resized_video_path): os.unlink(resized_video_path)
         return False, error_msg
 
-    # --- Limpieza Final y Éxito ---
-    # Eliminar video redimensionado si se creó
-    if resized_created and resized_video_path and os.path.exists(resized_video_path):
-        try:
-            os.unlink(resized_video_path)
-            print(f"[Pipeline] Video redimensionado temporal eliminado: {resized_video_path}")
-        except Exception as e:
-            print(f"[Pipeline] Advertencia: Error al eliminar video redimensionado {resized_video_path}: {e}")
-
     print("\n--- Ejecución del Pipeline PDD v0.3 Finalizada Exitosamente ---")
     result_payload = {
-        'docx_path': OUTPUT_DOCX_PATH,
-        'bpmn_path': OUTPUT_BPMN_PATH,
-        'json_path': JSON_OUTPUT_PATH
+        'docx_path': output_docx_path,
+        'bpmn_path': output_bpmn_path,
+        'json_path': json_output_path
     }
+    if "markdown" in EXTRA_OUTPUT_FORMATS: result_payload['md_path'] = output_md_path
+    if "html" in EXTRA_OUTPUT_FORMATS: result_payload['html_path'] = output_html_path
     return True, result_payload
 
+
+
+async def run_pdd_pipeline_async(video_path: str, user_metadata: dict, output_dir: str = None,
+                                 client: AsyncModelClient = None) -> tuple[bool, dict | str]:
+    """
+    Punto de entrada asíncrono del pipeline, para ejecutar varios trabajos en paralelo.
+
+    Las fases locales (video, screenshots, DOCX) se ejecutan en un hilo; las llamadas al
+    modelo pasan por el cliente compartido (`async_client.py`): concurrencia global, límite
+    de tasa, reintentos con backoff y plazo por solicitud. Usar un `output_dir` distinto por
+    trabajo concurrente.
+
+    Returns:
+        La misma tupla (éxito, resultado | mensaje de error) que `run_pdd_pipeline`.
+    """
+    client = client or get_shared_client()
+    runner = client.threadsafe_runner(asyncio.get_running_loop())
+    return await asyncio.to_thread(run_pdd_pipeline, video_path, user_metadata, output_dir, runner)
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import socket
+import uuid
+import hashlib
+import tempfile
+import threading
+
+from analysis_cache import compute_file_hash
+
+# --- Configuración del Caché de Proxies ---
+PROXY_CACHE_DIR = '.proxy_cache'                   # Carpeta del caché persistente de proxies de análisis
+PROXY_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024     # Cuota de disco antes de expulsar (LRU)
+PROXY_LOCK_TIMEOUT_SEC = 1800                      # Espera máxima a que otro trabajo termine de generar la misma entrada
+PROXY_LOCK_REFRESH_SEC = 30                        # El dueño del lock lo renueva (mtime) con esta frecuencia mientras genera
+PROXY_LOCK_STALE_SEC = 120                         # Un lock sin renovar durante este tiempo se considera abandonado
+                                                   # (debe ser > REFRESH y < TIMEOUT para que la espera pueda recuperarlo)
+PROXY_LOCK_POLL_SEC = 0.5                          # Intervalo de consulta mientras otro trabajo genera la entrada
+PROXY_PIN_STALE_SEC = 24 * 3600                    # Un pin más antiguo se considera abandonado aunque no se pueda comprobar su proceso
+# --- Fin Configuración ---
+
+PROXY_VIDEO_SUFFIX = '.mp4'
+PROXY_MAPPING_SUFFIX = '.json'
+PROXY_LOCK_SUFFIX = '.lock'
+PROXY_PIN_SUFFIX = '.pin'
+
+
+def build_proxy_key(source_hash: str, params: dict) -> str:
+    """
+    Construye la clave de un proxy a partir del hash del video original y de los parámetros
+    que determinan su contenido (ancho, fps, codec, tramos conservados).
+    """
+    serialized = json.dumps({"source_sha256": source_hash, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+def _entry_paths(cache_dir: str, key: str):
+    base = os.path.join(cache_dir, key)
+    return base + PROXY_VIDEO_SUFFIX, base + PROXY_MAPPING_SUFFIX, base + PROXY_LOCK_SUFFIX
+
+def _read_entry(cache_dir: str, key: str):
+    """
+    Devuelve (ruta_video, mapping) si la entrada está completa, o (None, None).
+
+    El mapping se escribe después del video, así que su presencia marca la entrada como completa.
+    Un acierto actualiza la fecha de modificación (orden LRU).
+    """
+    video_path, mapping_path, _ = _entry_paths(cache_dir, key)
+    try:
+        with open(mapping_path, 'r', encoding='utf-8') as f:
+            mapping = json.load(f)
+        if not os.path.exists(video_path):
+            return None, None
+        os.utime(video_path, None)
+        os.utime(mapping_path, None)
+        return video_path, mapping
+    except FileNotFoundError:
+        return None, None
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[ProxyCache] Advertencia: Entrada inválida '{mapping_path}' ({e}). Se regenerará.")
+        return None, None
+
+def _read_lock(lock_path: str):
+    """Devuelve el contenido del lock ({pid, host, token}) o None si no existe o es ilegible."""
+    try:
+        with open(lock_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, OSError, ValueError):
+        return {}
+
+def _lock_owner_alive(owner: dict) -> bool:
+    """
+    Indica si el proceso dueño del lock sigue vivo. Solo se puede comprobar en el mismo host;
+    para otros hosts se asume vivo y decide la antigüedad del lock.
+    """
+    if owner.get("host") != socket.gethostname() or not isinstance(owner.get("pid"), int):
+        return True
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True # Existe pero pertenece a otro usuario
+    return True
+
+def _lock_is_stale(lock_path: str, owner: dict) -> bool:
+    """Un lock está abandonado si su proceso murió (mismo host) o si no se renovó en PROXY_LOCK_STALE_SEC."""
+    if owner and not _lock_owner_alive(owner):
+        return True
+    return time.time() - os.path.getmtime(lock_path) > PROXY_LOCK_STALE_SEC
+
+def _try_lock(lock_path: str):
+    """
+    Crea el lock de forma exclusiva (válido entre hilos y procesos) con pid, host y un token único.
+    Retira locks abandonados.
+
+    Returns:
+        El token del lock si se adquirió, o None.
+    """
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            owner = _read_lock(lock_path)
+            if owner is not None and _lock_is_stale(lock_path, owner):
+                # Releer justo antes de retirar: otro trabajo pudo haberlo reemplazado por uno nuevo
+                if _read_lock(lock_path) == owner:
+                    print(f"[ProxyCache] Advertencia: Lock abandonado '{lock_path}' ({owner or 'ilegible'}). Se retira.")
+                    os.unlink(lock_path)
+        except FileNotFoundError:
+            pass
+        return None
+    token = uuid.uuid4().hex
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"pid": os.getpid(), "host": socket.gethostname(), "token": token}, f)
+    return token
+
+def _start_lock_heartbeat(lock_path: str) -> threading.Event:
+    """
+    Renueva el mtime del lock cada PROXY_LOCK_REFRESH_SEC mientras se genera la entrada, para que
+    una transcodificación larga no se confunda con un proceso caído. Devuelve el evento que la detiene.
+    """
+    stop = threading.Event()
+
+    def refresh():
+        while not stop.wait(PROXY_LOCK_REFRESH_SEC):
+            try:
+                os.utime(lock_path, None)
+            except FileNotFoundError:
+                return
+
+    threading.Thread(target=refresh, name="proxy-lock-heartbeat", daemon=True).start()
+    return stop
+
+def _release_lock(lock_path: str, token: str):
+    """Elimina el lock solo si sigue siendo el nuestro (pudo retirarse por abandonado y reasignarse)."""
+    owner = _read_lock(lock_path)
+    if not owner or owner.get("token") != token:
+        return
+    try:
+        os.unlink(lock_path)
+    except FileNotFoundError:
+        pass
+
+def _create_pin(cache_dir: str, key: str) -> str:
+    """
+    Fija la entrada `key` para que evict_lru no la elimine mientras se usa. Debe llamarse con el
+    lock de la entrada adquirido (evict_lru también lo toma antes de comprobar los pines).
+    """
+    pin_path = os.path.join(cache_dir, f"{key}.{uuid.uuid4().hex}{PROXY_PIN_SUFFIX}")
+    with open(pin_path, 'w', encoding='utf-8') as f:
+        json.dump({"pid": os.getpid(), "host": socket.gethostname()}, f)
+    return pin_path
+
+def release_proxy_pin(pin_path: str):
+    """Libera un pin devuelto por `get_or_build_proxy(..., pins_out=...)`. Es idempotente."""
+    try:
+        os.unlink(pin_path)
+    except FileNotFoundError:
+        pass
+
+def _entry_pinned(cache_dir: str, key: str) -> bool:
+    """Indica si algún trabajo vivo tiene fijada la entrada. Retira los pines abandonados."""
+    pinned = False
+    for filename in os.listdir(cache_dir):
+        if not (filename.startswith(key + '.') and filename.endswith(PROXY_PIN_SUFFIX)):
+            continue
+        pin_path = os.path.join(cache_dir, filename)
+        owner = _read_lock(pin_path)
+        try:
+            if owner is None:
+                continue
+            if (owner and not _lock_owner_alive(owner)) or time.time() - os.path.getmtime(pin_path) > PROXY_PIN_STALE_SEC:
+                print(f"[ProxyCache] Advertencia: Pin abandonado '{pin_path}'. Se retira.")
+                release_proxy_pin(pin_path)
+                continue
+        except FileNotFoundError:
+            continue
+        pinned = True
+    return pinned
+
+def _build_entry(cache_dir: str, key: str, builder):
+    """
+    Genera la entrada con `builder(ruta_salida)` -> (mapping, error) sobre archivos temporales
+    del mismo directorio y la publica con os.replace (video primero, mapping después).
+    """
+    video_path, mapping_path, _ = _entry_paths(cache_dir, key)
+    fd, tmp_video = tempfile.mkstemp(dir=cache_dir, suffix='.tmp' + PROXY_VIDEO_SUFFIX)
+    os.close(fd)
+    tmp_mapping = None
+    try:
+        mapping, error = builder(tmp_video)
+        if error or mapping is None:
+            return None, None, error or "El generador del proxy no devolvió datos."
+        os.replace(tmp_video, video_path)
+        fd, tmp_mapping = tempfile.mkstemp(dir=cache_dir, suffix='.tmp' + PROXY_MAPPING_SUFFIX)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(mapping, f)
+        os.replace(tmp_mapping, mapping_path)
+        return video_path, mapping, None
+    finally:
+        for path in (tmp_video, tmp_mapping):
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+def get_or_build_proxy(source_path: str, builder, params: dict, cache_dir: str = PROXY_CACHE_DIR,
+                       max_bytes: int = PROXY_CACHE_MAX_BYTES, source_hash: str = None, pins_out: list = None):
+    """
+    Devuelve el proxy de análisis cacheado de `source_path` o lo genera con `builder`.
+
+    Si otro trabajo (hilo o proceso) está generando la misma entrada, espera a que termine y la
+    reutiliza en lugar de transcodificar de nuevo. El lock guarda pid y host y se renueva mientras
+    se genera, así que un proceso caído se detecta en segundos (mismo host) o tras PROXY_LOCK_STALE_SEC.
+
+    Args:
+        source_path: Video original.
+        builder: `builder(ruta_salida)` -> (mapping, error), ej: `video_proxy.build_analysis_proxy`.
+        params: Parámetros del proxy que forman parte de la clave (ancho, fps, codec, tramos).
+        source_hash: (Opcional) Hash del original si ya se calculó.
+        pins_out: (Opcional) Lista donde se añade un pin de la entrada devuelta: evict_lru no la
+            elimina hasta liberarlo con `release_proxy_pin`.
+
+    Returns:
+        Una tupla (ruta_video, mapping, error). La ruta pertenece al caché: no se debe eliminar.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = build_proxy_key(source_hash or compute_file_hash(source_path), params)
+    _, mapping_path, lock_path = _entry_paths(cache_dir, key)
+    deadline = time.monotonic() + PROXY_LOCK_TIMEOUT_SEC
+    waiting = False
+    while True:
+        # También los aciertos toman el lock (brevemente): así el pin no compite con evict_lru
+        lock_token = _try_lock(lock_path)
+        if lock_token:
+            break
+        if time.monotonic() > deadline:
+            return None, None, f"Tiempo de espera agotado: otro trabajo sigue generando el proxy {key[:12]}."
+        if not waiting and not os.path.exists(mapping_path):
+            print(f"[ProxyCache] Otro trabajo está generando el proxy {key[:12]}... Esperando.")
+            waiting = True
+        time.sleep(PROXY_LOCK_POLL_SEC)
+
+    built = False
+    heartbeat = _start_lock_heartbeat(lock_path)
+    try:
+        video_path, mapping = _read_entry(cache_dir, key)
+        if mapping is not None:
+            print(f"[ProxyCache] ACIERTO para clave {key[:12]}...")
+        else:
+            print(f"[ProxyCache] FALLO para clave {key[:12]}... Generando proxy.")
+            video_path, mapping, error = _build_entry(cache_dir, key, builder)
+            if error:
+                return None, None, error
+            built = True
+        if pins_out is not None:
+            pins_out.append(_create_pin(cache_dir, key))
+    finally:
+        heartbeat.set()
+        _release_lock(lock_path, lock_token)
+    if built:
+        evict_lru(cache_dir, max_bytes, keep_key=key)
+    return video_path, mapping, None
+
+def _list_entries(cache_dir: str) -> list:
+    """Devuelve [(clave, tamaño, mtime)] de las entradas completas del caché."""
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith(PROXY_MAPPING_SUFFIX) or '.tmp' in filename:
+            continue
+        key = filename[:-len(PROXY_MAPPING_SUFFIX)]
+        video_path, mapping_path, _ = _entry_paths(cache_dir, key)
+        try:
+            size = os.path.getsize(video_path) + os.path.getsize(mapping_path)
+            mtime = os.path.getmtime(mapping_path)
+        except FileNotFoundError:
+            continue # Eliminada o incompleta
+        entries.append((key, size, mtime))
+    return entries
+
+def evict_lru(cache_dir: str = PROXY_CACHE_DIR, max_bytes: int = PROXY_CACHE_MAX_BYTES, keep_key: str = None) -> int:
+    """
+    Elimina los proxies menos recientemente usados hasta que el caché quepa en `max_bytes`.
+    No se tocan las entradas con lock (otro trabajo las regenera o las está fijando) ni las
+    fijadas por un trabajo vivo (ver `pins_out` en get_or_build_proxy).
+
+    Returns:
+        Número de entradas eliminadas.
+    """
+    entries = _list_entries(cache_dir)
+    total_bytes = sum(size for _, size, _ in entries)
+    evicted = 0
+    for key, size, _ in sorted(entries, key=lambda e: e[2]):
+        if total_bytes <= max_bytes:
+            break
+        if key == keep_key:
+            continue
+        video_path, mapping_path, lock_path = _entry_paths(cache_dir, key)
+        lock_token = _try_lock(lock_path)
+        if not lock_token:
+            continue
+        try:
+            if _entry_pinned(cache_dir, key):
+                continue
+            for path in (mapping_path, video_path): # Primero el mapping: la entrada deja de ser válida
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        finally:
+            _release_lock(lock_path, lock_token)
+        total_bytes -= size
+        evicted += 1
+    if evicted:
+        print(f"[ProxyCache] {evicted} proxies expulsados (LRU). Tamaño actual: {total_bytes / (1024 * 1024):.1f} MiB.")
+    return evicted
+
+def get_proxy_cache_stats(cache_dir: str = PROXY_CACHE_DIR) -> dict:
+    """Devuelve el número de proxies cacheados y los bytes que ocupan."""
+    if not os.path.isdir(cache_dir):
+        return {"entries": 0, "bytes": 0}
+    entries = _list_entries(cache_dir)
+    return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+
+# --- Bloque de Ejecución Principal ---
+if __name__ == "__main__":
+    print(json.dumps(get_proxy_cache_stats(), indent=2))
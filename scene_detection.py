@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import bisect
+import cv2
+import numpy as np
+
+from video_proxy import transcode_video, print_transcode_stats
+
+# --- Configuración de Detección de Escenas ---
+SCENE_SAMPLE_FPS = 4.0           # Fotogramas por segundo evaluados para detectar cambios
+SCENE_ANALYSIS_WIDTH = 160       # Ancho al que se reducen los fotogramas antes de compararlos
+SCENE_PIXEL_DELTA = 25           # Diferencia mínima de gris (0-255) para contar un píxel como cambiado
+SCENE_CHANGE_THRESHOLD = 0.005   # Fracción mínima de píxeles cambiados para marcar actividad
+SCENE_PADDING_MS = 1500          # Contexto conservado antes y después de cada cambio
+SCENE_MIN_GAP_MS = 3000          # Tramos inactivos más cortos que esto no se recortan
+SCENE_MAX_KEPT_RATIO = 0.85      # Si se conserva más de esta fracción, no vale la pena condensar
+SCENE_BATCH_FRAMES = 64          # Fotogramas reducidos comparados por lote (memoria acotada)
+# --- Fin Configuración ---
+
+
+def _frame_differences(batch: list, previous) -> np.ndarray:
+    """
+    Calcula, vectorizado sobre el lote, la fracción de píxeles cambiados respecto al fotograma anterior.
+    El primer fotograma del video (sin anterior) cuenta como cambio total.
+    """
+    stack = np.stack(([previous] if previous is not None else []) + batch).astype(np.int16)
+    changed = np.abs(np.diff(stack, axis=0)) > SCENE_PIXEL_DELTA
+    ratios = changed.mean(axis=(1, 2))
+    if previous is None:
+        ratios = np.concatenate(([1.0], ratios))
+    return ratios
+
+def compute_change_profile(video_path: str, sample_fps: float = SCENE_SAMPLE_FPS,
+                           analysis_width: int = SCENE_ANALYSIS_WIDTH):
+    """
+    Recorre el video una vez y mide cuánto cambia la imagen entre fotogramas muestreados.
+
+    Los fotogramas no muestreados solo se avanzan con grab() (sin decodificar la imagen).
+
+    Returns:
+        Una tupla (perfil, error). El perfil es un diccionario con fps, total_frames,
+        frame_indices (np.ndarray) y change_ratios (np.ndarray).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None, f"No se pudo abrir el video '{video_path}'."
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if not fps or fps <= 0 or width <= 0 or height <= 0:
+        cap.release()
+        return None, f"Propiedades inválidas en '{video_path}' (fps={fps}, {width}x{height})."
+
+    stride = max(1, int(round(fps / sample_fps)))
+    small_size = (analysis_width, max(1, int(analysis_width * height / width)))
+    frame_indices = []
+    ratios = []
+    batch = []
+    previous = None
+    index = 0
+    while True:
+        if index % stride == 0:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            batch.append(cv2.resize(gray, small_size, interpolation=cv2.INTER_AREA))
+            frame_indices.append(index)
+            if len(batch) >= SCENE_BATCH_FRAMES:
+                ratios.append(_frame_differences(batch, previous))
+                previous = batch[-1]
+                batch = []
+        elif not cap.grab():
+            break
+        index += 1
+    if batch:
+        ratios.append(_frame_differences(batch, previous))
+    cap.release()
+
+    if not frame_indices:
+        return None, f"No se pudo leer ningún fotograma de '{video_path}'."
+    profile = {
+        "fps": fps,
+        "total_frames": index,
+        "frame_indices": np.asarray(frame_indices),
+        "change_ratios": np.concatenate(ratios),
+    }
+    return profile, None
+
+def detect_active_segments(profile: dict, threshold: float = SCENE_CHANGE_THRESHOLD,
+                           padding_ms: int = SCENE_PADDING_MS, min_gap_ms: int = SCENE_MIN_GAP_MS) -> list:
+    """
+    Convierte el perfil de cambios en tramos activos [inicio, fin) en fotogramas del video original.
+
+    Cada cambio conserva `padding_ms` de contexto a cada lado y los tramos separados por
+    menos de `min_gap_ms` de inactividad se unen.
+
+    Returns:
+        Lista ordenada de tuplas (start_frame, end_frame).
+    """
+    fps = profile["fps"]
+    total_frames = profile["total_frames"]
+    active_frames = profile["frame_indices"][profile["change_ratios"] >= threshold]
+    if active_frames.size == 0:
+        return [(0, min(total_frames, int(round(2 * padding_ms / 1000.0 * fps)) or 1))]
+
+    pad = int(round(padding_ms / 1000.0 * fps))
+    gap = int(round(min_gap_ms / 1000.0 * fps))
+    starts = np.clip(active_frames - pad, 0, total_frames)
+    ends = np.clip(active_frames + pad + 1, 0, total_frames)
+    # Los fines son crecientes (relleno constante), así que un tramo nuevo empieza donde el hueco supera `gap`
+    new_segment = np.empty(active_frames.size, dtype=bool)
+    new_segment[0] = True
+    new_segment[1:] = starts[1:] > ends[:-1] + gap
+    segment_ends = ends[np.append(new_segment[1:], True)]
+    return [(int(s), int(e)) for s, e in zip(starts[new_segment], segment_ends)]
+
+def build_segment_mapping(segments: list, fps: float, total_frames: int) -> dict:
+    """
+    Construye la correspondencia entre el tiempo del video condensado y el del original.
+
+    Returns:
+        Diccionario con fps, segments (lista de {original_start_frame, original_end_frame,
+        proxy_start_ms, original_start_ms, duration_ms}), original_duration_ms,
+        proxy_duration_ms y condensed (bool: si condensar ahorra lo suficiente).
+    """
+    mapped = []
+    proxy_frame = 0
+    for start_frame, end_frame in segments:
+        mapped.append({
+            "original_start_frame": start_frame,
+            "original_end_frame": end_frame,
+            "proxy_start_ms": int(proxy_frame / fps * 1000),
+            "original_start_ms": int(start_frame / fps * 1000),
+            "duration_ms": int((end_frame - start_frame) / fps * 1000),
+        })
+        proxy_frame += end_frame - start_frame
+    kept_ratio = proxy_frame / total_frames if total_frames else 1.0
+    return {
+        "fps": fps,
+        "segments": mapped,
+        "original_duration_ms": int(total_frames / fps * 1000),
+        "proxy_duration_ms": int(proxy_frame / fps * 1000),
+        "condensed": kept_ratio <= SCENE_MAX_KEPT_RATIO,
+    }
+
+def detect_scene_segments(video_path: str):
+    """
+    Detecta los tramos con cambios de interfaz del video y calcula la correspondencia de tiempos.
+
+    Returns:
+        Una tupla (mapping, error). Ver `build_segment_mapping`.
+    """
+    profile, error = compute_change_profile(video_path)
+    if error:
+        return None, error
+    segments = detect_active_segments(profile)
+    mapping = build_segment_mapping(segments, profile["fps"], profile["total_frames"])
+    original_sec = mapping["original_duration_ms"] / 1000
+    proxy_sec = mapping["proxy_duration_ms"] / 1000
+    print(f"[Escenas] {len(segments)} tramos activos: {original_sec:.0f}s -> {proxy_sec:.0f}s "
+          f"({proxy_sec / original_sec:.0%} del original)." if original_sec else "[Escenas] Video vacío.")
+    return mapping, None
+
+def write_condensed_video(input_path: str, output_path: str, mapping: dict, target_width: int = None) -> bool:
+    """
+    Escribe el video condensado con solo los tramos activos, opcionalmente redimensionado.
+
+    Lee el original en una sola pasada: los fotogramas fuera de los tramos se saltan con grab().
+
+    Returns:
+        True si se escribió al menos un fotograma.
+    """
+    segments = [(s["original_start_frame"], s["original_end_frame"]) for s in mapping["segments"]]
+    if not segments:
+        return False
+    cursor = {"segment": 0}
+
+    def in_active_segment(index: int) -> bool:
+        # Los índices llegan en orden creciente: basta con avanzar el tramo actual
+        while cursor["segment"] < len(segments) and index >= segments[cursor["segment"]][1]:
+            cursor["segment"] += 1
+        return cursor["segment"] < len(segments) and index >= segments[cursor["segment"]][0]
+
+    stats = transcode_video(input_path, output_path, target_width, frame_selector=in_active_segment,
+                            stop_after=segments[-1][1])
+    if stats is None:
+        print(f"[Escenas] Error: No se pudo escribir el video condensado '{output_path}'.")
+        return False
+    print_transcode_stats(stats, "Escenas")
+    return stats["frames_out"] > 0
+
+def proxy_to_original_ms(proxy_ms: int, mapping: dict) -> int:
+    """Traduce un timestamp del video condensado al tiempo del video original."""
+    segments = mapping["segments"]
+    if not segments:
+        return proxy_ms
+    starts = [s["proxy_start_ms"] for s in segments]
+    segment = segments[max(0, bisect.bisect_right(starts, proxy_ms) - 1)]
+    offset = min(max(0, proxy_ms - segment["proxy_start_ms"]), segment["duration_ms"])
+    return segment["original_start_ms"] + offset
+
+
+# --- Bloque de Ejecución Principal ---
+if __name__ == "__main__":
+    import sys
+    import json
+    if len(sys.argv) < 2:
+        print("Uso: python scene_detection.py <video> [video_condensado_salida.mp4]")
+        sys.exit(1)
+    scene_mapping, scene_error = detect_scene_segments(sys.argv[1])
+    if scene_error:
+        print(f"Error: {scene_error}")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        write_condensed_video(sys.argv[1], sys.argv[2], scene_mapping)
+    print(json.dumps(scene_mapping, indent=2))
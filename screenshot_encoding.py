@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# --- Configuración de Codificación de Screenshots ---
+# Perfiles: formato ('png', 'jpeg' o 'webp'), calidad (jpeg/webp, 0-100), compresión (png, 0-9; None usa
+# la de OpenCV, rápida) y dimensión máxima opcional (el lado mayor se reduce conservando la proporción).
+# Nota: python-docx no puede incrustar WebP; ese perfil sirve solo para la salida en disco.
+SCREENSHOT_PROFILES = {
+    "png":       {"format": "png", "png_compression": None, "max_dimension": None},
+    "png-small": {"format": "png", "png_compression": 6, "max_dimension": None},
+    "jpeg":      {"format": "jpeg", "quality": 90, "max_dimension": None},
+    "jpeg-1600": {"format": "jpeg", "quality": 85, "max_dimension": 1600},
+    "webp":      {"format": "webp", "quality": 80, "max_dimension": None},
+}
+SCREENSHOT_PROFILE = 'png'                      # Perfil por defecto (PNG sin pérdida, igual que antes)
+ENCODE_WORKERS = min(4, os.cpu_count() or 1)    # Hilos que codifican y escriben en paralelo a la decodificación
+ENCODE_MAX_PENDING_PER_WORKER = 2               # Fotogramas en espera por hilo (acota la memoria retenida)
+# --- Fin Configuración ---
+
+FORMAT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+
+def get_profile(profile_name: str = None) -> dict:
+    """Devuelve el perfil de codificación `profile_name` (por defecto SCREENSHOT_PROFILE)."""
+    profile_name = profile_name or SCREENSHOT_PROFILE
+    if profile_name not in SCREENSHOT_PROFILES:
+        raise ValueError(f"Perfil de codificación desconocido '{profile_name}'. "
+                         f"Disponibles: {', '.join(SCREENSHOT_PROFILES)}.")
+    profile = SCREENSHOT_PROFILES[profile_name]
+    if profile["format"] not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Formato no soportado en el perfil '{profile_name}': {profile['format']}.")
+    return profile
+
+def profile_extension(profile: dict) -> str:
+    return FORMAT_EXTENSIONS[profile["format"]]
+
+def _encode_params(profile: dict) -> list:
+    if profile["format"] == "png":
+        compression = profile.get("png_compression")
+        return [] if compression is None else [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    if profile["format"] == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, profile.get("quality", 90)]
+    return [cv2.IMWRITE_WEBP_QUALITY, profile.get("quality", 80)]
+
+def encode_frame(frame, profile: dict):
+    """
+    Codifica un fotograma (BGR) según el perfil, reduciéndolo antes si supera `max_dimension`.
+
+    Returns:
+        Una tupla (bytes codificados, (ancho, alto) de la imagen codificada).
+
+    Raises:
+        ValueError: Si OpenCV no pudo codificar la imagen.
+    """
+    height, width = frame.shape[:2]
+    max_dimension = profile.get("max_dimension")
+    if max_dimension and max(width, height) > max_dimension:
+        scale = max_dimension / float(max(width, height))
+        width, height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(profile_extension(profile), frame, _encode_params(profile))
+    if not ok:
+        raise ValueError(f"OpenCV no pudo codificar la imagen como {profile['format']}.")
+    return buffer.tobytes(), (width, height)
+
+
+class ScreenshotEncoder:
+    """
+    Codifica y escribe screenshots en un pool de hilos, fuera del bucle de decodificación.
+
+    `submit()` devuelve enseguida (salvo que ya haya ENCODE_MAX_PENDING_PER_WORKER fotogramas por
+    hilo en espera, para acotar la memoria) y `drain()` espera los pendientes y devuelve el
+    resultado de cada uno. Las estadísticas (`stats`) acumulan bytes escritos y tiempo de
+    codificación para el reporte por perfil.
+
+    Con `keep_in_memory=True` las imágenes codificadas quedan además en `images`
+    ({ruta: {data, width, height, format}}) para entregarlas al DOCX sin releerlas del disco;
+    con `write_to_disk=False` no se escribe ningún archivo.
+    """
+
+    def __init__(self, profile_name: str = None, workers: int = None, keep_in_memory: bool = False,
+                 write_to_disk: bool = True):
+        self.profile_name = profile_name or SCREENSHOT_PROFILE
+        self.profile = get_profile(self.profile_name)
+        self.extension = profile_extension(self.profile)
+        self.keep_in_memory = keep_in_memory or not write_to_disk
+        self.write_to_disk = write_to_disk
+        self.images = {}
+        workers = workers or ENCODE_WORKERS
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="screenshot-encoder")
+        self._slots = threading.BoundedSemaphore(workers * ENCODE_MAX_PENDING_PER_WORKER)
+        self._pending = []
+        self._stats_lock = threading.Lock()
+        self.stats = {"count": 0, "bytes": 0, "encode_sec": 0.0}
+
+    def submit(self, frame, path: str, key=None):
+        """Encola la codificación de `frame` y su escritura en `path`. `key` identifica el resultado en `drain()`."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._encode_and_write, frame, path)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append((key, future))
+
+    def _encode_and_write(self, frame, path: str):
+        tmp_path = None
+        try:
+            start = time.perf_counter()
+            data, size = encode_frame(frame, self.profile)
+            encode_sec = time.perf_counter() - start
+            if self.write_to_disk:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path) # Un archivo a medio escribir nunca queda con el nombre final
+        except Exception as e:
+            print(f"    Error: No se pudo codificar/guardar el screenshot '{path}': {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return None
+        with self._stats_lock:
+            self.stats["count"] += 1
+            self.stats["bytes"] += len(data)
+            self.stats["encode_sec"] += encode_sec
+            if self.keep_in_memory:
+                self.images[path] = {"data": data, "width": size[0], "height": size[1], "format": self.profile["format"]}
+        print(f"    -> Screenshot {'guardado en' if self.write_to_disk else 'codificado en memoria para'}: '{path}'")
+        return size
+
+    def load_existing(self, path: str, width: int = None, height: int = None):
+        """
+        Carga en `images` un screenshot ya presente en disco (reutilizado), sin re-codificarlo.
+        Si no se conocen sus dimensiones se decodifica una vez para obtenerlas.
+
+        Returns:
+            (ancho, alto), o None si no se pudo leer.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if not width or not height:
+                image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+                if image is None:
+                    raise ValueError("OpenCV no pudo decodificar la imagen.")
+                height, width = image.shape[:2]
+        except (OSError, ValueError) as e:
+            print(f"    Advertencia: No se pudo cargar el screenshot existente '{path}': {e}")
+            return None
+        with self._stats_lock:
+            self.images[path] = {"data": data, "width": width, "height": height, "format": self.profile["format"]}
+        return width, height
+
+    def drain(self) -> list:
+        """
+        Espera las codificaciones pendientes.
+
+        Returns:
+            Lista de (key, (ancho, alto) o None si falló) en orden de envío.
+        """
+        pending, self._pending = self._pending, []
+        return [(key, future.result()) for key, future in pending]
+
+    def merge_stats(self, stats: dict, images: dict = None):
+        """Suma estadísticas (e imágenes en memoria) de otro codificador (ej: de un proceso del modo 'parallel')."""
+        with self._stats_lock:
+            for field in self.stats:
+                self.stats[field] += stats.get(field, 0)
+            self.images.update(images or {})
+
+    def close(self):
+        self.drain()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def print_encoding_stats(stats: dict, profile_name: str, tag: str = "Screenshots"):
+    """Muestra bytes por screenshot y tiempo de codificación del perfil usado."""
+    count = stats["count"]
+    if not count:
+        print(f"[{tag}] Perfil '{profile_name}': ningún screenshot codificado.")
+        return
+    print(f"[{tag}] Perfil '{profile_name}': {count} screenshots, "
+          f"{stats['bytes'] / count / 1024:.1f} KiB/screenshot, "
+          f"{stats['encode_sec'] / count * 1000:.1f} ms de codificación/screenshot.")
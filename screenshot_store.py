@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import tempfile
+
+# --- Configuración del Almacén de Screenshots ---
+SCREENSHOT_MANIFEST_FILENAME = 'screenshots_manifest.json'  # Manifiesto dentro de la carpeta de screenshots
+SCREENSHOT_KEY_HASH_CHARS = 16                              # Caracteres del hash del video en el nombre de archivo
+# --- Fin Configuración ---
+
+# Archivos de screenshot que gestiona el almacén, incluidos los nombres anteriores al manifiesto
+# ('screenshot_paso_N.png'); los demás archivos de la carpeta no se tocan
+SCREENSHOT_FILE_REGEX = re.compile(r"^(?:[0-9a-f]{%d}_\d{8}_\w+|screenshot_paso_[^.]+)\.(?:png|jpe?g|webp)$"
+                                   % SCREENSHOT_KEY_HASH_CHARS)
+
+
+def screenshot_filename(video_hash: str, frame_index: int, profile_name: str = 'png', extension: str = '.png') -> str:
+    """Nombre direccionado por contenido: hash del video + índice de fotograma + perfil de codificación."""
+    return f"{video_hash[:SCREENSHOT_KEY_HASH_CHARS]}_{frame_index:08d}_{profile_name}{extension}"
+
+def _new_manifest(video_hash: str, selection: dict) -> dict:
+    return {"video_sha256": video_hash, "selection": selection, "targets": {}, "steps": {}}
+
+def load_manifest(output_dir: str, video_hash: str, selection: dict) -> dict:
+    """
+    Carga el manifiesto de la carpeta. Si corresponde a otro video u otra configuración de
+    selección de fotograma, se empieza uno nuevo (los archivos existentes se pueden reutilizar
+    igual, porque su nombre ya identifica video y fotograma).
+
+    Estructura: {video_sha256, selection, targets: {fotograma_objetivo: {frame_index, file, width, height}},
+    steps: {step_number: {target_frame, frame_index, file, width, height}}}.
+    """
+    try:
+        with open(os.path.join(output_dir, SCREENSHOT_MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _new_manifest(video_hash, selection)
+    if manifest.get("video_sha256") != video_hash or manifest.get("selection") != selection:
+        return _new_manifest(video_hash, selection)
+    manifest.setdefault("targets", {})
+    manifest.setdefault("steps", {})
+    return manifest
+
+def save_manifest(output_dir: str, manifest: dict):
+    """Escribe el manifiesto de forma atómica (archivo temporal + os.replace)."""
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(output_dir, SCREENSHOT_MANIFEST_FILENAME))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def prune_screenshots(output_dir: str, manifest: dict) -> int:
+    """
+    Elimina de la carpeta los screenshots que no figuran en `manifest` (otros videos, otras
+    configuraciones o nombres anteriores al manifiesto), para que la carpeta no crezca con cada
+    video nuevo. Se conservan los fotogramas ya extraídos de este video (`targets`) para reutilizarlos.
+
+    Returns:
+        Número de archivos eliminados.
+    """
+    referenced = {record["file"] for record in manifest["targets"].values()}
+    referenced.update(record["file"] for record in manifest["steps"].values())
+    removed = 0
+    for filename in os.listdir(output_dir):
+        if filename in referenced or not SCREENSHOT_FILE_REGEX.match(filename):
+            continue
+        try:
+            os.unlink(os.path.join(output_dir, filename))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"  - {removed} screenshots de ejecuciones anteriores eliminados de '{output_dir}'.")
+    return removed
+
+def lookup_target(manifest: dict, output_dir: str, target_frame: int):
+    """Devuelve {frame_index, file, ...} si el fotograma objetivo ya se extrajo y su archivo existe; si no, None."""
+    record = manifest["targets"].get(str(target_frame))
+    if record and os.path.exists(os.path.join(output_dir, record["file"])):
+        return record
+    return None
+
+def record_extraction(manifest: dict, frame_records: dict):
+    """
+    Registra en el manifiesto los resultados de una extracción:
+    `frame_records` = {step_number: {target_frame, frame_index, file, width, height}} de los pasos de esta
+    ejecución (las dimensiones pueden faltar si el archivo se reutilizó sin leerlo).
+    """
+    for record in frame_records.values():
+        manifest["targets"][str(record["target_frame"])] = {key: value for key, value in record.items()
+                                                            if key != "target_frame"}
+    manifest["steps"] = {str(step_number): record for step_number, record in frame_records.items()}
+
+def load_step_records(output_dir: str, video_hash: str = None) -> dict:
+    """
+    Devuelve {step_number (str): {path, width, height, ...}} según el manifiesto de la carpeta
+    (vacío si no hay manifiesto). Las dimensiones pueden faltar.
+
+    Con `video_hash`, un manifiesto de otro video se ignora: sus screenshots no corresponden a
+    los pasos actuales.
+    """
+    try:
+        with open(os.path.join(output_dir, SCREENSHOT_MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if video_hash and manifest.get("video_sha256") != video_hash:
+        print(f"  - Advertencia: El manifiesto de '{output_dir}' corresponde a otro video. Se ignora.")
+        return {}
+    return {step_number: {**record, "path": os.path.join(output_dir, record["file"])}
+            for step_number, record in manifest.get("steps", {}).items()}
+
+def resolve_step_screenshots(output_dir: str, video_hash: str = None) -> dict:
+    """Devuelve {step_number (str): ruta del screenshot} según el manifiesto de la carpeta."""
+    return {step_number: record["path"] for step_number, record in load_step_records(output_dir, video_hash).items()}
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import os
+import difflib
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+from video_analyzer import analyze_video_steps, accumulate_usage
+from model_backends import get_backend
+from staged_analysis import generate_narrative_sections, STEPS_PROMPT_V0_3, STEPS_STAGE_KEYS, TEXT_MODEL_NAME
+from bpmn_builder import build_bpmn_xml_from_steps
+
+# --- Configuración del Análisis Segmentado ---
+SEGMENTED_MIN_DURATION_SEC = 600     # Usar modo segmentado a partir de esta duración (~10 min)
+SEGMENTED_WINDOW_SEC = 300           # Duración de cada ventana de análisis
+SEGMENTED_OVERLAP_SEC = 20           # Solapamiento entre ventanas consecutivas
+SEGMENTED_MAX_WORKERS = 4            # Llamadas concurrentes máximas a la API
+SEGMENTED_WINDOW_RETRIES = 1         # Reintentos de cada ventana fallida antes de omitirla
+SEGMENTED_MIN_OK_WINDOWS_RATIO = 0.5 # Fracción mínima de ventanas analizadas para aceptar el resultado
+DEDUP_TIME_TOLERANCE_MS = 3000       # Distancia máxima para considerar dos pasos como duplicados
+DEDUP_MIN_TEXT_SIMILARITY = 0.6      # Similitud mínima de descripción (0-1) para duplicados
+# --- Fin Configuración ---
+
+STEPS_KEY = "section_3_3_detailed_steps"
+
+
+def get_video_duration_ms(video_path: str) -> int:
+    """Devuelve la duración del video en milisegundos (0 si no se puede determinar)."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    if not fps or fps <= 0 or not total_frames or total_frames <= 0:
+        return 0
+    return int(total_frames / fps * 1000)
+
+def plan_windows(duration_ms: int, window_ms: int, overlap_ms: int) -> list:
+    """
+    Divide la duración total en ventanas [inicio, fin) solapadas.
+
+    Returns:
+        Lista de tuplas (start_ms, end_ms).
+    """
+    if duration_ms <= window_ms:
+        return [(0, duration_ms)]
+    stride_ms = max(1, window_ms - overlap_ms)
+    windows = []
+    start_ms = 0
+    while True:
+        end_ms = min(start_ms + window_ms, duration_ms)
+        windows.append((start_ms, end_ms))
+        if end_ms >= duration_ms:
+            break
+        start_ms += stride_ms
+    return windows
+
+def cut_video_window(input_path: str, output_path: str, start_ms: int, end_ms: int) -> bool:
+    """
+    Escribe en `output_path` el fragmento [start_ms, end_ms) del video de entrada.
+
+    Returns:
+        True si se escribió al menos un fotograma.
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        print(f"[Segmentado] Error: No se pudo abrir '{input_path}'.")
+        return False
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    start_frame = int(start_ms / 1000.0 * fps)
+    end_frame = int(end_ms / 1000.0 * fps)
+
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        print(f"[Segmentado] Error: No se pudo crear el VideoWriter para '{output_path}'.")
+        cap.release()
+        return False
+
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    written = 0
+    for _ in range(start_frame, end_frame):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        writer.write(frame)
+        written += 1
+    cap.release()
+    writer.release()
+    return written > 0
+
+def _coerce_timestamp_ms(value):
+    """Convierte el timestamp devuelto por el modelo (int, float o texto numérico) a int. None si no es válido."""
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def _is_duplicate_step(step: dict, previous_steps: list) -> bool:
+    """Indica si `step` repite un paso ya presente (mismo momento y descripción similar)."""
+    description = (step.get("description") or "").lower()
+    for prev in previous_steps:
+        if abs(prev["timestamp_ms"] - step["timestamp_ms"]) > DEDUP_TIME_TOLERANCE_MS:
+            continue
+        prev_description = (prev.get("description") or "").lower()
+        if difflib.SequenceMatcher(None, description, prev_description).ratio() >= DEDUP_MIN_TEXT_SIMILARITY:
+            return True
+    return False
+
+def merge_window_results(window_results: list) -> dict:
+    """
+    Combina la metadata y los pasos de las ventanas (prompt de pasos) en un único JSON.
+
+    - Pasos: se desplazan por el inicio de su ventana, se eliminan los duplicados
+      de la zona solapada con la ventana anterior y se renumeran `step_number`.
+    - Metadata: primer valor no nulo en orden de ventanas.
+    - BPMN: se construye desde los pasos combinados.
+
+    Las secciones narrativas no vienen de las ventanas: se generan después desde estos pasos.
+
+    Args:
+        window_results: Lista ordenada de tuplas ((start_ms, end_ms), datos_json).
+    """
+    merged = {}
+    merged_steps = []
+    previous_end_ms = None
+
+    for (start_ms, end_ms), data in window_results:
+        if "pdd_metadata_inferred" not in merged and data.get("pdd_metadata_inferred"):
+            merged["pdd_metadata_inferred"] = data["pdd_metadata_inferred"]
+
+        # Pasos ya presentes en la zona solapada (candidatos a duplicado)
+        overlap_steps = [s for s in merged_steps if previous_end_ms is not None and s["timestamp_ms"] >= start_ms - DEDUP_TIME_TOLERANCE_MS]
+        for step in data.get(STEPS_KEY) or []:
+            timestamp_ms = _coerce_timestamp_ms(step.get("timestamp_ms")) if isinstance(step, dict) else None
+            if timestamp_ms is None:
+                print(f"[Segmentado] Advertencia: Paso sin timestamp válido en la ventana {start_ms}-{end_ms} ms. Se omite: {step}")
+                continue
+            shifted = dict(step)
+            shifted["timestamp_ms"] = min(max(timestamp_ms, 0), end_ms - start_ms) + start_ms
+            in_overlap = previous_end_ms is not None and shifted["timestamp_ms"] < previous_end_ms + DEDUP_TIME_TOLERANCE_MS
+            if in_overlap and _is_duplicate_step(shifted, overlap_steps):
+                continue
+            merged_steps.append(shifted)
+        previous_end_ms = end_ms
+
+    merged_steps.sort(key=lambda s: s["timestamp_ms"])
+    for number, step in enumerate(merged_steps, start=1):
+        step["step_number"] = number
+
+    merged.setdefault("pdd_metadata_inferred", {})
+    merged[STEPS_KEY] = merged_steps
+    merged["section_3_2_bpmn_xml_code"] = build_bpmn_xml_from_steps(merged_steps)
+    return merged
+
+def _analyze_window(project_id: str, location: str, model_name: str, video_path: str, window: tuple, tmp_dir: str,
+                    usage_out: dict = None, request_runner=None, backend=None):
+    """
+    Corta una ventana y extrae solo su metadata y sus pasos (prompt de pasos del análisis por etapas):
+    las secciones narrativas se generan una vez para todo el video. Devuelve (window, datos, error).
+    """
+    start_ms, end_ms = window
+    window_path = os.path.join(tmp_dir, f"window_{start_ms}_{end_ms}.mp4")
+    try:
+        if not cut_video_window(video_path, window_path, start_ms, end_ms):
+            return window, None, f"No se pudo cortar la ventana {start_ms}-{end_ms} ms."
+        print(f"[Segmentado] Analizando ventana {start_ms / 1000:.0f}s - {end_ms / 1000:.0f}s...")
+        data, error = analyze_video_steps(project_id, location, model_name, window_path, backend=backend,
+                                          usage_out=usage_out, request_runner=request_runner,
+                                          prompt=STEPS_PROMPT_V0_3, expected_keys=STEPS_STAGE_KEYS)
+        return window, data, error
+    except Exception as e:
+        return window, None, f"Error inesperado en ventana {start_ms}-{end_ms} ms: {e}\n{traceback.format_exc()}"
+    finally:
+        if os.path.exists(window_path):
+            os.unlink(window_path)
+
+def analyze_video_segmented(project_id: str, location: str, model_name: str, video_path: str,
+                            window_sec: int = None, overlap_sec: int = None, max_workers: int = None,
+                            usage_out: dict = None, request_runner=None, retries: int = None, backend=None,
+                            text_model_name: str = TEXT_MODEL_NAME):
+    """
+    Analiza un video largo en ventanas solapadas concurrentes y combina los pasos.
+
+    Cada ventana solo extrae metadata y pasos; con los pasos combinados se generan una vez las
+    secciones narrativas (llamadas de solo texto con `text_model_name`, como en el análisis por
+    etapas) y el BPMN se construye localmente.
+
+    La latencia depende de la duración de la ventana (y de cuántas rondas hagan falta
+    con `max_workers`), no de la duración total del video.
+
+    Una ventana fallida se reintenta hasta `retries` veces; si sigue fallando se omite con una
+    advertencia, siempre que se hayan analizado al menos SEGMENTED_MIN_OK_WINDOWS_RATIO de las ventanas.
+    Los parámetros en None toman la configuración del módulo vigente en el momento de la llamada.
+
+    Si se indica `usage_out`, se completa con la suma del uso de tokens de todas las ventanas (y reintentos).
+    `request_runner` se pasa a cada ventana (ver `analyze_video_steps`).
+
+    Returns:
+        Una tupla (datos_json_combinados, error), igual que `analyze_video_steps`.
+    """
+    window_sec = SEGMENTED_WINDOW_SEC if window_sec is None else window_sec
+    overlap_sec = SEGMENTED_OVERLAP_SEC if overlap_sec is None else overlap_sec
+    max_workers = SEGMENTED_MAX_WORKERS if max_workers is None else max_workers
+    retries = SEGMENTED_WINDOW_RETRIES if retries is None else retries
+
+    try:
+        if backend is None:
+            backend = get_backend(project_id=project_id, location=location)
+    except ValueError as e:
+        return None, str(e)
+
+    duration_ms = get_video_duration_ms(video_path)
+    if duration_ms <= 0:
+        return None, f"No se pudo determinar la duración de '{video_path}'."
+    windows = plan_windows(duration_ms, window_sec * 1000, overlap_sec * 1000)
+    print(f"[Segmentado] Video de {duration_ms / 1000:.0f}s dividido en {len(windows)} ventanas "
+          f"(ventana={window_sec}s, solapamiento={overlap_sec}s, workers={max_workers}).")
+
+    results, errors = {}, {}
+    pending = list(windows)
+    with tempfile.TemporaryDirectory(prefix="pdd_windows_") as tmp_dir:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for attempt in range(retries + 1):
+                if not pending:
+                    break
+                if attempt:
+                    print(f"[Segmentado] Reintentando {len(pending)} ventana(s) fallida(s) (intento {attempt + 1} de {retries + 1})...")
+                attempt_usages = [{} for _ in pending]
+                futures = [executor.submit(_analyze_window, project_id, location, model_name, video_path, w, tmp_dir, u,
+                                           request_runner, backend)
+                           for w, u in zip(pending, attempt_usages)]
+                failed = []
+                for window, future in zip(pending, futures):
+                    try:
+                        _, data, error = future.result()
+                    except Exception as e:
+                        data, error = None, f"Error inesperado: {e}\n{traceback.format_exc()}"
+                    if error or not data:
+                        errors[window] = error or "sin datos"
+                        failed.append(window)
+                    else:
+                        results[window] = data
+                for window_usage in attempt_usages:
+                    accumulate_usage(usage_out, window_usage)
+                pending = failed
+
+    if pending:
+        details = " | ".join(f"Ventana {w[0]}-{w[1]} ms: {errors[w]}" for w in pending)
+        if not results or len(results) < len(windows) * SEGMENTED_MIN_OK_WINDOWS_RATIO:
+            return None, "Fallo en el análisis segmentado. " + details
+        print(f"[Segmentado] Advertencia: Se omiten {len(pending)} de {len(windows)} ventanas tras "
+              f"{retries} reintento(s); sus pasos no estarán en el PDD. {details}")
+
+    merged = merge_window_results([(w, results[w]) for w in windows if w in results])
+    print(f"[Segmentado] {len(merged[STEPS_KEY])} pasos combinados desde {len(results)} ventanas.")
+    if not merged[STEPS_KEY]:
+        return None, "El análisis segmentado no devolvió ningún paso."
+    print(f"[Segmentado] Generando las secciones narrativas ({text_model_name}) a partir de los pasos combinados...")
+    merged.update(generate_narrative_sections(merged, backend, text_model_name, request_runner, usage_out))
+    return merged, None
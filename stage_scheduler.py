@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# --- Configuración del Planificador ---
+STAGE_MAX_WORKERS = 4   # Etapas independientes ejecutadas a la vez
+# --- Fin Configuración ---
+
+
+class StageError(Exception):
+    """Fallo esperado de una etapa: el mensaje se devuelve como error del pipeline (sin traceback)."""
+
+
+class Stage:
+    """
+    Etapa del pipeline: `func(context)` se ejecuta cuando todas las etapas de `deps` terminaron bien.
+
+    `func` lee y escribe el diccionario compartido `context` (cada etapa escribe sus propias claves)
+    y señala un fallo lanzando una excepción (`StageError` para errores esperados).
+    """
+
+    def __init__(self, name: str, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+def _check_graph(stages: list):
+    """Valida nombres únicos, dependencias existentes y ausencia de ciclos."""
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Nombres de etapa duplicados: {names}")
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"La etapa '{stage.name}' depende de etapas inexistentes: {missing}")
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Ciclo de dependencias en la etapa '{name}'.")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in names:
+        visit(name)
+
+def _run_stage(stage: Stage, context: dict) -> dict:
+    start = time.perf_counter()
+    try:
+        stage.func(context)
+        return {"status": "ok", "elapsed_sec": time.perf_counter() - start, "error": None}
+    except StageError as e:
+        return {"status": "failed", "elapsed_sec": time.perf_counter() - start, "error": str(e)}
+    except Exception as e:
+        error = f"Error inesperado en la etapa '{stage.name}': {e}\n{traceback.format_exc()}"
+        return {"status": "failed", "elapsed_sec": time.perf_counter() - start, "error": error}
+
+def run_stages(stages: list, context: dict, max_workers: int = STAGE_MAX_WORKERS) -> dict:
+    """
+    Ejecuta el grafo de etapas: cada etapa arranca en cuanto sus dependencias terminaron bien,
+    así que las etapas independientes corren en paralelo (hasta `max_workers`).
+
+    Tras el primer fallo no se lanzan etapas nuevas; las que ya estaban en curso terminan y el
+    resto queda como 'skipped'.
+
+    Returns:
+        Reporte por etapa en orden de declaración: {nombre: {status, elapsed_sec, error}}, con
+        status 'ok', 'failed' o 'skipped'.
+    """
+    _check_graph(stages)
+    report = {stage.name: {"status": "skipped", "elapsed_sec": 0.0, "error": None} for stage in stages}
+    pending = list(stages)
+    running = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if not failed:
+                for stage in [s for s in pending if all(report[dep]["status"] == "ok" for dep in s.deps)]:
+                    pending.remove(stage)
+                    running[executor.submit(_run_stage, stage, context)] = stage
+            if not running:
+                break # Solo quedan etapas bloqueadas por un fallo
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                report[stage.name] = future.result()
+                if report[stage.name]["status"] == "failed":
+                    failed = True
+    return report
+
+def first_stage_error(report: dict):
+    """Devuelve el error de la primera etapa fallida (en orden de declaración), o None."""
+    for result in report.values():
+        if result["status"] == "failed":
+            return result["error"]
+    return None
+
+def print_stage_report(report: dict, tag: str = "Pipeline"):
+    """Muestra el estado y la duración de cada etapa."""
+    print(f"\n[{tag}] Resumen de etapas:")
+    for name, result in report.items():
+        print(f"  - {name:<14} {result['status']:<8} {result['elapsed_sec']:7.2f}s")
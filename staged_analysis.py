@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from video_analyzer import (analyze_video_steps, salvage_model_json, report_token_usage, accumulate_usage,
+                            ANALYSIS_PROMPT_V0_3, STEPS_KEY, LIST_RESPONSE_KEYS)
+from model_backends import get_backend, build_request
+from bpmn_builder import build_bpmn_xml_from_steps
+
+# --- Configuración del Análisis por Etapas ---
+TEXT_MODEL_NAME = "gemini-2.0-flash-001"   # Modelo (más barato) para las secciones narrativas de solo texto
+NARRATIVE_MAX_WORKERS = 3                  # Llamadas de texto concurrentes
+NARRATIVE_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 4096,
+}
+# Secciones narrativas agrupadas por llamada (el BPMN se construye localmente desde los pasos)
+NARRATIVE_SECTION_GROUPS = (
+    ("section_1_1_purpose_text", "section_1_2_objectives_text", "section_1_3_1_scope_in_suggestion",
+     "section_1_3_2_scope_out_suggestion", "section_2_0_context_text"),
+    ("section_3_1_as_is_summary_text", "section_3_1_user_roles_inferred", "section_3_4_inputs_suggestion",
+     "section_3_5_outputs_suggestion", "section_3_6_rules_suggestion"),
+    ("section_4_1_tobe_summary_suggestion", "section_4_3_interaction_suggestion", "section_5_exceptions_suggestions",
+     "section_6_2_dependencies_suggestion", "section_6_4_reporting_suggestion"),
+)
+# --- Fin Configuración ---
+
+STEPS_STAGE_KEYS = ("pdd_metadata_inferred", STEPS_KEY)
+
+STEPS_PROMPT_TEMPLATE = """
+**Tarea Principal:** Eres un asistente experto en análisis de procesos de negocio. Analiza exhaustivamente el video proporcionado que muestra un proceso en pantalla y extrae la secuencia detallada de pasos, estructurando la salida en un **único objeto JSON válido**.
+
+**Instrucciones Generales:**
+1.  Observa CADA acción visual y cambio significativo.
+2.  Infiere el contexto y propósito basándote ÚNICAMENTE en lo visible.
+3.  Genera la salida **estrictamente** en el formato JSON especificado abajo, sin texto introductorio, comentarios fuera del JSON, ni marcado como ```json ... ```. La respuesta DEBE ser solo el objeto JSON.
+
+**Estructura JSON de Salida Requerida:**
+
+```json
+{{
+  "pdd_metadata_inferred": {{
+    "process_name_suggestion": "string | null",
+    "potential_acronym": "string | null"
+  }},
+  "section_3_3_detailed_steps": [
+    {{
+      "step_number": "integer",
+      "description": "string",
+      "timestamp_ms": "integer",
+      "application_in_focus": "string",
+      "action_type_inferred": "string"
+    }}
+  ]
+}}
+```
+
+**Detalle de Secciones a Generar (Instrucciones Específicas):**
+
+{section_instructions}
+
+**¡IMPORTANTE!** Prioriza la validez del JSON y la precisión/detalle de `section_3_3_detailed_steps`. **La precisión en las interacciones con hojas de cálculo es CRÍTICA.**
+"""
+
+NARRATIVE_PROMPT_TEMPLATE = """
+**Tarea:** Eres un asistente experto en documentación de procesos (PDD). A partir de los pasos ya extraídos de una grabación de pantalla (JSON abajo), redacta un borrador de las secciones indicadas.
+
+**Proceso observado (JSON):**
+
+```json
+{steps_json}
+```
+
+**Instrucciones Generales:**
+1.  Basa el contenido ÚNICAMENTE en los pasos anteriores. Si no puedes inferir contenido útil para una clave, devuelve `null` para esa clave.
+2.  Genera **únicamente** un objeto JSON válido con estas claves: {keys}. Sin texto introductorio ni marcado como ```json ... ```.
+
+**Detalle de Secciones a Generar (Instrucciones Específicas):**
+
+{section_instructions}
+"""
+
+
+def extract_section_instructions(prompt: str, keys) -> str:
+    """
+    Extrae del prompt completo v0.3 las instrucciones específicas ("* **`clave`**: ...") de las claves indicadas,
+    para que los prompts por etapas no dupliquen (ni diverjan de) esas indicaciones.
+    """
+    blocks = []
+    for key in keys:
+        pattern = re.compile(r"^\* \*\*`" + re.escape(key) + r"`\*\*.*?(?=^\* \*\*`|^\*\*¡IMPORTANTE!\*\*|\Z)",
+                             re.DOTALL | re.MULTILINE)
+        match = pattern.search(prompt)
+        if match:
+            blocks.append(match.group(0).rstrip())
+    return "\n".join(blocks)
+
+STEPS_PROMPT_V0_3 = STEPS_PROMPT_TEMPLATE.format(
+    section_instructions=extract_section_instructions(ANALYSIS_PROMPT_V0_3, STEPS_STAGE_KEYS))
+
+
+def build_narrative_prompt(steps_data: dict, keys) -> str:
+    """Construye el prompt de solo texto para un grupo de secciones narrativas."""
+    context = {key: steps_data.get(key) for key in STEPS_STAGE_KEYS}
+    return NARRATIVE_PROMPT_TEMPLATE.format(
+        steps_json=json.dumps(context, indent=2, ensure_ascii=False),
+        keys=", ".join(keys),
+        section_instructions=extract_section_instructions(ANALYSIS_PROMPT_V0_3, keys),
+    )
+
+def narrative_prompt_chars() -> int:
+    """Caracteres de los prompts de las llamadas narrativas sin los pasos (para estimar su costo)."""
+    return sum(len(build_narrative_prompt({}, keys)) for keys in NARRATIVE_SECTION_GROUPS)
+
+def _generate_narrative_group(backend, text_model_name: str, steps_data: dict, keys, request_runner=None):
+    """Genera un grupo de secciones narrativas. Devuelve (datos, uso, error)."""
+    try:
+        request = build_request(text_model_name, build_narrative_prompt(steps_data, keys), NARRATIVE_GENERATION_CONFIG)
+        call = lambda: backend.generate(request)
+        result = request_runner(call) if request_runner else call()
+        if not result.get("text"):
+            return None, result.get("usage"), result.get("error") or "Respuesta vacía."
+        data, missing_keys = salvage_model_json(result["text"], keys)
+        if missing_keys:
+            print(f"[Etapas] Advertencia: Faltan claves en la respuesta narrativa: {missing_keys}")
+        return data, result.get("usage"), None
+    except Exception as e:
+        return None, None, f"{e}\n{traceback.format_exc()}"
+
+def generate_narrative_sections(steps_data: dict, backend, text_model_name: str = TEXT_MODEL_NAME,
+                                request_runner=None, usage_out: dict = None, max_workers: int = NARRATIVE_MAX_WORKERS) -> dict:
+    """
+    Genera en paralelo, con llamadas de solo texto, las secciones narrativas a partir de los pasos.
+
+    Un grupo que falla deja sus claves en null (el documento se puede generar igual).
+
+    Returns:
+        Diccionario con las secciones narrativas de todos los grupos.
+    """
+    sections = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(keys, executor.submit(_generate_narrative_group, backend, text_model_name, steps_data, keys, request_runner))
+                   for keys in NARRATIVE_SECTION_GROUPS]
+        for keys, future in futures:
+            data, usage, error = future.result()
+            report_token_usage(usage, text_model_name)
+            accumulate_usage(usage_out, usage, text_model_name)
+            if error:
+                print(f"[Etapas] Advertencia: Falló la generación de {', '.join(keys)}: {error}")
+            for key in keys:
+                default = [] if key in LIST_RESPONSE_KEYS else None
+                sections[key] = (data or {}).get(key, default)
+    return sections
+
+def analyze_video_staged(project_id: str, location: str, model_name: str, video_path: str, on_step=None, backend=None,
+                         usage_out: dict = None, request_runner=None, text_model_name: str = TEXT_MODEL_NAME):
+    """
+    Análisis en dos etapas:
+
+    1. Llamada multimodal (video) que devuelve solo `pdd_metadata_inferred` y los pasos detallados.
+    2. Llamadas concurrentes de solo texto (`text_model_name`) para las secciones narrativas,
+       con los pasos como contexto. El BPMN se construye localmente desde los pasos.
+
+    Returns:
+        Una tupla (datos_json_v0_3, error), igual que `analyze_video_steps`.
+    """
+    try:
+        if backend is None:
+            backend = get_backend(project_id=project_id, location=location)
+    except ValueError as e:
+        return None, str(e)
+
+    print("[Etapas] Etapa 1: extracción de pasos desde el video...")
+    steps_data, error = analyze_video_steps(project_id, location, model_name, video_path, on_step=on_step, backend=backend,
+                                            usage_out=usage_out, request_runner=request_runner,
+                                            prompt=STEPS_PROMPT_V0_3, expected_keys=STEPS_STAGE_KEYS)
+    if error or not steps_data:
+        return None, error or "La etapa de pasos no devolvió datos."
+    steps = steps_data.get(STEPS_KEY) or []
+    if not steps:
+        return None, "La etapa de pasos no devolvió ningún paso."
+
+    print(f"[Etapas] Etapa 2: {len(NARRATIVE_SECTION_GROUPS)} llamadas de texto concurrentes ({text_model_name}) "
+          f"a partir de {len(steps)} pasos...")
+    analysis_data = {"pdd_metadata_inferred": steps_data.get("pdd_metadata_inferred") or {}}
+    analysis_data.update(generate_narrative_sections(steps_data, backend, text_model_name, request_runner, usage_out))
+    analysis_data[STEPS_KEY] = steps
+    analysis_data["section_3_2_bpmn_xml_code"] = build_bpmn_xml_from_steps(steps)
+    print("[Etapas] Análisis por etapas completado.")
+    return analysis_data, None
@@ -1,10 +1,8 @@
 import sys
 import os
-import base64
 import json
-import vertexai
-from vertexai.preview.generative_models import GenerativeModel, Part, FinishReason
-import vertexai.preview.generative_models as generative_models
+from json_incremental import IncrementalJsonScanner
+from model_backends import get_backend, build_request
 
 # --- CONFIGURACIÓN (¡MODIFICA ESTOS VALORES!) ---
 PROJECT_ID = "pdd-agent-456515"  # Reemplaza con tu ID de Proyecto de Google Cloud
@@ -15,105 +13,13 @@ MODEL_NAME = "gemini-2.5-pro-exp-03-25"
 VIDEO_PATH = "video_1.mkv"
 # Archivo donde se guardará la salida JSON
 OUTPUT_JSON_PATH = "full_analysis_output.json"
-# --- FIN DE LA CONFIGURACIÓN ---
-
-# <<< --- FUNCIÓN PARA CALCULAR COSTO --- >>>
-def calculate_estimated_cost(input_tokens: int, output_tokens: int) -> float:
-    """
-    Calcula el costo estimado basado en tokens de entrada/salida y
-    la tabla de precios proporcionada (por 1 millón de tokens).
-
-    Args:
-        input_tokens: Número de tokens de entrada.
-        output_tokens: Número de tokens de salida.
-
-    Returns:
-        El costo estimado en USD para el nivel pagado.
-    """
-    # --- Precios (Basados en la tabla, por 1 millón de tokens) ---
-    # ¡¡¡ ACTUALIZA ESTOS VALORES SI LOS PRECIOS OFICIALES CAMBIAN !!!
-    INPUT_THRESHOLD = 200000
-    OUTPUT_THRESHOLD = 200000
-    INPUT_RATE_LOW = 1.25    # USD por 1M tokens si input <= threshold
-    INPUT_RATE_HIGH = 2.50   # USD por 1M tokens si input > threshold
-    OUTPUT_RATE_LOW = 10.00  # USD por 1M tokens si output <= threshold
-    OUTPUT_RATE_HIGH = 15.00 # USD por 1M tokens si output > threshold
-    TOKENS_PER_MILLION = 1_000_000.0 # Usar float para división precisa
-    # ---------------------------------------------------------
-
-    # Calcular tarifa de entrada aplicable
-    if input_tokens <= INPUT_THRESHOLD:
-        input_rate = INPUT_RATE_LOW
-    else:
-        input_rate = INPUT_RATE_HIGH
-
-    # Calcular costo de entrada
-    cost_input = (input_tokens / TOKENS_PER_MILLION) * input_rate
-
-    # Calcular tarifa de salida aplicable
-    if output_tokens <= OUTPUT_THRESHOLD:
-        output_rate = OUTPUT_RATE_LOW
-    else:
-        output_rate = OUTPUT_RATE_HIGH
-
-    # Calcular costo de salida
-    cost_output = (output_tokens / TOKENS_PER_MILLION) * output_rate
-
-    # Calcular costo total
-    total_cost = cost_input + cost_output
-
-    return total_cost
-# <<< --- FIN DE LA FUNCIÓN --- >>>
-
-def analyze_video_steps(project_id: str, location: str, model_name: str, video_path: str):
-    """
-    Analiza un video usando Vertex AI Gemini para extraer pasos y timestamps.
-
-    Args:
-        project_id: ID del proyecto de Google Cloud.
-        location: Región de Vertex AI.
-        model_name: Nombre del modelo Generative AI (ej: gemini-1.0-pro-vision-001).
-        video_path: Ruta al archivo de video local.
+# Solicitudes de continuación máximas para completar una respuesta truncada
+CONTINUATION_MAX_ROUNDS = 2
 
-    Returns:
-        La estructura de datos Python parseada desde el JSON de respuesta, o None si falla.
-    """
-    print(f"Inicializando Vertex AI para el proyecto {project_id} en {location}...")
-    try:
-        vertexai.init(project=project_id, location=location)
-    except Exception as e:
-        print(f"Error al inicializar Vertex AI: {e}")
-        print("Asegúrate de haber ejecutado 'gcloud auth application-default login'")
-        return None
-
-    print(f"Cargando el modelo: {model_name}")
-    try:
-        model = GenerativeModel(model_name)
-    except Exception as e:
-        print(f"Error al cargar el modelo: {e}")
-        print("Verifica que el nombre del modelo sea correcto y esté disponible en la región.")
-        return None
-
-    print(f"Verificando el archivo de video: {video_path}")
-    if not os.path.exists(video_path):
-        print(f"Error: No se encuentra el archivo de video en '{video_path}'")
-        return None
-
-    print("Leyendo y codificando el video en Base64 (esto puede tardar)...")
-    try:
-        with open(video_path, "rb") as video_file:
-            video_bytes = video_file.read()
-        encoded_content = base64.b64encode(video_bytes).decode("utf-8")
-        # Determinar MIME type (ajusta si tu video no es MP4)
-        mime_type = "video/mp4"
-        video_part = Part.from_data(data=encoded_content, mime_type=mime_type)
-        print("Video codificado exitosamente.")
-    except Exception as e:
-        print(f"Error al leer o codificar el video: {e}")
-        return None
+# --- FIN DE LA CONFIGURACIÓN ---
 
-    # Define el prompt detallado
-    prompt = """
+# Prompt detallado del análisis (v0.3). Forma parte de la clave del caché de análisis.
+ANALYSIS_PROMPT_V0_3 = """
 **Tarea Principal:** Eres un asistente experto en análisis de procesos de negocio y documentación técnica (PDD). Analiza exhaustivamente el video proporcionado que muestra un proceso en pantalla. Tu objetivo es extraer información detallada y generar un borrador inicial para la mayoría de las secciones de un PDD profesional, estructurando toda la salida en un **único objeto JSON válido**.
 
 **Instrucciones Generales:**
@@ -233,78 +139,370 @@ def analyze_video_steps(project_id: str, location: str, model_name: str, video_p
 
 **¡IMPORTANTE!** Prioriza la validez del JSON y la precisión/detalle de `section_3_3_detailed_steps`. **La precisión en las interacciones con hojas de cálculo es CRÍTICA.** La calidad del texto narrativo generado es secundaria y requerirá revisión humana intensiva. El BPMN debe ser estructuralmente correcto y simple.
 """
-    # Configuración de generación
-    generation_config = {
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 20000,
-    }
 
-    # Configuración de seguridad
-    safety_settings = {
-        generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    }
+# Configuración de generación. Forma parte de la clave del caché de análisis.
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 20000,
+}
+
+STEPS_KEY = "section_3_3_detailed_steps"
+
+# Claves de primer nivel que debe contener una respuesta completa (ver ANALYSIS_PROMPT_V0_3)
+EXPECTED_RESPONSE_KEYS = (
+    "pdd_metadata_inferred", "section_1_1_purpose_text", "section_1_2_objectives_text",
+    "section_1_3_1_scope_in_suggestion", "section_1_3_2_scope_out_suggestion", "section_2_0_context_text",
+    "section_3_1_as_is_summary_text", "section_3_1_user_roles_inferred", "section_3_2_bpmn_xml_code",
+    STEPS_KEY, "section_3_4_inputs_suggestion", "section_3_5_outputs_suggestion",
+    "section_3_6_rules_suggestion", "section_4_1_tobe_summary_suggestion", "section_4_3_interaction_suggestion",
+    "section_5_exceptions_suggestions", "section_6_2_dependencies_suggestion", "section_6_4_reporting_suggestion",
+)
+
+LIST_RESPONSE_KEYS = ("section_3_1_user_roles_inferred", STEPS_KEY, "section_5_exceptions_suggestions")
+
+# Prompt de continuación: pide solo las claves que faltan en una respuesta truncada
+CONTINUATION_PROMPT_TEMPLATE = """
+**Tarea:** Una respuesta anterior a las instrucciones originales (abajo) se cortó antes de terminar. Esta es la parte ya recuperada (JSON válido):
+
+```json
+{partial_json}
+```
 
-    print("Enviando solicitud a la API de Vertex AI (esto puede tardar y generar costos)...")
-    raw_response_text = ""
+Genera **únicamente** un objeto JSON válido con estas claves faltantes: {missing_keys}.
+{steps_instruction}
+Sigue el formato y las indicaciones de las instrucciones originales para cada clave y mantén la coherencia con lo ya generado. No repitas claves ya presentes. La respuesta DEBE ser solo el objeto JSON.
+
+**Instrucciones originales:**
+{original_prompt}
+"""
+
+STEPS_CONTINUATION_INSTRUCTION = (
+    "Para `section_3_3_detailed_steps` devuelve SOLO los pasos posteriores al paso {last_step} "
+    "(timestamp {last_ms} ms) observados en el video, numerados desde {next_step}."
+)
+STEPS_FULL_INSTRUCTION = (
+    "Para `section_3_3_detailed_steps` devuelve todos los pasos observados en el video, numerados desde 1."
+)
+
+# Precios (USD por 1 millón de tokens) de los modelos que no siguen la tabla de `calculate_estimated_cost`,
+# por prefijo del nombre del modelo (ej: el modelo de texto del análisis por etapas).
+MODEL_PRICE_OVERRIDES = {
+    "gemini-2.0-flash": {"input": 0.10, "output": 0.40},
+}
+
+# <<< --- FUNCIÓN PARA CALCULAR COSTO --- >>>
+def calculate_estimated_cost(input_tokens: int, output_tokens: int, model_name: str = None) -> float:
+    """
+    Calcula el costo estimado basado en tokens de entrada/salida y
+    la tabla de precios proporcionada (por 1 millón de tokens).
+
+    Args:
+        input_tokens: Número de tokens de entrada.
+        output_tokens: Número de tokens de salida.
+        model_name: (Opcional) Modelo que generó el uso; si figura en MODEL_PRICE_OVERRIDES se
+            usan sus precios en lugar de la tabla (nivel Pro).
+
+    Returns:
+        El costo estimado en USD para el nivel pagado.
+    """
+    for prefix, prices in MODEL_PRICE_OVERRIDES.items():
+        if model_name and model_name.startswith(prefix):
+            return (input_tokens * prices["input"] + output_tokens * prices["output"]) / 1_000_000.0
+
+    # --- Precios (Basados en la tabla, por 1 millón de tokens) ---
+    # ¡¡¡ ACTUALIZA ESTOS VALORES SI LOS PRECIOS OFICIALES CAMBIAN !!!
+    INPUT_THRESHOLD = 200000
+    OUTPUT_THRESHOLD = 200000
+    INPUT_RATE_LOW = 1.25    # USD por 1M tokens si input <= threshold
+    INPUT_RATE_HIGH = 2.50   # USD por 1M tokens si input > threshold
+    OUTPUT_RATE_LOW = 10.00  # USD por 1M tokens si output <= threshold
+    OUTPUT_RATE_HIGH = 15.00 # USD por 1M tokens si output > threshold
+    TOKENS_PER_MILLION = 1_000_000.0 # Usar float para división precisa
+    # ---------------------------------------------------------
+
+    # Calcular tarifa de entrada aplicable
+    if input_tokens <= INPUT_THRESHOLD:
+        input_rate = INPUT_RATE_LOW
+    else:
+        input_rate = INPUT_RATE_HIGH
+
+    # Calcular costo de entrada
+    cost_input = (input_tokens / TOKENS_PER_MILLION) * input_rate
+
+    # Calcular tarifa de salida aplicable
+    if output_tokens <= OUTPUT_THRESHOLD:
+        output_rate = OUTPUT_RATE_LOW
+    else:
+        output_rate = OUTPUT_RATE_HIGH
+
+    # Calcular costo de salida
+    cost_output = (output_tokens / TOKENS_PER_MILLION) * output_rate
+
+    # Calcular costo total
+    total_cost = cost_input + cost_output
+
+    return total_cost
+# <<< --- FIN DE LA FUNCIÓN --- >>>
+
+def analyze_video_steps(project_id: str, location: str, model_name: str, video_path: str, on_step=None, backend=None,
+                        usage_out: dict = None, request_runner=None, prompt: str = ANALYSIS_PROMPT_V0_3,
+                        expected_keys: tuple = EXPECTED_RESPONSE_KEYS):
+    """
+    Analiza un video usando Vertex AI Gemini para extraer pasos y timestamps.
+
+    Args:
+        project_id: ID del proyecto de Google Cloud.
+        location: Región de Vertex AI.
+        model_name: Nombre del modelo Generative AI (ej: gemini-1.0-pro-vision-001).
+        video_path: Ruta al archivo de video local.
+        on_step: (Opcional) Callback llamado con cada paso de 'section_3_3_detailed_steps'
+            en cuanto se recibe completo. Si se indica, la respuesta se pide en streaming.
+        backend: (Opcional) Backend de modelo a usar. Por defecto se crea el indicado por
+            `model_backends.MODEL_BACKEND` ('vertex', 'record', 'replay' o 'stub').
+        usage_out: (Opcional) Diccionario que se completa con el uso real de tokens
+            (input_tokens, output_tokens, total_tokens) para registrar el costo.
+        request_runner: (Opcional) Ejecutor `runner(func)` por el que pasa la llamada al modelo
+            (ej: `AsyncModelClient.threadsafe_runner`, con límites de tasa y reintentos).
+        prompt: (Opcional) Prompt a enviar junto al video (por defecto `ANALYSIS_PROMPT_V0_3`).
+        expected_keys: (Opcional) Claves de primer nivel que debe contener la respuesta del `prompt`.
+
+    Returns:
+        Una tupla (datos, error): la estructura parseada desde el JSON de respuesta, o None y el mensaje de error.
+    """
     try:
-        contents = [video_part, prompt]
-        response = model.generate_content(
-            contents,
-            generation_config=generation_config,
-            safety_settings=safety_settings,
-            stream=False,
-        )
-        print("Respuesta recibida de la API.")
-        try:
-            # Acceder a los metadatos de uso
-            usage_metadata = response.usage_metadata
-            if usage_metadata:
-                input_tokens = usage_metadata.prompt_token_count
-                output_tokens = usage_metadata.candidates_token_count
-                total_tokens = usage_metadata.total_token_count
-                print("\n--- Información de Uso de Tokens ---")
-                print(f" - Tokens de Entrada (Prompt + Video): {input_tokens}")
-                print(f" - Tokens de Salida (Respuesta): {output_tokens}")
-                print(f" - Tokens Totales: {total_tokens}")
-                print("------------------------------------")
-
-                # <<< --- LLAMADA A LA FUNCIÓN DE CÁLCULO DE COSTO --- >>>
-                estimated_cost = calculate_estimated_cost(input_tokens, output_tokens)
-                # Mostrar el costo formateado (ej: con 6 decimales para precisión)
-                print(f" - Costo Estimado (USD, Nivel Pagado): ${estimated_cost:.5f}")
-                print("   (Basado en precios por millón de tokens: Input <=200k=$1.25, >200k=$2.50; Output <=200k=$10.00, >200k=$15.00)")
-                print("   (Nota: El costo real puede variar y depende del nivel gratuito aplicable. Revisa la facturación de GCP.)")
-                # <<< --- FIN DE LA LLAMADA Y MUESTRA DE COSTO --- >>>
-
-            else:
-                print("\nAdvertencia: No se encontraron metadatos de uso de tokens en la respuesta.")
-        except Exception as e:
-            print(f"\nAdvertencia: No se pudo obtener la información de uso de tokens: {e}")
-    
+        if backend is None:
+            backend = get_backend(project_id=project_id, location=location)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None, str(e)
 
-        if response.candidates and response.candidates[0].content.parts:
-            raw_response_text = response.candidates[0].content.parts[0].text
-        else:
-             finish_reason = response.candidates[0].finish_reason if response.candidates else "N/A"
-             safety_ratings = response.candidates[0].safety_ratings if response.candidates else "N/A"
-             error_msg = f"Respuesta vacía o bloqueada. Razón: {finish_reason}, Ratings: {safety_ratings}"
-             print(f"Error: {error_msg}")
-             # Imprimir feedback del prompt si existe
-             if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-                  print(f"Prompt Feedback: {response.prompt_feedback}")
-             return None, error_msg
+    print(f"Verificando el archivo de video: {video_path}")
+    if not os.path.exists(video_path):
+        error_msg = f"No se encuentra el archivo de video en '{video_path}'"
+        print(f"Error: {error_msg}")
+        return None, error_msg
+
+    # Determinar MIME type (ajusta si tu video no es MP4)
+    request = build_request(model_name, prompt, GENERATION_CONFIG, video_path=video_path, mime_type="video/mp4")
 
+    print(f"Enviando solicitud al backend '{backend.name}' (esto puede tardar y generar costos)...")
+    if on_step is not None:
+        # Modo streaming: emitir cada paso en cuanto su objeto JSON queda completo
+        call = lambda: _generate_streaming(backend, request, on_step)
+    else:
+        call = lambda: backend.generate(request)
+    try:
+        result = request_runner(call) if request_runner else call()
+        print("Respuesta completa recibida (streaming)." if on_step is not None else "Respuesta recibida.")
     except Exception as e:
         error_msg = f"Error durante la llamada a la API de Vertex AI: {e}"
         print(error_msg)
         # Considerar verificar quotas, permisos, etc.
         return None, error_msg
 
+    report_token_usage(result.get("usage"), model_name)
+    accumulate_usage(usage_out, result.get("usage"), model_name)
+    if result.get("error"):
+        print(f"Error: {result['error']}")
+        if not result.get("text"):
+            return None, result["error"]
+        # Respuesta interrumpida con texto parcial: intentar recuperarla
+        return recover_truncated_response(backend, model_name, video_path, result["text"], result["error"],
+                                          request_runner, usage_out, prompt, expected_keys)
+
+    parsed_data, parse_error = parse_model_json(result["text"])
+    if parsed_data is not None:
+        return parsed_data, None
+    return recover_truncated_response(backend, model_name, video_path, result["text"], parse_error,
+                                      request_runner, usage_out, prompt, expected_keys)
+
+def accumulate_usage(usage_out: dict, usage: dict, model_name: str = None):
+    """
+    Suma el uso de tokens de una llamada al diccionario `usage_out` (si se indicó), también por
+    modelo en `usage_out["by_model"]` (para cobrar cada modelo a su precio). `usage` puede ser a
+    su vez un acumulado con su propio "by_model".
+    """
+    if usage_out is None or not usage:
+        return
+    fields = ("input_tokens", "output_tokens", "total_tokens")
+    for field in fields:
+        usage_out[field] = usage_out.get(field, 0) + (usage.get(field) or 0)
+    by_model = usage.get("by_model") or ({model_name: usage} if model_name else {})
+    for name, model_usage in by_model.items():
+        model_out = usage_out.setdefault("by_model", {}).setdefault(name, {})
+        for field in fields:
+            model_out[field] = model_out.get(field, 0) + (model_usage.get(field) or 0)
+
+def salvage_model_json(raw_response_text: str, expected_keys: tuple = EXPECTED_RESPONSE_KEYS):
+    """
+    Recupera las secciones completas de una respuesta truncada o malformada.
+
+    Returns:
+        Una tupla (datos, claves_faltantes). Los pasos completos de un
+        'section_3_3_detailed_steps' cortado se conservan, y la clave se incluye
+        igualmente en las faltantes.
+    """
+    scanner = IncrementalJsonScanner(watched_keys=(STEPS_KEY,))
+    scanner.feed(raw_response_text)
+    data = scanner.salvage()
+    missing_keys = [key for key in expected_keys if key not in data or key in scanner.truncated_keys]
+    return data, missing_keys
+
+def build_continuation_prompt(partial_data: dict, missing_keys: list, original_prompt: str = ANALYSIS_PROMPT_V0_3) -> str:
+    """Construye el prompt que pide al modelo solo las claves faltantes."""
+    steps_instruction = ""
+    if STEPS_KEY in missing_keys:
+        steps = partial_data.get(STEPS_KEY) or []
+        if steps:
+            steps_instruction = STEPS_CONTINUATION_INSTRUCTION.format(
+                last_step=steps[-1].get("step_number", len(steps)), last_ms=steps[-1].get("timestamp_ms", 0),
+                next_step=len(steps) + 1)
+        else: # Respuesta cortada antes de los pasos
+            steps_instruction = STEPS_FULL_INSTRUCTION
+    return CONTINUATION_PROMPT_TEMPLATE.format(
+        partial_json=json.dumps(partial_data, indent=2, ensure_ascii=False),
+        missing_keys=", ".join(missing_keys),
+        steps_instruction=steps_instruction,
+        original_prompt=original_prompt,
+    )
+
+def merge_continuation(partial_data: dict, continuation_data: dict, expected_keys: tuple = EXPECTED_RESPONSE_KEYS) -> dict:
+    """
+    Añade a `partial_data` las claves de la continuación. Los pasos nuevos se agregan
+    a continuación de los ya recuperados (descartando los repetidos) y se renumeran.
+    """
+    for key, value in continuation_data.items():
+        if key == STEPS_KEY:
+            steps = partial_data.setdefault(STEPS_KEY, [])
+            last_ms = steps[-1].get("timestamp_ms", -1) if steps else -1
+            for step in value or []:
+                if isinstance(step, dict) and (step.get("timestamp_ms") or 0) > last_ms:
+                    steps.append(step)
+            for number, step in enumerate(steps, start=1):
+                step["step_number"] = number
+        elif key in expected_keys and key not in partial_data:
+            partial_data[key] = value
+    return partial_data
+
+def recover_truncated_response(backend, model_name: str, video_path: str, raw_response_text: str, original_error: str,
+                               request_runner=None, usage_out: dict = None, prompt: str = ANALYSIS_PROMPT_V0_3,
+                               expected_keys: tuple = EXPECTED_RESPONSE_KEYS):
+    """
+    Recupera una respuesta truncada o malformada y la completa con solicitudes de continuación.
+
+    Se conservan todas las secciones completas, también si la respuesta se cortó antes de los
+    pasos. Solo se vuelve a enviar el video si faltan pasos; el resto de las secciones se piden
+    en una llamada de solo texto con los datos recuperados como contexto.
+
+    Returns:
+        Una tupla (datos, error). Las claves que no se logren completar quedan en None; si se
+        esperaban pasos y no se obtuvo ninguno, (None, error).
+    """
+    partial_data, missing_keys = salvage_model_json(raw_response_text, expected_keys)
+    if not partial_data:
+        print("[Recuperación] No se recuperó ninguna sección de la respuesta; no es posible continuar.")
+        return None, original_error
+    print(f"[Recuperación] Recuperadas {len(partial_data)} secciones y {len(partial_data.get(STEPS_KEY) or [])} pasos. "
+          f"Faltan: {missing_keys or 'ninguna'}")
+
+    for round_number in range(1, CONTINUATION_MAX_ROUNDS + 1):
+        if not missing_keys:
+            break
+        needs_video = STEPS_KEY in missing_keys
+        request = build_request(model_name, build_continuation_prompt(partial_data, missing_keys, prompt), GENERATION_CONFIG,
+                                video_path=video_path if needs_video else None, mime_type="video/mp4")
+        print(f"[Recuperación] Continuación {round_number}/{CONTINUATION_MAX_ROUNDS} "
+              f"({'con video' if needs_video else 'solo texto'}) para {len(missing_keys)} claves...")
+        try:
+            call = lambda: backend.generate(request)
+            result = request_runner(call) if request_runner else call()
+        except Exception as e:
+            print(f"[Recuperación] Error en la solicitud de continuación: {e}")
+            break
+        report_token_usage(result.get("usage"), model_name)
+        accumulate_usage(usage_out, result.get("usage"), model_name)
+        if not result.get("text"):
+            print(f"[Recuperación] La continuación no devolvió texto: {result.get('error')}")
+            break
+        continuation_data, continuation_missing = salvage_model_json(result["text"], expected_keys)
+        merge_continuation(partial_data, continuation_data, expected_keys)
+        steps_still_truncated = needs_video and STEPS_KEY in continuation_missing and STEPS_KEY in continuation_data
+        missing_keys = [key for key in expected_keys
+                        if key not in partial_data or (key == STEPS_KEY and steps_still_truncated)]
+
+    if STEPS_KEY in expected_keys and not partial_data.get(STEPS_KEY):
+        print("[Recuperación] No se obtuvieron pasos ni con las continuaciones.")
+        return None, original_error
+    if missing_keys:
+        print(f"[Recuperación] Advertencia: Claves sin completar (quedan en null): {missing_keys}")
+        for key in missing_keys:
+            partial_data.setdefault(key, [] if key in LIST_RESPONSE_KEYS else None)
+    return partial_data, None
+
+def _generate_streaming(backend, request: dict, on_step) -> dict:
+    """
+    Ejecuta la solicitud en streaming y llama a `on_step(step)` por cada
+    elemento de 'section_3_3_detailed_steps' en cuanto se completa.
+
+    Returns:
+        El resultado normalizado con el texto completo acumulado.
+    """
+    scanner = IncrementalJsonScanner(watched_keys=("section_3_3_detailed_steps",))
+    usage = None
+    finish_reason = None
+    emitted_count = 0
+    for chunk in backend.generate_stream(request):
+        if chunk.get("error"):
+            return {"text": scanner.text, "usage": chunk.get("usage") or usage,
+                    "finish_reason": chunk.get("finish_reason"), "error": chunk["error"]}
+        usage = chunk.get("usage") or usage # El último fragmento trae los totales
+        finish_reason = chunk.get("finish_reason") or finish_reason
+        for _, step in scanner.feed(chunk.get("text") or ""):
+            emitted_count += 1
+            try:
+                on_step(step)
+            except Exception as e:
+                print(f"Advertencia: El consumidor de pasos falló en el paso {step.get('step_number', '?')}: {e}")
+    print(f"Pasos emitidos durante el streaming: {emitted_count}")
+    error = None if scanner.text else "Respuesta vacía o bloqueada durante el streaming."
+    return {"text": scanner.text, "usage": usage, "finish_reason": finish_reason, "error": error}
+
+def report_token_usage(usage: dict, model_name: str = None):
+    """Muestra los tokens usados y el costo estimado de una respuesta (uso normalizado del backend)."""
+    try:
+        # Acceder a los metadatos de uso
+        if usage:
+            input_tokens = usage["input_tokens"]
+            output_tokens = usage["output_tokens"]
+            total_tokens = usage["total_tokens"]
+            print("\n--- Información de Uso de Tokens ---")
+            print(f" - Tokens de Entrada (Prompt + Video): {input_tokens}")
+            print(f" - Tokens de Salida (Respuesta): {output_tokens}")
+            print(f" - Tokens Totales: {total_tokens}")
+            print("------------------------------------")
+
+            # <<< --- LLAMADA A LA FUNCIÓN DE CÁLCULO DE COSTO --- >>>
+            estimated_cost = calculate_estimated_cost(input_tokens, output_tokens, model_name)
+            # Mostrar el costo formateado (ej: con 6 decimales para precisión)
+            print(f" - Costo Estimado (USD, Nivel Pagado): ${estimated_cost:.5f}")
+            print("   (Basado en precios por millón de tokens: Input <=200k=$1.25, >200k=$2.50; Output <=200k=$10.00, >200k=$15.00)")
+            print("   (Nota: El costo real puede variar y depende del nivel gratuito aplicable. Revisa la facturación de GCP.)")
+            # <<< --- FIN DE LA LLAMADA Y MUESTRA DE COSTO --- >>>
+
+        else:
+            print("\nAdvertencia: No se encontraron metadatos de uso de tokens en la respuesta.")
+    except Exception as e:
+        print(f"\nAdvertencia: No se pudo obtener la información de uso de tokens: {e}")
+
+def parse_model_json(raw_response_text: str):
+    """
+    Limpia el texto crudo del modelo (marcado markdown, texto previo) y lo parsea como JSON.
+
+    Returns:
+        Una tupla (datos, error).
+    """
     # --- Procesamiento de la Respuesta ---
     print("\n--- Texto de Respuesta Crudo de la API ---")
     print(raw_response_text)
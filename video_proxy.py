@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+# --- Configuración del Transcodificador ---
+RESIZE_WORKERS = max(2, (os.cpu_count() or 2) - 1)  # Hilos de redimensionamiento (cv2.resize libera el GIL)
+PIPELINE_QUEUE_FRAMES = 16                          # Fotogramas en vuelo como máximo entre etapas (acota la memoria)
+PROXY_FOURCC = 'mp4v'                               # Codec del video generado (ej: 'mp4v', 'avc1' si OpenCV lo soporta)
+PROXY_TARGET_FPS = 2.0                              # fps del proxy de análisis (None = conservar los del original)
+# --- Fin Configuración ---
+
+
+def _encode_stage(writer, pending: queue.Queue, errors: list):
+    """Etapa de codificación: escribe los fotogramas en el orden de la cola hasta recibir None."""
+    while True:
+        future = pending.get()
+        if future is None:
+            return
+        if errors:
+            continue # Tras un error se sigue vaciando la cola para no bloquear la decodificación
+        try:
+            writer.write(future.result())
+        except Exception as e:
+            errors.append(e)
+
+def transcode_video(input_path: str, output_path: str, target_width: int = None, frame_selector=None,
+                    stop_after: int = None, output_fps: float = None, fourcc: str = PROXY_FOURCC,
+                    workers: int = RESIZE_WORKERS, queue_frames: int = PIPELINE_QUEUE_FRAMES) -> dict:
+    """
+    Transcodifica un video en tres etapas concurrentes conectadas por una cola acotada:
+    decodificación (hilo actual), redimensionamiento (pool de `workers` hilos) y codificación
+    (hilo dedicado). La cola guarda los futuros en orden de decodificación, así que los
+    fotogramas se escriben en orden y nunca hay más de `queue_frames` en vuelo.
+
+    Args:
+        input_path: Video de entrada.
+        output_path: Video de salida.
+        target_width: Ancho de salida (se mantiene la proporción). None o mayor/igual al original: sin redimensionar.
+        frame_selector: (Opcional) `frame_selector(indice)` -> bool; los fotogramas descartados se saltan con grab().
+        stop_after: (Opcional) Índice de fotograma a partir del cual se deja de leer.
+        output_fps: (Opcional) fps del video de salida (por defecto el del original).
+        fourcc: Codec del video de salida.
+
+    Returns:
+        Diccionario de estadísticas (frames_in, frames_out, elapsed_sec, fps, peak_inflight_frames,
+        peak_inflight_bytes, width, height, output_fps, source_frames), o None si falló.
+    """
+    start = time.perf_counter()
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        print(f"[Transcode] Error: No se pudo abrir el video '{input_path}'")
+        return None
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if width == 0 or height == 0:
+        print(f"[Transcode] Error: Dimensiones inválidas ({width}x{height}).")
+        cap.release()
+        return None
+    if target_width and width > target_width:
+        new_size = (target_width, int(target_width * height / width))
+    else:
+        new_size = (width, height)
+    output_fps = output_fps or source_fps
+
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), output_fps, new_size)
+    if not writer.isOpened():
+        print(f"[Transcode] Error: No se pudo crear el VideoWriter para '{output_path}' (codec '{fourcc}').")
+        cap.release()
+        return None
+
+    needs_resize = new_size != (width, height)
+    resize_frame = lambda frame: cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA) if needs_resize else frame
+
+    pending = queue.Queue(maxsize=queue_frames)
+    errors = []
+    encoder = threading.Thread(target=_encode_stage, args=(writer, pending, errors), daemon=True)
+    encoder.start()
+    source_frames = []
+    peak_inflight = 0
+    index = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while not errors and (stop_after is None or index < stop_after):
+                if frame_selector is not None and not frame_selector(index):
+                    if not cap.grab():
+                        break
+                    index += 1
+                    continue
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                pending.put(executor.submit(resize_frame, frame))
+                peak_inflight = max(peak_inflight, pending.qsize())
+                source_frames.append(index)
+                index += 1
+            pending.put(None)
+            encoder.join()
+    finally:
+        cap.release()
+        writer.release()
+
+    if errors:
+        print(f"[Transcode] Error durante la codificación: {errors[0]}")
+        return None
+    elapsed = time.perf_counter() - start
+    frame_bytes = width * height * 3 + (new_size[0] * new_size[1] * 3 if needs_resize else 0)
+    return {
+        "frames_in": index,
+        "frames_out": len(source_frames),
+        "elapsed_sec": elapsed,
+        "fps": index / elapsed if elapsed > 0 else 0.0,
+        "peak_inflight_frames": peak_inflight,
+        "peak_inflight_bytes": peak_inflight * frame_bytes,
+        "width": new_size[0],
+        "height": new_size[1],
+        "output_fps": output_fps,
+        "source_frames": source_frames,
+    }
+
+def print_transcode_stats(stats: dict, tag: str = "Transcode"):
+    """Muestra el rendimiento de una transcodificación."""
+    print(f"[{tag}] {stats['frames_in']} fotogramas leídos, {stats['frames_out']} escritos "
+          f"({stats['width']}x{stats['height']}) en {stats['elapsed_sec']:.2f}s: {stats['fps']:.1f} fps. "
+          f"Memoria en vuelo máx.: {stats['peak_inflight_frames']} fotogramas "
+          f"(~{stats['peak_inflight_bytes'] / (1024 * 1024):.1f} MiB).")
+
+
+def _build_frame_selector(source_fps: float, target_fps: float = None, segments: list = None):
+    """
+    Crea el selector de fotogramas del proxy: dentro de los tramos indicados (o todo el video),
+    conserva el primer fotograma en o después de cada marca de tiempo de `target_fps`.
+    Las marcas se calculan sobre el tiempo del original, así que los timestamps no se desplazan.
+    """
+    frame_step = source_fps / target_fps if target_fps and target_fps < source_fps else 1.0
+    state = {"next_tick": 0.0, "segment": 0}
+
+    def select(index: int) -> bool:
+        if segments:
+            while state["segment"] < len(segments) and index >= segments[state["segment"]][1]:
+                state["segment"] += 1
+            if state["segment"] >= len(segments) or index < segments[state["segment"]][0]:
+                return False
+        if index + 1e-6 < state["next_tick"]:
+            return False
+        state["next_tick"] = (int(index / frame_step + 1e-6) + 1) * frame_step
+        return True
+
+    return select
+
+def build_analysis_proxy(input_path: str, output_path: str, target_width: int = None,
+                         target_fps: float = PROXY_TARGET_FPS, fourcc: str = PROXY_FOURCC, segments: list = None):
+    """
+    Genera el proxy de análisis que se envía al modelo: reducido a `target_width`, a `target_fps`
+    fotogramas por segundo, con el codec `fourcc` y sin pista de audio (OpenCV solo escribe video,
+    así que el proxy se genera siempre, aunque el original ya sea pequeño).
+
+    Args:
+        segments: (Opcional) Tramos [inicio, fin) en fotogramas del original a conservar (ej: detección de escenas).
+
+    Returns:
+        Una tupla (mapping, error). El mapping relaciona cada fotograma del proxy con su fotograma
+        del original: source_fps, proxy_fps, source_frames, width, height, original_duration_ms,
+        proxy_duration_ms.
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        return None, f"No se pudo abrir el video '{input_path}'."
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if not source_fps or source_fps <= 0:
+        return None, f"fps inválidos en '{input_path}' ({source_fps})."
+
+    proxy_fps = target_fps if target_fps and target_fps < source_fps else source_fps
+    selector = _build_frame_selector(source_fps, proxy_fps, segments)
+    stats = transcode_video(input_path, output_path, target_width, frame_selector=selector,
+                            stop_after=segments[-1][1] if segments else None, output_fps=proxy_fps, fourcc=fourcc)
+    if stats is None:
+        return None, f"No se pudo generar el proxy de análisis de '{input_path}'."
+    if not stats["source_frames"]:
+        return None, f"El proxy de análisis de '{input_path}' quedó vacío."
+    print_transcode_stats(stats, "Proxy")
+
+    mapping = {
+        "source_fps": source_fps,
+        "proxy_fps": proxy_fps,
+        "source_frames": stats["source_frames"],
+        "width": stats["width"],
+        "height": stats["height"],
+        "original_duration_ms": int(max(total_frames, stats["frames_in"]) / source_fps * 1000),
+        "proxy_duration_ms": int(len(stats["source_frames"]) / proxy_fps * 1000),
+    }
+    print(f"[Proxy] {mapping['original_duration_ms'] / 1000:.0f}s a {source_fps:.1f} fps -> "
+          f"{len(stats['source_frames'])} fotogramas a {proxy_fps:.1f} fps, sin audio, codec '{fourcc}'.")
+    return mapping, None
+
+def proxy_to_original_ms(proxy_ms: int, mapping: dict) -> int:
+    """
+    Traduce un timestamp del proxy al tiempo del video original.
+
+    El fotograma del proxy visible en `proxy_ms` es exactamente un fotograma del original; el
+    desplazamiento dentro de ese fotograma se conserva sin pasar al siguiente fotograma conservado.
+    """
+    source_frames = mapping["source_frames"]
+    frame_ms = 1000.0 / mapping["proxy_fps"]
+    index = min(max(0, int(proxy_ms / frame_ms)), len(source_frames) - 1)
+    source_ms = [source_frames[i] / mapping["source_fps"] * 1000.0 for i in (index, min(index + 1, len(source_frames) - 1))]
+    offset = min(max(0.0, proxy_ms - index * frame_ms), frame_ms)
+    if index + 1 < len(source_frames):
+        offset = min(offset, source_ms[1] - source_ms[0])
+    return min(int(source_ms[0] + offset), mapping["original_duration_ms"])
+
+def remap_step_timestamp(step: dict, mapping: dict) -> dict:
+    """Devuelve una copia del paso con `timestamp_ms` traducido al video original."""
+    remapped = dict(step)
+    if remapped.get("timestamp_ms") is not None:
+        try:
+            remapped["timestamp_ms"] = proxy_to_original_ms(int(remapped["timestamp_ms"]), mapping)
+        except (TypeError, ValueError):
+            pass
+    return remapped
+
+def remap_analysis_timestamps(analysis_data: dict, mapping: dict) -> dict:
+    """Traduce al tiempo original todos los pasos de 'section_3_3_detailed_steps' (modifica `analysis_data`)."""
+    steps = analysis_data.get("section_3_3_detailed_steps") or []
+    analysis_data["section_3_3_detailed_steps"] = [remap_step_timestamp(step, mapping) for step in steps]
+    return analysis_data